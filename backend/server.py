@@ -1,9 +1,13 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Request
+from fastapi.responses import Response, JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 import random
@@ -13,17 +17,30 @@ from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from concurrent.futures import ThreadPoolExecutor
 import jwt
 import bcrypt
 import httpx
 import shutil
 import json
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 import re
+import asyncio
+import bisect
+import base64
+import unicodedata
+import gzip
+import hashlib
+import time
 
 # Web Push
 try:
-    from pywebpush import webpush, WebPushException
+    from pywebpush import WebPusher
+    from py_vapid import Vapid
+    import requests
     WEBPUSH_AVAILABLE = True
 except ImportError:
     WEBPUSH_AVAILABLE = False
@@ -71,6 +88,7 @@ SMTP_FROM = os.environ.get('SMTP_FROM', 'info@lamaisonettepaestum.com')
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.utils import format_datetime, parsedate_to_datetime
 
 async def send_booking_notification(booking: dict, unit_name: str = "La Maisonette"):
     """Send booking notification to admin"""
@@ -156,84 +174,224 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-async def send_notification_email(subject: str, body: str, to_email: str = None):
-    """
-    Invia email di notifica alla struttura.
-    Se SMTP non configurato, logga solo il messaggio.
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 20))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 6))
+EMAIL_RETRY_BASE_SECONDS = 30
+EMAIL_RETRY_MAX_SECONDS = 3600
+EMAIL_POLL_SECONDS = 30
+# Un messaggio "sending" torna reclamabile da qualsiasi worker solo dopo questo tempo
+# (più di un lotto intero con timeout SMTP di 30s a messaggio)
+EMAIL_CLAIM_LEASE_SECONDS = int(os.environ.get('EMAIL_CLAIM_LEASE_SECONDS', 900))
+SMTP_IDLE_SECONDS = 60
+
+def build_email_message(to_email: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = SMTP_FROM
+    msg['To'] = to_email
+    
+    # HTML email body
+    html_body = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+        <div style="background: #C5A059; padding: 20px; text-align: center;">
+            <h1 style="color: white; margin: 0;">La Maisonette di Paestum</h1>
+        </div>
+        <div style="padding: 20px; background: #f9f9f7;">
+            {body}
+        </div>
+        <div style="padding: 10px; text-align: center; font-size: 12px; color: #666;">
+            Questa è una notifica automatica dal sistema di gestione.
+        </div>
+    </body>
+    </html>
     """
-    target_email = to_email or NOTIFY_EMAIL
     
-    if not SMTP_HOST or not SMTP_USER:
-        # SMTP not configured - log only
-        logging.info(f"[EMAIL NOT SENT - SMTP not configured] To: {target_email}, Subject: {subject}")
-        # Store in database for admin to see
-        await db.email_queue.insert_one({
+    msg.attach(MIMEText(body, 'plain'))
+    msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+class EmailOutbox:
+    """
+    Coda email persistente su db.email_queue.
+    Gli handler inseriscono il messaggio e ritornano subito; un worker in background
+    spedisce a lotti su una connessione SMTP persistente (in un thread dedicato,
+    smtplib è bloccante) e ritenta con backoff esponenziale.
+    Stati: pending -> sending -> sent | failed (dopo EMAIL_MAX_ATTEMPTS) | skipped (SMTP non configurato).
+    Il passaggio a "sending" registra claimed_at: un messaggio rimasto "sending" per più di
+    EMAIL_CLAIM_LEASE_SECONDS (processo interrotto) viene ripreso, senza toccare quelli che
+    un altro worker sta ancora spedendo.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+        self._smtp = None
+        self._smtp_used_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+
+    async def enqueue(self, subject: str, body: str, to_email: str = None) -> bool:
+        target_email = to_email or NOTIFY_EMAIL
+        now = datetime.now(timezone.utc).isoformat()
+        doc = {
             "id": str(uuid.uuid4()),
             "to": target_email,
             "subject": subject,
             "body": body,
             "sent": False,
-            "error": "SMTP non configurato",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        return False
-    
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = SMTP_FROM
-        msg['To'] = target_email
-        
-        # HTML email body
-        html_body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-            <div style="background: #C5A059; padding: 20px; text-align: center;">
-                <h1 style="color: white; margin: 0;">La Maisonette di Paestum</h1>
-            </div>
-            <div style="padding: 20px; background: #f9f9f7;">
-                {body}
-            </div>
-            <div style="padding: 10px; text-align: center; font-size: 12px; color: #666;">
-                Questa è una notifica automatica dal sistema di gestione.
-            </div>
-        </body>
-        </html>
-        """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        msg.attach(MIMEText(html_body, 'html'))
-        
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        }
+        if not SMTP_HOST or not SMTP_USER:
+            # SMTP not configured - log only, stored for admin to see
+            logging.info(f"[EMAIL NOT SENT - SMTP not configured] To: {target_email}, Subject: {subject}")
+            doc.update({"status": "skipped", "error": "SMTP non configurato"})
+            await db.email_queue.insert_one(doc)
+            return False
+        await db.email_queue.insert_one(doc)
+        self._wakeup.set()
+        return True
+
+    # --- lato thread SMTP ---
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._smtp_used_at > SMTP_IDLE_SECONDS:
+            self._close()
+        if self._smtp is not None:
+            try:
+                self._smtp.noop()
+            except smtplib.SMTPException:
+                self._close()
+        if self._smtp is None:
+            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
             server.starttls()
             server.login(SMTP_USER, SMTP_PASSWORD)
-            server.sendmail(SMTP_FROM, target_email, msg.as_string())
-        
-        # Log success
-        await db.email_queue.insert_one({
-            "id": str(uuid.uuid4()),
-            "to": target_email,
-            "subject": subject,
-            "body": body,
-            "sent": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        
-        logging.info(f"[EMAIL SENT] To: {target_email}, Subject: {subject}")
-        return True
+            self._smtp = server
+        self._smtp_used_at = time.monotonic()
+        return self._smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _send_batch(self, messages: list) -> list:
+        """Invia i messaggi su una sola connessione; restituisce un errore (o None) per messaggio"""
+        results = []
+        for msg in messages:
+            try:
+                self._connection().sendmail(SMTP_FROM, msg['To'], msg.as_string())
+                results.append(None)
+            except Exception as e:
+                # Connessione probabilmente compromessa: riaperta al prossimo messaggio
+                self._close()
+                results.append(str(e))
+        return results
+
+    # --- lato event loop ---
+
+    async def _claim_batch(self) -> list:
+        docs = []
+        now = datetime.now(timezone.utc)
+        expired = (now - timedelta(seconds=EMAIL_CLAIM_LEASE_SECONDS)).isoformat()
+        now = now.isoformat()
+        while len(docs) < EMAIL_BATCH_SIZE:
+            doc = await db.email_queue.find_one_and_update(
+                {"$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    {"status": "sending", "claimed_at": {"$lte": expired}},
+                    {"status": "sending", "claimed_at": {"$exists": False}},  # presi prima dei lease
+                ]},
+                {"$set": {"status": "sending", "claimed_at": now}},
+                projection={"_id": 0},
+                sort=[("next_attempt_at", 1)]
+            )
+            if not doc:
+                break
+            doc["claimed_at"] = now
+            docs.append(doc)
+        return docs
+
+    async def _deliver(self, docs: list):
+        messages = [build_email_message(d["to"], d["subject"], d["body"]) for d in docs]
+        loop = asyncio.get_running_loop()
+        errors = await loop.run_in_executor(self._executor, self._send_batch, messages)
         
-    except Exception as e:
-        logging.error(f"[EMAIL ERROR] {str(e)}")
-        await db.email_queue.insert_one({
-            "id": str(uuid.uuid4()),
-            "to": target_email,
-            "subject": subject,
-            "body": body,
-            "sent": False,
-            "error": str(e),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        return False
+        for doc, error in zip(docs, errors):
+            now = datetime.now(timezone.utc)
+            if error is None:
+                self.sent += 1
+                logging.info(f"[EMAIL SENT] To: {doc['to']}, Subject: {doc['subject']}")
+                await db.email_queue.update_one(
+                    {"id": doc["id"], "claimed_at": doc["claimed_at"]},
+                    {"$set": {"status": "sent", "sent": True, "sent_at": now.isoformat()}, "$unset": {"error": ""}}
+                )
+                continue
+            attempts = doc.get("attempts", 0) + 1
+            logging.error(f"[EMAIL ERROR] To: {doc['to']} (tentativo {attempts}): {error}")
+            update = {"attempts": attempts, "error": error}
+            if attempts >= EMAIL_MAX_ATTEMPTS:
+                self.failed += 1
+                update["status"] = "failed"
+            else:
+                delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+                update["status"] = "pending"
+                update["next_attempt_at"] = (now + timedelta(seconds=delay)).isoformat()
+            # Solo se il lease è ancora nostro: un messaggio ripreso da un altro worker resta suo
+            await db.email_queue.update_one({"id": doc["id"], "claimed_at": doc["claimed_at"]}, {"$set": update})
+
+    async def _run(self):
+        while True:
+            try:
+                docs = await self._claim_batch()
+                if docs:
+                    await self._deliver(docs)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"[EMAIL OUTBOX] worker error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=EMAIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+
+    async def stats(self) -> dict:
+        counts = {}
+        async for row in db.email_queue.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"] or "legacy"] = row["count"]
+        return {"running": self._task is not None, "sent": self.sent, "failed": self.failed, "queue": counts}
+
+email_outbox = EmailOutbox()
+
+async def send_notification_email(subject: str, body: str, to_email: str = None):
+    """
+    Accoda un'email di notifica (di default alla struttura) nell'outbox.
+    L'invio avviene in background; se SMTP non configurato, logga solo il messaggio.
+    """
+    return await email_outbox.enqueue(subject, body, to_email)
 
 def generate_booking_code():
     """Genera un codice prenotazione univoco es: MDP-ABC123"""
@@ -389,6 +547,7 @@ class ICalFeedCreate(BaseModel):
     nome: str  # es. "Booking.com", "Airbnb"
     url: str  # URL del feed iCal
     attivo: bool = True
+    intervallo_minuti: Optional[int] = Field(default=None, ge=5)  # sincronizzazione automatica, default globale
 
 class ICalFeedResponse(BaseModel):
     id: str
@@ -396,8 +555,10 @@ class ICalFeedResponse(BaseModel):
     nome: str
     url: str
     attivo: bool
+    intervallo_minuti: Optional[int] = None
     ultima_sincronizzazione: Optional[str] = None
     eventi_importati: int = 0
+    eventi_trovati: int = 0
     created_at: str
 
 class ICalSyncResult(BaseModel):
@@ -405,6 +566,9 @@ class ICalSyncResult(BaseModel):
     feed_nome: str
     eventi_trovati: int
     nuovi_blocchi: int
+    blocchi_aggiornati: int = 0
+    blocchi_rimossi: int = 0
+    non_modificato: bool = False  # 304 dal server remoto
     errore: Optional[str] = None
 
 # Prenotazioni
@@ -434,6 +598,16 @@ class AdminBookingCreate(BaseModel):
     prezzo_totale: Optional[float] = None  # Admin può impostare prezzo custom
     status: str = "confirmed"  # Admin può creare direttamente confermate
 
+class QuoteRequestItem(BaseModel):
+    unit_id: str
+    data_arrivo: str
+    data_partenza: str
+    num_ospiti: int = Field(default=2, ge=1, le=5)
+
+class QuoteBatchRequest(BaseModel):
+    """Richiesta di preventivi multipli (es. heatmap calendario)"""
+    items: List[QuoteRequestItem] = Field(max_length=200)
+
 class BookingResponse(BaseModel):
     id: str
     unit_id: str
@@ -731,11 +905,85 @@ class NotificationResponse(BaseModel):
 
 # ==================== AUTH HELPERS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed.encode())
+class PasswordHasher:
+    """
+    bcrypt eseguito in un pool di thread dedicato e limitato, così hash e verifiche
+    (~100-300 ms ciascuno) non bloccano l'event loop. Oltre max_queue richieste
+    in attesa si risponde 503 invece di accodare all'infinito.
+    """
+
+    def __init__(self, rounds: int, workers: int, max_queue: int):
+        self.rounds = rounds
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.workers = workers
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_ms = 0.0
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server occupato, riprova tra poco")
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_ms += (time.perf_counter() - started) * 1000
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=self.rounds)).decode()
+
+    @staticmethod
+    def _verify(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self._verify, password, hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """True se l'hash ($2b$<cost>$...) usa un costo diverso da quello configurato"""
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_ms": round(self.total_ms / self.completed, 1) if self.completed else None
+        }
+
+password_hasher = PasswordHasher(
+    BCRYPT_ROUNDS,
+    int(os.environ.get('BCRYPT_WORKERS', 2)),
+    int(os.environ.get('BCRYPT_MAX_QUEUE', 64))
+)
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.hash(password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await password_hasher.verify(password, hashed)
 
 def create_token(guest_id: str, is_admin: bool = False) -> str:
     payload = {
@@ -745,26 +993,101 @@ def create_token(guest_id: str, is_admin: bool = False) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+class PrincipalCache:
+    """
+    Cache LRU con scadenza dei documenti guest degli utenti autenticati, per id.
+    Va invalidata da ogni scrittura su db.guests; la TTL limita comunque
+    la durata di un dato non aggiornato.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # guest_id -> (scadenza, guest)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guest_id: str) -> Optional[dict]:
+        entry = self._entries.get(guest_id)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(guest_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(guest_id)
+        self.hits += 1
+        return dict(entry[1])
+
+    def put(self, guest: dict):
+        self._entries[guest["id"]] = (time.monotonic() + self.ttl_seconds, dict(guest))
+        self._entries.move_to_end(guest["id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, guest_id: Optional[str] = None):
+        if guest_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(guest_id, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits, "misses": self.misses}
+
+principal_cache = PrincipalCache(
+    int(os.environ.get('PRINCIPAL_CACHE_SIZE', 1000)),
+    int(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 60))
+)
+
+def decode_token_claims(token: str) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        guest_id = payload.get("sub")
-        if not guest_id:
-            raise HTTPException(status_code=401, detail="Token non valido")
-        guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
-        if not guest:
-            raise HTTPException(status_code=401, detail="Utente non trovato")
-        return guest
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token scaduto")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Token non valido")
+    if not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Token non valido")
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    guest_id = decode_token_claims(credentials.credentials)["sub"]
+    guest = principal_cache.get(guest_id)
+    if guest:
+        return guest
+    guest = await db.guests.find_one({"id": guest_id}, {"_id": 0})
+    if not guest:
+        raise HTTPException(status_code=401, detail="Utente non trovato")
+    principal_cache.put(guest)
+    return guest
+
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Solo i dati del token (id, is_admin), senza leggere il guest dal DB.
+    Per endpoint che usano soltanto l'id dell'utente autenticato.
+    """
+    payload = decode_token_claims(credentials.credentials)
+    return {"id": payload["sub"], "is_admin": payload.get("is_admin", False)}
 
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if not current_user.get("is_admin"):
         raise HTTPException(status_code=403, detail="Accesso non autorizzato")
     return current_user
 
+@api_router.get("/admin/email-outbox/stats")
+async def admin_get_email_outbox_stats(admin: dict = Depends(get_admin_user)):
+    """Stato della coda email (messaggi per stato, inviati/falliti dal riavvio)"""
+    return await email_outbox.stats()
+
+@api_router.get("/admin/password-hasher/stats")
+async def admin_get_password_hasher_stats(admin: dict = Depends(get_admin_user)):
+    """Metriche del pool bcrypt (richieste in corso, rifiutate, tempo medio)"""
+    return password_hasher.stats()
+
+@api_router.get("/admin/principal-cache/stats")
+async def admin_get_principal_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Statistiche della cache degli utenti autenticati"""
+    return principal_cache.stats()
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register")
@@ -781,7 +1104,7 @@ async def register(data: GuestCreate):
         "nome": data.nome,
         "cognome": data.cognome,
         "email": data.email,
-        "password_hash": hash_password(data.password),
+        "password_hash": await hash_password(data.password),
         "telefono": data.telefono,
         "punti_fedelta": 0,
         "is_admin": False,
@@ -789,7 +1112,10 @@ async def register(data: GuestCreate):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
+    guest_doc.update(guest_search_fields(guest_doc))
+    
     await db.guests.insert_one(guest_doc)
+    await badge_counters.guest_created()
     token = create_token(guest_id)
     
     # Send notification email to admin for new registration
@@ -848,9 +1174,18 @@ async def register(data: GuestCreate):
 @api_router.post("/auth/login")
 async def login(data: GuestLogin):
     guest = await db.guests.find_one({"email": data.email}, {"_id": 0})
-    if not guest or not verify_password(data.password, guest["password_hash"]):
+    if not guest or not await verify_password(data.password, guest["password_hash"]):
         raise HTTPException(status_code=401, detail="Credenziali non valide")
     
+    # Costo bcrypt cambiato: aggiorna l'hash ora che abbiamo la password in chiaro
+    if password_hasher.needs_rehash(guest["password_hash"]):
+        await db.guests.update_one(
+            {"id": guest["id"]},
+            {"$set": {"password_hash": await hash_password(data.password)}}
+        )
+        principal_cache.invalidate(guest["id"])
+        password_hasher.rehashed += 1
+    
     token = create_token(guest["id"], guest.get("is_admin", False))
     
     return {
@@ -912,18 +1247,238 @@ async def delete_account(current_user: dict = Depends(get_current_user)):
     
     # Elimina i check-in dell'utente
     await db.checkins.delete_many({"user_id": user_id})
+    await checkin_view.discard({"source": "form", "user_id": user_id})
     
     # Elimina le prenotazioni associate
+    booking_ids = [b["id"] async for b in db.bookings.find({"user_id": user_id}, {"_id": 0, "id": 1})]
     await db.bookings.delete_many({"user_id": user_id})
+    availability_index.invalidate()
+    await occupancy.discard_bookings(booking_ids)
+    await night_ledger.release_many(booking_ids)
+    await checkin_view.sync_bookings(booking_ids)
+    await badge_counters.reconcile()
     
     # Elimina l'utente
     result = await db.users.delete_one({"id": user_id})
+    principal_cache.invalidate(user_id)
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Utente non trovato")
     
     return {"message": f"Account {user_email} eliminato con successo"}
 
+# ==================== PAGINATION ====================
+
+# Paginazione keyset degli elenchi admin: ordinamento (created_at, id) decrescente,
+# cursore opaco con la chiave dell'ultima riga, proiezione dei campi e conteggio su richiesta.
+# Il corpo resta una lista; cursore successivo e totale viaggiano negli header.
+ADMIN_MAX_PAGE_SIZE = 500
+
+def encode_cursor(created_at: Optional[str], doc_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, doc_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+    if not isinstance(doc_id, str) or not (created_at is None or isinstance(created_at, str)):
+        raise HTTPException(status_code=400, detail="Cursore non valido")
+    return created_at, doc_id
+
+def fields_projection(fields: Optional[str], hidden: tuple = ()) -> dict:
+    """Proiezione da "campo1,campo2"; id e created_at servono sempre al cursore"""
+    projection = {"_id": 0}
+    if fields:
+        for field in {"id", "created_at", *(f.strip() for f in fields.split(","))}:
+            if field and field not in hidden and not field.startswith("$"):
+                projection[field] = 1
+    else:
+        projection.update({field: 0 for field in hidden})
+    return projection
+
+async def keyset_page(collection, query: dict, limit: int, cursor: Optional[str] = None,
+                      projection: Optional[dict] = None) -> tuple:
+    """Una pagina di al massimo limit righe; ritorna (righe, cursore successivo o None)"""
+    limit = max(1, min(limit, ADMIN_MAX_PAGE_SIZE))
+    if cursor:
+        created_at, doc_id = decode_cursor(cursor)
+        if created_at is None:
+            # Documenti senza created_at: in ordine decrescente vengono per ultimi
+            after = {"created_at": None, "id": {"$lt": doc_id}}
+        else:
+            after = {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": doc_id}},
+                {"created_at": None}
+            ]}
+        query = {"$and": [query, after]} if query else after
+    docs = await collection.find(query, projection or {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1].get("created_at"), docs[-1].get("id", ""))
+    return docs, next_cursor
+
+async def page_response(collection, query: dict, limit: int, cursor: Optional[str] = None,
+                        fields: Optional[str] = None, count: bool = False,
+                        hidden: tuple = (), model=None, enrich=None) -> JSONResponse:
+    """
+    Risposta paginata comune agli elenchi admin. La JSONResponse salta il response_model
+    della route: le route che ne hanno uno lo passano come model, così le righe complete
+    passano dal modello e quelle proiettate con fields mantengono solo i suoi campi.
+    """
+    docs, next_cursor = await keyset_page(collection, query, limit, cursor, fields_projection(fields, hidden))
+    if enrich:
+        docs = await enrich(docs)
+    if model and fields:
+        docs = [{k: v for k, v in d.items() if k in model.model_fields} for d in docs]
+    elif model:
+        docs = [model(**d).model_dump() for d in docs]
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if count:
+        headers["X-Total-Count"] = str(await collection.count_documents(query))
+    return JSONResponse(content=jsonable_encoder(docs), headers=headers)
+
+# ==================== CHECK-IN VIEW ====================
+
+# Campi della prenotazione incorporati in ogni riga della vista
+CHECKIN_BOOKING_FIELDS = [
+    "id", "codice_prenotazione", "nome_ospite", "email_ospite", "telefono_ospite",
+    "data_arrivo", "data_partenza", "num_ospiti", "unit_id", "status"
+]
+
+class CheckinView:
+    """
+    Proiezione denormalizzata db.checkin_view: un documento per check-in (form e online)
+    con i campi del check-in, la prenotazione essenziale, il nome ospite e l'unità già
+    incorporati. Aggiornata ad ogni scrittura su checkins, online_checkins e sulle
+    prenotazioni collegate, così gli elenchi admin sono una sola query indicizzata.
+    """
+
+    SOURCES = {"form": "checkins", "online": "online_checkins"}
+
+    def _build(self, source: str, checkin: dict, booking: Optional[dict], guest: Optional[dict]) -> dict:
+        doc = {k: v for k, v in checkin.items() if k != "_id"}
+        doc["source"] = source
+        doc["booking"] = {f: booking.get(f) for f in CHECKIN_BOOKING_FIELDS} if booking else None
+        if booking:
+            # I check-in online non hanno date proprie: le prende dalla prenotazione
+            for field in ("data_arrivo", "data_partenza", "num_ospiti", "codice_prenotazione"):
+                if not doc.get(field):
+                    doc[field] = booking.get(field)
+        if source == "online":
+            doc.setdefault("note", checkin.get("admin_note", ""))
+            if checkin.get("validated_by_admin"):
+                doc["admin_validated"] = True
+            if booking:
+                doc["guest_nome"] = booking.get("nome_ospite", "")
+        elif guest:
+            doc["guest_nome"] = f"{guest.get('nome', '')} {guest.get('cognome', '')}"
+        doc["unit_id"] = booking.get("unit_id") if booking else None
+        doc["unit_nome"] = None
+        return doc
+
+    async def _store(self, docs: list):
+        await unit_names.attach([d for d in docs if d.get("unit_id")])
+        for doc in docs:
+            await db.checkin_view.replace_one({"id": doc["id"]}, doc, upsert=True)
+
+    async def put(self, source: str, checkin: dict, booking: Optional[dict], guest: Optional[dict] = None):
+        """Scrive la riga quando il chiamante ha già check-in, prenotazione e ospite"""
+        await self._store([self._build(source, checkin, booking, guest)])
+
+    async def sync_checkin(self, source: str, checkin_id: str):
+        checkin = await db[self.SOURCES[source]].find_one({"id": checkin_id}, {"_id": 0})
+        if not checkin:
+            await db.checkin_view.delete_one({"id": checkin_id})
+            return
+        booking = await db.bookings.find_one({"id": checkin.get("booking_id")}, {"_id": 0}) if checkin.get("booking_id") else None
+        guest = None
+        if source == "form" and checkin.get("guest_id"):
+            guest = await db.guests.find_one({"id": checkin["guest_id"]}, {"_id": 0, "nome": 1, "cognome": 1})
+        await self.put(source, checkin, booking, guest)
+
+    async def sync_bookings(self, booking_ids: list):
+        """Riallinea le righe dei check-in collegati alle prenotazioni (modificate o eliminate)"""
+        if not booking_ids:
+            return
+        query = {"booking_id": {"$in": booking_ids}}
+        present = set()
+        for source, collection in self.SOURCES.items():
+            async for checkin in db[collection].find(query, {"_id": 0, "id": 1}):
+                present.add(checkin["id"])
+                await self.sync_checkin(source, checkin["id"])
+        await db.checkin_view.delete_many({**query, "id": {"$nin": list(present)}})
+
+    async def sync_booking(self, booking_id: str):
+        await self.sync_bookings([booking_id])
+
+    async def sync_guest(self, guest_id: str):
+        """Nome ospite cambiato: aggiorna le righe dei check-in da form"""
+        guest = await db.guests.find_one({"id": guest_id}, {"_id": 0, "nome": 1, "cognome": 1})
+        if guest:
+            await db.checkin_view.update_many(
+                {"source": "form", "guest_id": guest_id},
+                {"$set": {"guest_nome": f"{guest.get('nome', '')} {guest.get('cognome', '')}"}}
+            )
+
+    async def sync_unit(self, unit_id: str, nome: Optional[str]):
+        await db.checkin_view.update_many({"unit_id": unit_id}, {"$set": {"unit_nome": nome}})
+
+    async def update_fields(self, checkin_id: str, fields: dict):
+        await db.checkin_view.update_one({"id": checkin_id}, {"$set": fields})
+
+    async def discard(self, query: dict):
+        await db.checkin_view.delete_many(query)
+
+    async def rebuild(self) -> int:
+        """
+        Ricostruisce la vista caricando prenotazioni e ospiti a lotti ($in), senza svuotarla:
+        sostituzione (upsert) delle righe attese, poi rimozione delle sole righe preesistenti
+        non più valide. Gli elenchi restano leggibili e i check-in arrivati nel frattempo restano.
+        """
+        previous = {d["id"] async for d in db.checkin_view.find({}, {"_id": 0, "id": 1})}
+        docs = []
+        for source, collection in self.SOURCES.items():
+            checkins = await db[collection].find({}, {"_id": 0}).to_list(None)
+            booking_ids = list({c["booking_id"] for c in checkins if c.get("booking_id")})
+            guest_ids = list({c["guest_id"] for c in checkins if source == "form" and c.get("guest_id")})
+            bookings = {b["id"]: b async for b in db.bookings.find({"id": {"$in": booking_ids}}, {"_id": 0})}
+            guests = {g["id"]: g async for g in db.guests.find(
+                {"id": {"$in": guest_ids}}, {"_id": 0, "id": 1, "nome": 1, "cognome": 1})}
+            for checkin in checkins:
+                docs.append(self._build(source, checkin, bookings.get(checkin.get("booking_id")),
+                                        guests.get(checkin.get("guest_id"))))
+        await unit_names.attach([d for d in docs if d.get("unit_id")])
+        if docs:
+            await db.checkin_view.bulk_write([ReplaceOne({"id": doc["id"]}, doc, upsert=True) for doc in docs],
+                                             ordered=False)
+        stale = list(previous - {doc["id"] for doc in docs})
+        if stale:
+            await db.checkin_view.delete_many({"id": {"$in": stale}})
+        return len(docs)
+
+    async def ensure_built(self):
+        """Primo avvio: costruisce la vista se è vuota ma esistono check-in"""
+        if await db.checkin_view.estimated_document_count() == 0 and (
+            await db.checkins.estimated_document_count() or await db.online_checkins.estimated_document_count()
+        ):
+            await self.rebuild()
+
+checkin_view = CheckinView()
+checkin_view_bootstrap_task = None
+
+@api_router.post("/admin/checkin-view/rebuild")
+async def admin_rebuild_checkin_view(admin: dict = Depends(get_admin_user)):
+    """Ricostruisce la vista unificata dei check-in"""
+    rows = await checkin_view.rebuild()
+    return {"message": "Vista check-in ricostruita", "righe": rows}
+
 # ==================== CHECK-IN ROUTES ====================
 
 @api_router.post("/checkin", response_model=CheckInResponse)
@@ -992,6 +1547,8 @@ async def create_checkin(data: CheckInCreate, current_user: dict = Depends(get_c
     }
     
     await db.checkins.insert_one(checkin_doc)
+    await checkin_view.put("form", checkin_doc, booking, current_user)
+    await track_status_change("checkins", checkin_doc["id"], None, checkin_doc["status"])
     
     # Aggiorna guest_id nella prenotazione se non già associato
     if not booking.get("guest_id"):
@@ -1023,39 +1580,11 @@ async def create_checkin(data: CheckInCreate, current_user: dict = Depends(get_c
     return CheckInResponse(**checkin_doc)
 
 @api_router.get("/checkin")
-async def get_my_checkins(current_user: dict = Depends(get_current_user)):
+async def get_my_checkins(current_user: dict = Depends(get_current_user),
+                          limit: int = 100, cursor: Optional[str] = None,
+                          fields: Optional[str] = None, count: bool = False):
     """Get all check-ins for the current user (form + online/validated)"""
-    # Get checkins from form submissions
-    checkins = await db.checkins.find(
-        {"guest_id": current_user["id"]}, 
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    for c in checkins:
-        c["source"] = "form"
-    
-    # Get online checkins (including manually validated)
-    online_checkins = await db.online_checkins.find(
-        {"guest_id": current_user["id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(100)
-    
-    # Enrich online checkins with booking data
-    for c in online_checkins:
-        c["source"] = "online"
-        booking = await db.bookings.find_one({"id": c.get("booking_id")}, {"_id": 0})
-        if booking:
-            c["data_arrivo"] = booking.get("data_arrivo", "")
-            c["data_partenza"] = booking.get("data_partenza", "")
-            c["num_ospiti"] = booking.get("num_ospiti", 1)
-            c["codice_prenotazione"] = booking.get("codice_prenotazione", "")
-            c["note"] = c.get("admin_note", "")
-    
-    # Combine and sort by created_at
-    all_checkins = checkins + online_checkins
-    all_checkins.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-    
-    return all_checkins
+    return await page_response(db.checkin_view, {"guest_id": current_user["id"]}, limit, cursor, fields, count)
 
 @api_router.get("/checkin/active")
 async def get_active_checkin(current_user: dict = Depends(get_current_user)):
@@ -1167,10 +1696,11 @@ async def admin_upload_media(
     return media_doc
 
 @api_router.get("/admin/media")
-async def admin_get_media(admin: dict = Depends(get_admin_user)):
+async def admin_get_media(admin: dict = Depends(get_admin_user),
+                          limit: int = 500, cursor: Optional[str] = None,
+                          fields: Optional[str] = None, count: bool = False):
     """Get all media files"""
-    media = await db.media.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    return media
+    return await page_response(db.media, {}, limit, cursor, fields, count)
 
 @api_router.delete("/admin/media/{media_id}")
 async def admin_delete_media(media_id: str, admin: dict = Depends(get_admin_user)):
@@ -1658,6 +2188,7 @@ async def create_order(data: OrderCreate, current_user: dict = Depends(get_curre
     }
     
     await db.orders.insert_one(order_doc)
+    await track_status_change("ordini", order_doc["id"], None, order_doc["status"])
     return OrderResponse(**order_doc)
 
 @api_router.get("/orders/my", response_model=List[OrderResponse])
@@ -1722,6 +2253,7 @@ async def book_service(data: ServiceBookingCreate, current_user: dict = Depends(
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.service_bookings.insert_one(booking_doc)
+    await track_status_change("servizi", booking_doc["id"], None, booking_doc["status"])
     return ServiceBookingResponse(**booking_doc)
 
 @api_router.get("/services/bookings/my", response_model=List[ServiceBookingResponse])
@@ -1765,6 +2297,7 @@ async def redeem_points(data: LoyaltyRedeem, current_user: dict = Depends(get_cu
         {"id": current_user["id"]},
         {"$inc": {"punti_fedelta": -punti_usati}}
     )
+    principal_cache.invalidate(current_user["id"])
     
     # Create transaction
     transaction = {
@@ -1776,6 +2309,7 @@ async def redeem_points(data: LoyaltyRedeem, current_user: dict = Depends(get_cu
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.loyalty_transactions.insert_one(transaction)
+    admin_events.publish("fedelta", {"id": transaction["id"], "guest_id": current_user["id"], "descrizione": transaction["descrizione"]})
     
     return {
         "message": f"Riscattate {notti} notte/i omaggio",
@@ -1808,6 +2342,7 @@ async def redeem_reward(reward_id: str, current_user: dict = Depends(get_current
         {"id": current_user["id"]},
         {"$inc": {"punti_fedelta": -reward["punti_richiesti"]}}
     )
+    principal_cache.invalidate(current_user["id"])
     
     # Create transaction
     transaction = {
@@ -1832,6 +2367,7 @@ async def redeem_reward(reward_id: str, current_user: dict = Depends(get_current
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notification)
+    notification_created(current_user["id"])
     
     # Also notify admin about the redemption
     admin_notification = {
@@ -1846,6 +2382,7 @@ async def redeem_reward(reward_id: str, current_user: dict = Depends(get_current
     }
     # Store in a separate admin notifications collection or filter by type
     await db.admin_notifications.insert_one(admin_notification)
+    admin_events.publish("fedelta", {"id": transaction["id"], "guest_id": current_user["id"], "descrizione": transaction["descrizione"]})
     
     return {
         "message": f"Premio '{reward['nome']}' riscattato con successo!",
@@ -1855,86 +2392,183 @@ async def redeem_reward(reward_id: str, current_user: dict = Depends(get_current
 
 # ==================== NOTIFICATION ROUTES ====================
 
+# Stato di lettura: watermark per utente (tutto ciò che è stato creato fino a last_read_at è letto)
+# più marcatori espliciti solo per le notifiche lette singolarmente dopo il watermark.
+
+def user_notifications_query(user_id: str) -> dict:
+    return {"$or": [
+        {"destinatario_id": user_id},
+        {"destinatario_id": None}  # Broadcast notifications
+    ]}
+
+async def get_read_watermark(user_id: str) -> str:
+    state = await db.notification_watermarks.find_one({"user_id": user_id}, {"_id": 0, "last_read_at": 1})
+    return state["last_read_at"] if state else ""
+
+async def get_explicit_read_ids(user_id: str, watermark: str) -> list:
+    """Notifiche segnate come lette una per una e più recenti del watermark"""
+    reads = await db.notification_reads.find(
+        {"user_id": user_id, "$or": [
+            {"notification_created_at": {"$gt": watermark}},
+            {"notification_created_at": {"$exists": False}}  # marcatori precedenti al watermark
+        ]},
+        {"_id": 0, "notification_id": 1}
+    ).to_list(None)
+    return [r["notification_id"] for r in reads]
+
+async def count_unread_notifications(user_id: str) -> int:
+    watermark = await get_read_watermark(user_id)
+    query = {**user_notifications_query(user_id), "created_at": {"$gt": watermark}}
+    read_ids = await get_explicit_read_ids(user_id, watermark)
+    if read_ids:
+        query["id"] = {"$nin": read_ids}
+    return await db.notifications.count_documents(query)
+
+class UnreadCountCache:
+    """
+    Contatori di notifiche non lette per utente (LRU con scadenza).
+    Le notifiche personali incrementano la voce del destinatario; i broadcast
+    e le eliminazioni incrementano solo l'epoca globale, che rende obsolete
+    tutte le voci calcolate prima. La generazione scarta i conteggi calcolati
+    in parallelo a una modifica, così un ricalcolo lento non sovrascrive un
+    incremento già applicato.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.epoch = 0
+        self.generation = 0
+        self._entries = OrderedDict()  # user_id -> (scadenza, epoca, conteggio)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[int]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic() or entry[1] != self.epoch:
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, user_id: str, count: int, generation: Optional[int] = None):
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, self.epoch, count)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def increment(self, user_id: str):
+        self.generation += 1
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._entries[user_id] = (entry[0], entry[1], entry[2] + 1)
+
+    def invalidate(self, user_id: str):
+        self.generation += 1
+        self._entries.pop(user_id, None)
+
+    def bump_epoch(self):
+        self.generation += 1
+        self.epoch += 1
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "ttl_seconds": self.ttl_seconds,
+                "epoch": self.epoch, "hits": self.hits, "misses": self.misses}
+
+unread_counts = UnreadCountCache(
+    int(os.environ.get('UNREAD_CACHE_SIZE', 5000)),
+    int(os.environ.get('UNREAD_CACHE_TTL_SECONDS', 300))
+)
+
+def notification_created(destinatario_id: Optional[str]):
+    """Aggiorna i contatori dopo l'inserimento di una notifica"""
+    if destinatario_id:
+        unread_counts.increment(destinatario_id)
+    else:
+        unread_counts.bump_epoch()
+
 @api_router.get("/notifications", response_model=List[NotificationResponse])
-async def get_my_notifications(current_user: dict = Depends(get_current_user)):
+async def get_my_notifications(current_user: dict = Depends(get_current_claims)):
     """Get notifications for current user (personal + broadcast)"""
-    notifications = await db.notifications.find({
-        "$or": [
-            {"destinatario_id": current_user["id"]},
-            {"destinatario_id": None}  # Broadcast notifications
-        ]
-    }, {"_id": 0}).sort("created_at", -1).to_list(50)
+    notifications = await db.notifications.find(
+        user_notifications_query(current_user["id"]), {"_id": 0}
+    ).sort("created_at", -1).to_list(50)
     
     # Get read status for this user
-    read_ids = await db.notification_reads.find(
-        {"user_id": current_user["id"]},
-        {"notification_id": 1}
-    ).to_list(1000)
-    read_set = {r["notification_id"] for r in read_ids}
+    watermark = await get_read_watermark(current_user["id"])
+    reads = await db.notification_reads.find(
+        {"user_id": current_user["id"], "notification_id": {"$in": [n["id"] for n in notifications]}},
+        {"_id": 0, "notification_id": 1}
+    ).to_list(None)
+    read_set = {r["notification_id"] for r in reads}
     
     # Mark notifications as read or not
     for notif in notifications:
-        notif["letto"] = notif["id"] in read_set
+        notif["letto"] = notif.get("created_at", "") <= watermark or notif["id"] in read_set
     
     return notifications
 
 @api_router.get("/notifications/unread-count")
-async def get_unread_count(current_user: dict = Depends(get_current_user)):
+async def get_unread_count(current_user: dict = Depends(get_current_claims)):
     """Get count of unread notifications"""
-    # Get all notification IDs for this user
-    all_notifications = await db.notifications.find({
-        "$or": [
-            {"destinatario_id": current_user["id"]},
-            {"destinatario_id": None}
-        ]
-    }, {"id": 1}).to_list(1000)
-    all_ids = {n["id"] for n in all_notifications}
-    
-    # Get read notification IDs
-    read_ids = await db.notification_reads.find(
-        {"user_id": current_user["id"]},
-        {"notification_id": 1}
-    ).to_list(1000)
-    read_set = {r["notification_id"] for r in read_ids}
-    
-    unread_count = len(all_ids - read_set)
-    return {"count": unread_count}
+    count = unread_counts.get(current_user["id"])
+    if count is None:
+        generation = unread_counts.generation
+        count = await count_unread_notifications(current_user["id"])
+        unread_counts.put(current_user["id"], count, generation)
+    return {"count": count}
 
 @api_router.post("/notifications/{notification_id}/read")
-async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
+async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_claims)):
     """Mark a notification as read"""
     # Check if notification exists
-    notif = await db.notifications.find_one({"id": notification_id})
+    notif = await db.notifications.find_one({"id": notification_id}, {"_id": 0, "created_at": 1})
     if not notif:
         raise HTTPException(status_code=404, detail="Notifica non trovata")
     
+    # Già coperta dal watermark: nessun marcatore da scrivere
+    if notif.get("created_at", "") <= await get_read_watermark(current_user["id"]):
+        return {"message": "Notifica segnata come letta"}
+    
     # Add to reads (upsert to avoid duplicates)
     await db.notification_reads.update_one(
         {"user_id": current_user["id"], "notification_id": notification_id},
-        {"$set": {"user_id": current_user["id"], "notification_id": notification_id, "read_at": datetime.now(timezone.utc).isoformat()}},
+        {"$set": {
+            "user_id": current_user["id"],
+            "notification_id": notification_id,
+            "notification_created_at": notif.get("created_at", ""),
+            "read_at": datetime.now(timezone.utc).isoformat()
+        }},
         upsert=True
     )
+    unread_counts.invalidate(current_user["id"])
     return {"message": "Notifica segnata come letta"}
 
 @api_router.post("/notifications/read-all")
-async def mark_all_notifications_read(current_user: dict = Depends(get_current_user)):
+async def mark_all_notifications_read(current_user: dict = Depends(get_current_claims)):
     """Mark all notifications as read"""
-    notifications = await db.notifications.find({
-        "$or": [
-            {"destinatario_id": current_user["id"]},
-            {"destinatario_id": None}
-        ]
-    }, {"id": 1}).to_list(1000)
-    
-    for notif in notifications:
-        await db.notification_reads.update_one(
-            {"user_id": current_user["id"], "notification_id": notif["id"]},
-            {"$set": {"user_id": current_user["id"], "notification_id": notif["id"], "read_at": datetime.now(timezone.utc).isoformat()}},
-            upsert=True
-        )
+    now = datetime.now(timezone.utc).isoformat()
+    await db.notification_watermarks.update_one(
+        {"user_id": current_user["id"]},
+        {"$set": {"user_id": current_user["id"], "last_read_at": now}},
+        upsert=True
+    )
+    # I marcatori espliciti ora sono coperti dal watermark
+    await db.notification_reads.delete_many({"user_id": current_user["id"]})
+    unread_counts.invalidate(current_user["id"])
+    unread_counts.put(current_user["id"], 0, unread_counts.generation)
     
     return {"message": "Tutte le notifiche segnate come lette"}
 
+@api_router.get("/admin/notifications/unread-cache/stats")
+async def admin_get_unread_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Statistiche della cache dei contatori di notifiche non lette"""
+    return unread_counts.stats()
+
 # ==================== WEATHER ROUTES ====================
 
 @api_router.get("/weather")
@@ -2077,6 +2711,713 @@ async def get_suggested_itineraries():
             "itinerari_suggeriti": itineraries
         }
 
+# ==================== AVAILABILITY INDEX ====================
+
+# Stati di prenotazione che occupano le date
+ACTIVE_BOOKING_STATUSES = ["pending", "confirmed"]
+
+class _IntervalTrack:
+    """
+    Intervalli [inizio, fine) di una unità, ordinati per data di inizio.
+    Per ogni posizione mantiene il massimo delle date di fine fino a quel punto,
+    così una verifica di sovrapposizione costa una bisect (O(log n)).
+    """
+
+    def __init__(self):
+        self.items = {}  # id -> (inizio, fine, motivo)
+        self._order = []
+        self._starts = []
+        self._max_end = []
+        self._max_pos = []
+        self._dirty = False
+
+    def put(self, item_id: str, inizio: str, fine: str, motivo: Optional[str] = None):
+        self.items[item_id] = (inizio, fine, motivo)
+        self._dirty = True
+
+    def discard(self, item_id: str) -> bool:
+        if self.items.pop(item_id, None) is None:
+            return False
+        self._dirty = True
+        return True
+
+    def _compile(self):
+        self._order = sorted(self.items.items(), key=lambda kv: kv[1][0])
+        self._starts = [interval[0] for _, interval in self._order]
+        self._max_end = []
+        self._max_pos = []
+        best_end, best_pos = "", -1
+        for pos, (_, (_, fine, _)) in enumerate(self._order):
+            if fine > best_end:
+                best_end, best_pos = fine, pos
+            self._max_end.append(best_end)
+            self._max_pos.append(best_pos)
+        self._dirty = False
+
+    def find_overlap(self, inizio: str, fine: str) -> Optional[tuple]:
+        """Restituisce (id, motivo) di un intervallo che interseca [inizio, fine), altrimenti None"""
+        if self._dirty:
+            self._compile()
+        # Intervalli che iniziano prima della fine richiesta
+        pos = bisect.bisect_left(self._starts, fine)
+        if pos == 0 or self._max_end[pos - 1] <= inizio:
+            return None
+        item_id, (_, _, motivo) = self._order[self._max_pos[pos - 1]]
+        return item_id, motivo
+
+class UnitRevisions:
+    """
+    Contatori di revisione per unità, incrementati ad ogni modifica di prenotazioni,
+    blocchi, tariffe o dati dell'unità. Usati per gli ETag del calendario.
+    Il boot_id distingue i contatori di processi diversi (riavvii).
+    """
+
+    def __init__(self):
+        self.boot_id = uuid.uuid4().hex[:8]
+        self._epoch = 0  # incrementato dalle modifiche globali (tutte le unità)
+        self._units = {}
+
+    def bump(self, unit_id: Optional[str] = None):
+        if unit_id is None:
+            self._epoch += 1
+        else:
+            self._units[unit_id] = self._units.get(unit_id, 0) + 1
+
+    def get(self, unit_id: str) -> str:
+        return f"{self.boot_id}.{self._epoch}.{self._units.get(unit_id, 0)}"
+
+unit_revisions = UnitRevisions()
+
+class AvailabilityIndex:
+    """
+    Indice in memoria delle date occupate per unità (prenotazioni attive + blocchi).
+    Costruito all'avvio e aggiornato ad ogni scrittura su bookings/date_blocks,
+    risponde alle verifiche di disponibilità senza interrogare MongoDB.
+    Le unità non ancora caricate (o invalidate) vengono lette dal DB al primo accesso.
+    """
+
+    def __init__(self):
+        self._units = {}  # unit_id -> {"bookings": _IntervalTrack, "blocks": _IntervalTrack}
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.built_at = None
+
+    @staticmethod
+    def _valid_range(inizio, fine) -> bool:
+        return isinstance(inizio, str) and isinstance(fine, str) and inizio < fine
+
+    @staticmethod
+    def _new_tracks() -> dict:
+        return {"bookings": _IntervalTrack(), "blocks": _IntervalTrack()}
+
+    def _add_booking(self, tracks: dict, booking: dict):
+        if self._valid_range(booking.get("data_arrivo"), booking.get("data_partenza")):
+            tracks["bookings"].put(booking["id"], booking["data_arrivo"], booking["data_partenza"])
+
+    def _add_block(self, tracks: dict, block: dict):
+        if self._valid_range(block.get("data_inizio"), block.get("data_fine")):
+            tracks["blocks"].put(block["id"], block["data_inizio"], block["data_fine"], block.get("motivo"))
+
+    async def rebuild(self):
+        """Ricostruisce l'intero indice da bookings e date_blocks"""
+        units = {}
+        async for unit in db.units.find({}, {"_id": 0, "id": 1}):
+            units[unit["id"]] = self._new_tracks()
+        async for booking in db.bookings.find(
+            {"status": {"$in": ACTIVE_BOOKING_STATUSES}},
+            {"_id": 0, "id": 1, "unit_id": 1, "data_arrivo": 1, "data_partenza": 1}
+        ):
+            tracks = units.setdefault(booking.get("unit_id"), self._new_tracks())
+            self._add_booking(tracks, booking)
+        async for block in db.date_blocks.find(
+            {}, {"_id": 0, "id": 1, "unit_id": 1, "data_inizio": 1, "data_fine": 1, "motivo": 1}
+        ):
+            tracks = units.setdefault(block.get("unit_id"), self._new_tracks())
+            self._add_block(tracks, block)
+        self._units = units
+        unit_revisions.bump()
+        self.rebuilds += 1
+        self.built_at = datetime.now(timezone.utc).isoformat()
+
+    async def refresh_unit(self, unit_id: str) -> dict:
+        """Ricarica dal DB gli intervalli di una singola unità"""
+        tracks = self._new_tracks()
+        async for booking in db.bookings.find(
+            {"unit_id": unit_id, "status": {"$in": ACTIVE_BOOKING_STATUSES}},
+            {"_id": 0, "id": 1, "data_arrivo": 1, "data_partenza": 1}
+        ):
+            self._add_booking(tracks, booking)
+        async for block in db.date_blocks.find(
+            {"unit_id": unit_id},
+            {"_id": 0, "id": 1, "data_inizio": 1, "data_fine": 1, "motivo": 1}
+        ):
+            self._add_block(tracks, block)
+        self._units[unit_id] = tracks
+        self.rebuilds += 1
+        return tracks
+
+    def invalidate(self, unit_id: Optional[str] = None):
+        """Scarta una unità (o tutte): verrà ricaricata dal DB alla prossima richiesta"""
+        unit_revisions.bump(unit_id)
+        if unit_id is None:
+            self._units = {}
+        else:
+            self._units.pop(unit_id, None)
+
+    async def _tracks(self, unit_id: str) -> dict:
+        tracks = self._units.get(unit_id)
+        if tracks is None:
+            self.misses += 1
+            return await self.refresh_unit(unit_id)
+        self.hits += 1
+        return tracks
+
+    async def find_conflict(self, unit_id: str, data_arrivo: str, data_partenza: str, include_blocks: bool = True) -> Optional[dict]:
+        """
+        Cerca una prenotazione attiva (o un blocco) che si sovrappone al periodo richiesto.
+        Restituisce {"tipo": "booking"|"block", "id", "motivo"} oppure None.
+        """
+        tracks = await self._tracks(unit_id)
+        hit = tracks["bookings"].find_overlap(data_arrivo, data_partenza)
+        if hit:
+            return {"tipo": "booking", "id": hit[0], "motivo": None}
+        if include_blocks:
+            hit = tracks["blocks"].find_overlap(data_arrivo, data_partenza)
+            if hit:
+                return {"tipo": "block", "id": hit[0], "motivo": hit[1]}
+        return None
+
+    async def night_status(self, unit_id: str, dates: List[str]) -> str:
+        """
+        Stato di ogni notte [dates[i], dates[i+1]) come stringa compatta:
+        'F' libera, 'B' prenotata, 'X' bloccata. L'ultima data fa solo da confine.
+        """
+        tracks = await self._tracks(unit_id)
+        status = []
+        for inizio, fine in zip(dates, dates[1:]):
+            if tracks["bookings"].find_overlap(inizio, fine):
+                status.append("B")
+            elif tracks["blocks"].find_overlap(inizio, fine):
+                status.append("X")
+            else:
+                status.append("F")
+        return "".join(status)
+
+    # Le unità non caricate vengono ignorate: saranno lette interamente dal DB al primo accesso
+
+    def put_booking(self, booking: dict):
+        unit_revisions.bump(booking.get("unit_id"))
+        tracks = self._units.get(booking.get("unit_id"))
+        if tracks is None:
+            return
+        tracks["bookings"].discard(booking["id"])
+        if booking.get("status") in ACTIVE_BOOKING_STATUSES:
+            self._add_booking(tracks, booking)
+
+    def discard_booking(self, booking_id: str):
+        for unit_id, tracks in self._units.items():
+            if tracks["bookings"].discard(booking_id):
+                unit_revisions.bump(unit_id)
+                return
+        # Unità sconosciuta: invalida tutte le revisioni
+        unit_revisions.bump()
+
+    def put_block(self, block: dict):
+        unit_revisions.bump(block.get("unit_id"))
+        tracks = self._units.get(block.get("unit_id"))
+        if tracks is None:
+            return
+        tracks["blocks"].discard(block["id"])
+        self._add_block(tracks, block)
+
+    def discard_block(self, block_id: str):
+        for unit_id, tracks in self._units.items():
+            if tracks["blocks"].discard(block_id):
+                unit_revisions.bump(unit_id)
+                return
+        unit_revisions.bump()
+
+    def stats(self) -> dict:
+        return {
+            "units": len(self._units),
+            "bookings": sum(len(t["bookings"].items) for t in self._units.values()),
+            "blocks": sum(len(t["blocks"].items) for t in self._units.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "built_at": self.built_at
+        }
+
+availability_index = AvailabilityIndex()
+
+@api_router.get("/admin/availability-index/stats")
+async def admin_get_availability_index_stats(admin: dict = Depends(get_admin_user)):
+    """Statistiche dell'indice di disponibilità in memoria"""
+    return availability_index.stats()
+
+@api_router.post("/admin/availability-index/rebuild")
+async def admin_rebuild_availability_index(admin: dict = Depends(get_admin_user)):
+    """Forza la ricostruzione completa dell'indice di disponibilità"""
+    await availability_index.rebuild()
+    return availability_index.stats()
+
+# ==================== RATE CALENDAR ====================
+
+RATE_CALENDAR_HORIZON_DAYS = 3 * 366
+RATE_CALENDAR_MAX_AGE_DAYS = 30
+
+class RateCalendar:
+    """
+    Tariffe notte precompilate di una unità per i prossimi ~3 anni:
+    base, weekend e periodi speciali sono già risolti per ogni notte,
+    quindi un preventivo è una slice degli array più una somma.
+    """
+
+    def __init__(self, unit: dict, price_periods: list, discounts: list):
+        self.unit_id = unit["id"]
+        self.prezzo_base = unit["prezzo_base"]
+        self.prezzo_weekend = unit.get("prezzo_weekend")
+        self.capacita_max = unit.get("capacita_max", 5)
+        self.attivo = unit.get("attivo", True)
+        self.soggiorno_minimo = unit.get("soggiorno_minimo", 1)
+        # Stesso ordine del DB: il primo periodo che copre una notte vince
+        self.price_periods = [
+            p for p in price_periods
+            if isinstance(p.get("data_inizio"), str) and isinstance(p.get("data_fine"), str)
+        ]
+        self.discounts = discounts  # ordinati per giorni_minimo decrescente
+        self.origin = datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time())
+        self._compile()
+
+    def _default_night(self, is_weekend: bool) -> tuple:
+        if is_weekend and self.prezzo_weekend:
+            return self.prezzo_weekend, "Tariffa Weekend"
+        return self.prezzo_base, "Tariffa Base"
+
+    def _period_night(self, period: dict, is_weekend: bool) -> tuple:
+        if is_weekend and period.get("prezzo_weekend"):
+            return period["prezzo_weekend"], period["nome_periodo"] + " (Weekend)"
+        return period.get("prezzo_notte", period.get("prezzo", self.prezzo_base)), period["nome_periodo"]
+
+    def _compile(self):
+        days = [self.origin + timedelta(days=i) for i in range(RATE_CALENDAR_HORIZON_DAYS)]
+        self.dates = [d.strftime("%Y-%m-%d") for d in days]
+        self.weekend = [d.weekday() >= 4 for d in days]  # Fri, Sat, Sun
+        nights = [self._default_night(w) for w in self.weekend]
+        self.min_stay = [self.soggiorno_minimo] * len(days)
+        # Periodi applicati in ordine inverso, così quelli che vengono prima sovrascrivono gli altri.
+        # Le date restano stringhe: bisect replica il confronto data_inizio <= data <= data_fine.
+        for period in reversed(self.price_periods):
+            lo = bisect.bisect_left(self.dates, period["data_inizio"])
+            hi = bisect.bisect_right(self.dates, period["data_fine"])
+            min_stay = period.get("soggiorno_minimo") or self.soggiorno_minimo
+            for i in range(lo, hi):
+                nights[i] = self._period_night(period, self.weekend[i])
+                self.min_stay[i] = min_stay
+        self.prices = [n[0] for n in nights]
+        self.labels = [n[1] for n in nights]
+
+    def _resolve(self, day: datetime) -> tuple:
+        """Risoluzione diretta di una notte fuori dall'orizzonte precompilato"""
+        date_str = day.strftime("%Y-%m-%d")
+        is_weekend = day.weekday() >= 4
+        for period in self.price_periods:
+            if period["data_inizio"] <= date_str <= period["data_fine"]:
+                prezzo, nome = self._period_night(period, is_weekend)
+                break
+        else:
+            prezzo, nome = self._default_night(is_weekend)
+        return date_str, prezzo, nome, is_weekend
+
+    def nights(self, start: datetime, count: int) -> tuple:
+        """Restituisce (prezzi, soggiorni_minimi) per count notti a partire da start"""
+        offset = (start - self.origin).days
+        if 0 <= offset and offset + count <= len(self.prices):
+            return self.prices[offset:offset + count], self.min_stay[offset:offset + count]
+        prices, min_stay = [], []
+        for i in range(count):
+            date_str, prezzo, _, _ = self._resolve(start + timedelta(days=i))
+            prices.append(prezzo)
+            period = next((p for p in self.price_periods if p["data_inizio"] <= date_str <= p["data_fine"]), None)
+            min_stay.append((period and period.get("soggiorno_minimo")) or self.soggiorno_minimo)
+        return prices, min_stay
+
+    def quote(self, arrivo: datetime, partenza: datetime) -> tuple:
+        """Restituisce (totale, dettaglio) per le notti da arrivo (inclusa) a partenza (esclusa)"""
+        start = (arrivo - self.origin).days
+        end = (partenza - self.origin).days
+        if 0 <= start and end <= len(self.prices):
+            total = sum(self.prices[start:end], 0.0)
+            nights = zip(self.dates[start:end], self.prices[start:end], self.labels[start:end], self.weekend[start:end])
+        else:
+            nights = [self._resolve(arrivo + timedelta(days=i)) for i in range((partenza - arrivo).days)]
+            total = sum((n[1] for n in nights), 0.0)
+        dettaglio = [
+            {"data": data, "prezzo": prezzo, "periodo": periodo, "is_weekend": is_weekend}
+            for data, prezzo, periodo, is_weekend in nights
+        ]
+        return total, dettaglio
+
+    def discount_for(self, num_notti: int) -> tuple:
+        """Restituisce (sconto_percentuale, descrizione) per un soggiorno di num_notti"""
+        for discount in self.discounts:
+            if num_notti >= discount["giorni_minimo"]:
+                return discount["sconto_percentuale"], f"Sconto {discount['giorni_minimo']}+ notti"
+        return 0, None
+
+class RateCalendarCache:
+    """Calendari tariffari per unità, ricompilati quando cambiano unità, periodi o sconti"""
+
+    def __init__(self):
+        self._calendars = {}
+        self.compiles = 0
+
+    async def get(self, unit_id: str) -> Optional[RateCalendar]:
+        calendar = self._calendars.get(unit_id)
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if calendar and (now - calendar.origin).days <= RATE_CALENDAR_MAX_AGE_DAYS:
+            return calendar
+        unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
+        if not unit:
+            self._calendars.pop(unit_id, None)
+            return None
+        price_periods = await db.price_periods.find({"unit_id": unit_id}, {"_id": 0}).to_list(None)
+        discounts = await db.discounts.find({"unit_id": unit_id}, {"_id": 0}).sort("giorni_minimo", -1).to_list(None)
+        calendar = RateCalendar(unit, price_periods, discounts)
+        self._calendars[unit_id] = calendar
+        self.compiles += 1
+        return calendar
+
+    def invalidate(self, unit_id: Optional[str] = None):
+        unit_revisions.bump(unit_id)
+        if unit_id is None:
+            self._calendars = {}
+        else:
+            self._calendars.pop(unit_id, None)
+
+rate_calendars = RateCalendarCache()
+
+class UnitNameMap:
+    """
+    Mappa id unità -> nome per arricchire gli elenchi di prenotazioni con una sola query.
+    Le unità sono poche e cambiano di rado: la mappa si ricarica dopo invalidate()
+    (chiamata dalle scritture su db.units) o quando compare un id sconosciuto
+    (unità creata da un altro worker), al massimo una volta al minuto.
+    """
+
+    RELOAD_UNKNOWN_SECONDS = 60
+
+    def __init__(self):
+        self._names = None
+        self._loaded_at = 0.0
+
+    async def get(self) -> dict:
+        if self._names is None:
+            units = await db.units.find({}, {"_id": 0, "id": 1, "nome": 1}).to_list(None)
+            self._names = {u["id"]: u.get("nome") for u in units}
+            self._loaded_at = time.monotonic()
+        return self._names
+
+    def invalidate(self):
+        self._names = None
+
+    async def attach(self, docs: list, field: str = "unit_id") -> list:
+        """Imposta unit_nome su ogni documento che ha un'unità"""
+        names = await self.get()
+        if (time.monotonic() - self._loaded_at > self.RELOAD_UNKNOWN_SECONDS
+                and any(d.get(field) and d[field] not in names for d in docs)):
+            self.invalidate()
+            names = await self.get()
+        for doc in docs:
+            nome = names.get(doc.get(field))
+            if nome:
+                doc["unit_nome"] = nome
+        return docs
+
+unit_names = UnitNameMap()
+
+# ==================== OCCUPANCY ====================
+
+# Prenotazioni che compaiono nella tabella di occupazione (i report filtrano poi per stato)
+OCCUPANCY_BOOKING_STATUSES = ["pending", "confirmed", "completed"]
+OCCUPANCY_MAX_NIGHTS = 366
+
+def booking_nights(data_arrivo, data_partenza) -> list:
+    """Notti (YYYY-MM-DD) da arrivo incluso a partenza esclusa"""
+    try:
+        start = datetime.strptime(data_arrivo, "%Y-%m-%d")
+        end = datetime.strptime(data_partenza, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return []
+    count = min((end - start).days, OCCUPANCY_MAX_NIGHTS)
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(count)]
+
+def booking_source(booking: dict) -> str:
+    """Provenienza della prenotazione dalle note (stesse regole di /admin/statistics)"""
+    note_lower = (booking.get('note', '') or '').lower()
+    if 'airbnb' in note_lower:
+        return 'airbnb'
+    if 'booking' in note_lower:
+        return 'booking'
+    if '[whatsapp]' in note_lower:
+        return 'whatsapp'
+    if '[telefono]' in note_lower or '[phone]' in note_lower:
+        return 'phone'
+    return 'direct'
+
+class OccupancyLedger:
+    """
+    Tabella materializzata db.occupancy_daily: una riga per notte occupata
+    (unit_id, date, kind booking|block, ref_id, status, revenue, source), con
+    _id "kind|ref_id|data". Aggiornata ad ogni scrittura su prenotazioni e blocchi,
+    così i report aggregano righe già pronte invece di ricalcolare dalle prenotazioni.
+    """
+
+    @staticmethod
+    def _key(row: dict) -> str:
+        return f"{row['kind']}|{row['ref_id']}|{row['date']}"
+
+    async def _upsert(self, rows: list):
+        if rows:
+            await db.occupancy_daily.bulk_write([
+                UpdateOne({"_id": self._key(row)}, {"$set": row}, upsert=True) for row in rows
+            ], ordered=False)
+
+    def _booking_rows(self, booking: dict) -> list:
+        if booking.get("status") not in OCCUPANCY_BOOKING_STATUSES or not booking.get("unit_id"):
+            return []
+        nights = booking_nights(booking.get("data_arrivo"), booking.get("data_partenza"))
+        if not nights:
+            return []
+        # Ricavo ripartito sulle notti (stima €100/notte se manca il prezzo)
+        revenue = booking.get("prezzo_totale") if "prezzo_totale" in booking else len(nights) * 100
+        share = round((revenue or 0) / len(nights), 2)
+        source = booking_source(booking)
+        return [
+            {"unit_id": booking["unit_id"], "date": night, "kind": "booking", "ref_id": booking["id"],
+             "status": booking["status"], "revenue": share, "source": source}
+            for night in nights
+        ]
+
+    def _block_rows(self, block: dict) -> list:
+        if not block.get("unit_id"):
+            return []
+        return [
+            {"unit_id": block["unit_id"], "date": night, "kind": "block", "ref_id": block["id"],
+             "status": "blocked", "revenue": 0, "source": block.get("source") or "manual",
+             "ical_feed_id": block.get("ical_feed_id")}
+            for night in booking_nights(block.get("data_inizio"), block.get("data_fine"))
+        ]
+
+    async def _replace(self, query: dict, rows: list):
+        """Sostituisce le righe che soddisfano query: upsert delle nuove, poi rimozione delle altre"""
+        await self._upsert(rows)
+        await db.occupancy_daily.delete_many({**query, "_id": {"$nin": [self._key(row) for row in rows]}})
+
+    async def sync_booking(self, booking: dict):
+        await self._replace({"kind": "booking", "ref_id": booking["id"]}, self._booking_rows(booking))
+
+    async def discard_booking(self, booking_id: str):
+        await db.occupancy_daily.delete_many({"kind": "booking", "ref_id": booking_id})
+
+    async def discard_bookings(self, booking_ids: list):
+        if booking_ids:
+            await db.occupancy_daily.delete_many({"kind": "booking", "ref_id": {"$in": booking_ids}})
+
+    async def sync_block(self, block: dict):
+        await self._replace({"kind": "block", "ref_id": block["id"]}, self._block_rows(block))
+
+    async def discard_block(self, block_id: str):
+        await db.occupancy_daily.delete_many({"kind": "block", "ref_id": block_id})
+
+    async def sync_feed_blocks(self, feed_id: str):
+        """Riallinea le righe dei blocchi importati da un feed iCal"""
+        rows = []
+        async for block in db.date_blocks.find({"ical_feed_id": feed_id}, {"_id": 0}):
+            rows.extend(self._block_rows(block))
+        await self._replace({"kind": "block", "ical_feed_id": feed_id}, rows)
+
+    async def rebuild(self) -> int:
+        """
+        Ricostruisce l'intera tabella da bookings e date_blocks senza svuotarla: upsert
+        delle righe attese, poi rimozione delle sole righe preesistenti non più valide.
+        Le scritture arrivate nel frattempo non vanno perse.
+        """
+        previous = {d["_id"] async for d in db.occupancy_daily.find({}, {"_id": 1})}
+        rows = []
+        async for booking in db.bookings.find({"status": {"$in": OCCUPANCY_BOOKING_STATUSES}}, {"_id": 0}):
+            rows.extend(self._booking_rows(booking))
+        async for block in db.date_blocks.find({}, {"_id": 0}):
+            rows.extend(self._block_rows(block))
+        await self._upsert(rows)
+        stale = list(previous - {self._key(row) for row in rows})
+        if stale:
+            await db.occupancy_daily.delete_many({"_id": {"$in": stale}})
+        return len(rows)
+
+    async def ensure_built(self):
+        """Primo avvio: costruisce la tabella se è vuota ma esistono prenotazioni o blocchi"""
+        if await db.occupancy_daily.estimated_document_count() == 0 and (
+            await db.bookings.estimated_document_count() or await db.date_blocks.estimated_document_count()
+        ):
+            await self.rebuild()
+
+    async def daily(self, date_from: str, date_to: str, statuses: list) -> dict:
+        """{date: {"occupied", "blocked", "revenue"}} per le notti in [date_from, date_to)"""
+        pipeline = [
+            {"$match": {"date": {"$gte": date_from, "$lt": date_to},
+                        "$or": [{"kind": "block"}, {"status": {"$in": statuses}}]}},
+            {"$group": {
+                "_id": "$date",
+                "occupied": {"$sum": {"$cond": [{"$eq": ["$kind", "booking"]}, 1, 0]}},
+                "blocked": {"$sum": {"$cond": [{"$eq": ["$kind", "block"]}, 1, 0]}},
+                "revenue": {"$sum": "$revenue"}
+            }}
+        ]
+        return {row["_id"]: row async for row in db.occupancy_daily.aggregate(pipeline)}
+
+    async def monthly(self, date_from: str, date_to: str, statuses: list) -> dict:
+        """{"YYYY-MM": {"bookings", "nights", "revenue"}} delle notti vendute in [date_from, date_to)"""
+        pipeline = [
+            {"$match": {"kind": "booking", "date": {"$gte": date_from, "$lt": date_to},
+                        "status": {"$in": statuses}}},
+            {"$group": {
+                "_id": {"month": {"$substrCP": ["$date", 0, 7]}, "ref_id": "$ref_id"},
+                "nights": {"$sum": 1},
+                "revenue": {"$sum": "$revenue"}
+            }},
+            {"$group": {
+                "_id": "$_id.month",
+                "bookings": {"$sum": 1},
+                "nights": {"$sum": "$nights"},
+                "revenue": {"$sum": "$revenue"}
+            }}
+        ]
+        return {row["_id"]: row async for row in db.occupancy_daily.aggregate(pipeline)}
+
+occupancy = OccupancyLedger()
+occupancy_bootstrap_task = None
+
+@api_router.post("/admin/occupancy/rebuild")
+async def admin_rebuild_occupancy(admin: dict = Depends(get_admin_user)):
+    """Ricostruisce la tabella di occupazione giornaliera"""
+    rows = await occupancy.rebuild()
+    return {"message": "Tabella occupazione ricostruita", "righe": rows}
+
+# ==================== RESERVATION LEDGER ====================
+
+class NightLedger:
+    """
+    Registro db.unit_nights: un documento per notte occupata da una prenotazione attiva,
+    con _id "unit_id|data". L'unicità di _id fa fallire nel DB il secondo inserimento
+    delle stesse notti, anche tra richieste concorrenti o worker diversi: la verifica
+    sull'indice di disponibilità resta solo un controllo rapido prima della scrittura.
+    """
+
+    def _nights(self, booking: dict) -> list:
+        if booking.get("status") not in ACTIVE_BOOKING_STATUSES or not booking.get("unit_id"):
+            return []
+        return booking_nights(booking.get("data_arrivo"), booking.get("data_partenza"))
+
+    def _doc(self, booking: dict, night: str) -> dict:
+        return {"_id": f"{booking['unit_id']}|{night}", "unit_id": booking["unit_id"],
+                "date": night, "booking_id": booking["id"]}
+
+    async def sync(self, booking: dict, new: bool = False):
+        """
+        Allinea le notti riservate alla prenotazione (anche in seguito a cambio date o stato).
+        Se una notte è già di un'altra prenotazione annulla le notti appena inserite e solleva 409.
+        """
+        wanted = {self._doc(booking, night)["_id"]: self._doc(booking, night) for night in self._nights(booking)}
+        held = set()
+        if not new:
+            held = {d["_id"] async for d in db.unit_nights.find({"booking_id": booking["id"]}, {"_id": 1})}
+        missing = [doc for key, doc in wanted.items() if key not in held]
+        if missing:
+            try:
+                await db.unit_nights.insert_many(missing, ordered=False)
+            except BulkWriteError as e:
+                failed = {err["op"]["_id"] for err in e.details.get("writeErrors", [])}
+                inserted = [doc["_id"] for doc in missing if doc["_id"] not in failed]
+                if inserted:
+                    await db.unit_nights.delete_many({"_id": {"$in": inserted}})
+                if any(err.get("code") == 11000 for err in e.details.get("writeErrors", [])):
+                    raise HTTPException(status_code=409, detail="Date non disponibili - già prenotato")
+                raise
+        stale = [key for key in held if key not in wanted]
+        if stale:
+            await db.unit_nights.delete_many({"_id": {"$in": stale}})
+
+    async def release(self, booking_id: str):
+        await db.unit_nights.delete_many({"booking_id": booking_id})
+
+    async def release_many(self, booking_ids: list):
+        if booking_ids:
+            await db.unit_nights.delete_many({"booking_id": {"$in": booking_ids}})
+
+    async def rebuild(self) -> dict:
+        """
+        Ricostruisce il registro dalle prenotazioni attive senza svuotarlo: upsert delle notti
+        attese, poi rimozione delle sole righe preesistenti non più valide. Le prenotazioni
+        create nel frattempo non perdono la copertura. Riporta le sovrapposizioni già presenti.
+        """
+        previous = {d["_id"] async for d in db.unit_nights.find({}, {"_id": 1})}
+        wanted = {}
+        overlaps = 0
+        async for booking in db.bookings.find({"status": {"$in": ACTIVE_BOOKING_STATUSES}}, {"_id": 0}):
+            for night in self._nights(booking):
+                doc = self._doc(booking, night)
+                if doc["_id"] in wanted:
+                    overlaps += 1
+                    continue
+                wanted[doc["_id"]] = doc
+        if overlaps:
+            logger.warning(f"Night ledger: {overlaps} notti sovrapposte tra prenotazioni esistenti")
+        if wanted:
+            await db.unit_nights.bulk_write([
+                UpdateOne({"_id": key}, {"$set": {k: v for k, v in doc.items() if k != "_id"}}, upsert=True)
+                for key, doc in wanted.items()
+            ], ordered=False)
+        stale = [key for key in previous if key not in wanted]
+        if stale:
+            await db.unit_nights.delete_many({"_id": {"$in": stale}})
+        return {"notti": len(wanted), "sovrapposizioni": overlaps}
+
+    async def ensure_built(self):
+        """Primo avvio: costruisce il registro se è vuoto ma esistono prenotazioni attive"""
+        if await db.unit_nights.estimated_document_count() == 0 and await db.bookings.find_one(
+            {"status": {"$in": ACTIVE_BOOKING_STATUSES}}, {"_id": 1}
+        ):
+            await self.rebuild()
+
+night_ledger = NightLedger()
+night_ledger_bootstrap_task = None
+
+BOOKING_CODE_ATTEMPTS = 5
+
+async def insert_booking(booking_doc: dict):
+    """
+    Inserisce la prenotazione; un codice già usato viene rigenerato quando l'indice
+    univoco lo rifiuta, senza verifiche preventive.
+    """
+    for _ in range(BOOKING_CODE_ATTEMPTS):
+        try:
+            await db.bookings.insert_one(booking_doc)
+            return
+        except DuplicateKeyError as e:
+            booking_doc.pop("_id", None)
+            if "codice_prenotazione" not in str(e):
+                raise
+            booking_doc["codice_prenotazione"] = generate_booking_code()
+    raise HTTPException(status_code=503, detail="Impossibile generare un codice prenotazione, riprova")
+
+@api_router.post("/admin/night-ledger/rebuild")
+async def admin_rebuild_night_ledger(admin: dict = Depends(get_admin_user)):
+    """Ricostruisce il registro delle notti riservate"""
+    result = await night_ledger.rebuild()
+    return {"message": "Registro notti ricostruito", **result}
+
 # ==================== UNITS (CASETTE) ROUTES ====================
 
 @api_router.delete("/admin/reset-units")
@@ -2088,6 +3429,13 @@ async def reset_all_units(admin: dict = Depends(get_admin_user)):
     await db.ical_feeds.delete_many({})
     await db.price_periods.delete_many({})
     await db.units.delete_many({})
+    unit_names.invalidate()
+    await db.occupancy_daily.delete_many({})
+    await db.unit_nights.delete_many({})
+    availability_index.invalidate()
+    rate_calendars.invalidate()
+    await checkin_view.rebuild()
+    await badge_counters.reconcile()
     
     return {
         "message": "Tutte le casette e i dati correlati sono stati eliminati",
@@ -2139,85 +3487,83 @@ async def get_unit_availability(unit_id: str, month: Optional[str] = None):
         "price_periods": price_periods
     }
 
-@api_router.get("/units/{unit_id}/price")
-async def get_unit_price(unit_id: str, data_arrivo: str, data_partenza: str):
-    """Calculate price for a date range"""
-    unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
-    if not unit:
+CALENDAR_MAX_MONTHS = 12
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Verifica l'header If-None-Match (lista di ETag o '*')"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+@api_router.get("/units/{unit_id}/calendar")
+async def get_unit_calendar(request: Request, unit_id: str, month: Optional[str] = None, months: int = 1):
+    """
+    Calendario compatto di una unità per uno o più mesi (month: YYYY-MM, default mese corrente).
+    Per ogni giorno: stato della notte ('F' libera, 'B' prenotata, 'X' bloccata),
+    prezzo notte e soggiorno minimo. L'ETag è un hash del contenuto, quindi è lo stesso
+    su ogni worker: se nulla è cambiato la risposta è un 304 senza corpo.
+    """
+    if months < 1 or months > CALENDAR_MAX_MONTHS:
+        raise HTTPException(status_code=400, detail=f"months deve essere tra 1 e {CALENDAR_MAX_MONTHS}")
+    try:
+        start = datetime.strptime(month, "%Y-%m") if month else datetime.now(timezone.utc).replace(
+            tzinfo=None, day=1, hour=0, minute=0, second=0, microsecond=0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Formato mese non valido (YYYY-MM)")
+    end_month = start.month - 1 + months
+    end = start.replace(year=start.year + end_month // 12, month=end_month % 12 + 1)
+    
+    # Unità verificata prima dell'ETag: un id sconosciuto risponde 404 anche con If-None-Match: *
+    calendar = await rate_calendars.get(unit_id)
+    if not calendar:
         raise HTTPException(status_code=404, detail="Unità non trovata")
     
-    # Parse dates
-    from datetime import datetime as dt
-    arrivo = dt.strptime(data_arrivo, "%Y-%m-%d")
-    partenza = dt.strptime(data_partenza, "%Y-%m-%d")
+    num_giorni = (end - start).days
+    dates = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(num_giorni + 1)]
+    status = await availability_index.night_status(unit_id, dates)
+    prices, min_stay = calendar.nights(start, num_giorni)
+    body = {
+        "unit_id": unit_id,
+        "data_inizio": dates[0],
+        "data_fine": dates[-1],
+        "stato": status,
+        "legenda": {"F": "libero", "B": "prenotato", "X": "bloccato"},
+        "prezzi": prices,
+        "soggiorno_minimo": min_stay
+    }
+    
+    # Stato e tariffe vengono da indici già in memoria: l'hash costa poco e non dipende dal worker
+    digest = hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()[:20]
+    etag = f'"cal-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    return JSONResponse(body, headers=headers)
+
+def compute_price_quote(calendar: RateCalendar, data_arrivo: str, data_partenza: str) -> dict:
+    """Preventivo per un periodo a partire dal calendario tariffario dell'unità"""
+    arrivo = datetime.strptime(data_arrivo, "%Y-%m-%d")
+    partenza = datetime.strptime(data_partenza, "%Y-%m-%d")
     num_notti = (partenza - arrivo).days
     
     if num_notti <= 0:
         raise HTTPException(status_code=400, detail="Date non valide")
     
-    # Get price periods
-    price_periods = await db.price_periods.find({"unit_id": unit_id}, {"_id": 0}).to_list(100)
-    
-    # Get long stay discounts
-    discounts = await db.discounts.find({"unit_id": unit_id}, {"_id": 0}).sort("giorni_minimo", -1).to_list(100)
-    
-    # Get weekend price from unit
-    prezzo_weekend = unit.get("prezzo_weekend")
-    
-    # Calculate total price
-    total = 0.0
-    current_date = arrivo
-    dettaglio_prezzi = []
-    
-    while current_date < partenza:
-        date_str = current_date.strftime("%Y-%m-%d")
-        day_of_week = current_date.weekday()  # 0=Mon, 4=Fri, 5=Sat, 6=Sun
-        is_weekend = day_of_week >= 4  # Fri, Sat, Sun
-        
-        # Check if date falls in a special price period
-        prezzo_notte = unit["prezzo_base"]
-        periodo_nome = "Tariffa Base"
-        
-        for period in price_periods:
-            if period["data_inizio"] <= date_str <= period["data_fine"]:
-                prezzo_notte = period.get("prezzo_notte", period.get("prezzo", unit["prezzo_base"]))
-                periodo_nome = period["nome_periodo"]
-                # Check if period has weekend price
-                if is_weekend and period.get("prezzo_weekend"):
-                    prezzo_notte = period["prezzo_weekend"]
-                    periodo_nome += " (Weekend)"
-                break
-        else:
-            # No special period - check unit weekend price
-            if is_weekend and prezzo_weekend:
-                prezzo_notte = prezzo_weekend
-                periodo_nome = "Tariffa Weekend"
-        
-        total += prezzo_notte
-        dettaglio_prezzi.append({
-            "data": date_str,
-            "prezzo": prezzo_notte,
-            "periodo": periodo_nome,
-            "is_weekend": is_weekend
-        })
-        
-        current_date += timedelta(days=1)
+    # Calculate total price from the precompiled nightly rates
+    total, dettaglio_prezzi = calendar.quote(arrivo, partenza)
     
     # Apply long stay discount
-    sconto_applicato = None
-    sconto_percentuale = 0
-    for discount in discounts:
-        if num_notti >= discount["giorni_minimo"]:
-            sconto_percentuale = discount["sconto_percentuale"]
-            sconto_applicato = f"Sconto {discount['giorni_minimo']}+ notti"
-            break
+    sconto_percentuale, sconto_applicato = calendar.discount_for(num_notti)
     
     prezzo_scontato = total
     if sconto_percentuale > 0:
         prezzo_scontato = total * (1 - sconto_percentuale / 100)
     
     return {
-        "unit_id": unit_id,
+        "unit_id": calendar.unit_id,
         "data_arrivo": data_arrivo,
         "data_partenza": data_partenza,
         "num_notti": num_notti,
@@ -2228,16 +3574,74 @@ async def get_unit_price(unit_id: str, data_arrivo: str, data_partenza: str):
         "dettaglio": dettaglio_prezzi
     }
 
+@api_router.get("/units/{unit_id}/price")
+async def get_unit_price(unit_id: str, data_arrivo: str, data_partenza: str):
+    """Calculate price for a date range"""
+    calendar = await rate_calendars.get(unit_id)
+    if not calendar:
+        raise HTTPException(status_code=404, detail="Unità non trovata")
+    
+    return compute_price_quote(calendar, data_arrivo, data_partenza)
+
+@api_router.post("/units/quote-batch")
+async def quote_batch(data: QuoteBatchRequest):
+    """
+    Preventivi e disponibilità per più periodi/unità in una sola richiesta.
+    Calendari tariffari e indice di disponibilità sono condivisi tra tutte le voci;
+    un errore su una voce non blocca le altre.
+    """
+    calendars = {}
+    results = []
+    
+    for item in data.items:
+        result = {
+            "unit_id": item.unit_id,
+            "data_arrivo": item.data_arrivo,
+            "data_partenza": item.data_partenza,
+            "num_ospiti": item.num_ospiti,
+            "disponibile": False,
+            "motivo": None,
+            "prezzo": None,
+            "errore": None
+        }
+        results.append(result)
+        
+        if item.unit_id not in calendars:
+            calendars[item.unit_id] = await rate_calendars.get(item.unit_id)
+        calendar = calendars[item.unit_id]
+        if not calendar or not calendar.attivo:
+            result["errore"] = "Unità non trovata"
+            continue
+        
+        try:
+            result["prezzo"] = compute_price_quote(calendar, item.data_arrivo, item.data_partenza)
+        except HTTPException as e:
+            result["errore"] = e.detail
+            continue
+        except ValueError:
+            result["errore"] = "Date non valide"
+            continue
+        
+        if item.num_ospiti > calendar.capacita_max:
+            result["motivo"] = f"Capacità massima: {calendar.capacita_max} ospiti"
+            continue
+        
+        conflict = await availability_index.find_conflict(item.unit_id, item.data_arrivo, item.data_partenza)
+        result["disponibile"] = conflict is None
+        if conflict:
+            result["motivo"] = "Già prenotato" if conflict["tipo"] == "booking" else "Date bloccate"
+    
+    return {"count": len(results), "quotes": results}
+
 # ==================== BOOKINGS ROUTES ====================
 
 @api_router.post("/bookings", response_model=BookingResponse)
 async def create_booking(data: BookingCreate):
-    """Create a new booking request (status: pending)"""
-    unit = await db.units.find_one({"id": data.unit_id, "attivo": True}, {"_id": 0})
-    if not unit:
-        raise HTTPException(status_code=404, detail="Unità non trovata o non attiva")
-    
-    # Check if dates are available
+    """
+    Create a new booking request (status: pending).
+    Unità, prezzo e disponibilità vengono dalle cache in memoria; le notti si riservano
+    nel registro (una scrittura, fallisce nel DB se già prese) e poi si inserisce la prenotazione.
+    """
     from datetime import datetime as dt
     arrivo = dt.strptime(data.data_arrivo, "%Y-%m-%d")
     partenza = dt.strptime(data.data_partenza, "%Y-%m-%d")
@@ -2245,46 +3649,29 @@ async def create_booking(data: BookingCreate):
     if arrivo >= partenza:
         raise HTTPException(status_code=400, detail="La data di partenza deve essere successiva all'arrivo")
     
-    if data.num_ospiti > unit["capacita_max"]:
-        raise HTTPException(status_code=400, detail=f"Capacità massima: {unit['capacita_max']} ospiti")
+    calendar = await rate_calendars.get(data.unit_id)
+    if not calendar or not calendar.attivo:
+        raise HTTPException(status_code=404, detail="Unità non trovata o non attiva")
     
-    # Check for conflicting bookings
-    existing = await db.bookings.find_one({
-        "unit_id": data.unit_id,
-        "status": {"$in": ["pending", "confirmed"]},
-        "$or": [
-            {"data_arrivo": {"$lt": data.data_partenza}, "data_partenza": {"$gt": data.data_arrivo}}
-        ]
-    })
-    if existing:
-        raise HTTPException(status_code=409, detail="Date non disponibili - già prenotato")
+    if data.num_ospiti > calendar.capacita_max:
+        raise HTTPException(status_code=400, detail=f"Capacità massima: {calendar.capacita_max} ospiti")
     
-    # Check for date blocks
-    block = await db.date_blocks.find_one({
-        "unit_id": data.unit_id,
-        "$or": [
-            {"data_inizio": {"$lt": data.data_partenza}, "data_fine": {"$gt": data.data_arrivo}}
-        ]
-    })
-    if block:
-        raise HTTPException(status_code=409, detail=f"Date non disponibili - {block.get('motivo', 'Bloccate')}")
+    # Controllo rapido su bookings e date bloccate (il registro notti fa da garanzia)
+    conflict = await availability_index.find_conflict(data.unit_id, data.data_arrivo, data.data_partenza)
+    if conflict and conflict["tipo"] == "booking":
+        raise HTTPException(status_code=409, detail="Date non disponibili - già prenotato")
+    if conflict:
+        raise HTTPException(status_code=409, detail=f"Date non disponibili - {conflict['motivo'] or 'Bloccate'}")
     
     # Calculate price
-    price_response = await get_unit_price(data.unit_id, data.data_arrivo, data.data_partenza)
-    prezzo_totale = price_response["prezzo_totale"]
-    
-    booking_id = str(uuid.uuid4())
-    codice_prenotazione = generate_booking_code()
-    
-    # Assicurati che il codice sia univoco
-    while await db.bookings.find_one({"codice_prenotazione": codice_prenotazione}):
-        codice_prenotazione = generate_booking_code()
+    prezzo_totale = compute_price_quote(calendar, data.data_arrivo, data.data_partenza)["prezzo_totale"]
+    unit_nome = (await unit_names.get()).get(data.unit_id)
     
     booking_doc = {
-        "id": booking_id,
+        "id": str(uuid.uuid4()),
         "unit_id": data.unit_id,
         "guest_id": None,  # Will be linked after guest registers/logs in
-        "codice_prenotazione": codice_prenotazione,
+        "codice_prenotazione": generate_booking_code(),
         "data_arrivo": data.data_arrivo,
         "data_partenza": data.data_partenza,
         "num_ospiti": data.num_ospiti,
@@ -2297,8 +3684,17 @@ async def create_booking(data: BookingCreate):
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.bookings.insert_one(booking_doc)
-    booking_doc["unit_nome"] = unit["nome"]
+    await night_ledger.sync(booking_doc, new=True)
+    try:
+        await insert_booking(booking_doc)
+    except Exception:
+        await night_ledger.release(booking_doc["id"])
+        raise
+    codice_prenotazione = booking_doc["codice_prenotazione"]
+    availability_index.put_booking(booking_doc)
+    await occupancy.sync_booking(booking_doc)
+    await track_status_change("prenotazioni", booking_doc["id"], None, booking_doc["status"])
+    booking_doc["unit_nome"] = unit_nome
     
     # Send notification email to structure
     await send_notification_email(
@@ -2308,7 +3704,7 @@ async def create_booking(data: BookingCreate):
         <p><strong>Ospite:</strong> {data.nome_ospite}</p>
         <p><strong>Email:</strong> {data.email_ospite}</p>
         <p><strong>Telefono:</strong> {data.telefono_ospite}</p>
-        <p><strong>Casetta:</strong> {unit['nome']}</p>
+        <p><strong>Casetta:</strong> {unit_nome}</p>
         <p><strong>Arrivo:</strong> {data.data_arrivo}</p>
         <p><strong>Partenza:</strong> {data.data_partenza}</p>
         <p><strong>Ospiti:</strong> {data.num_ospiti}</p>
@@ -2329,24 +3725,10 @@ async def check_availability(unit_id: str, data_arrivo: str, data_partenza: str)
     if not unit:
         raise HTTPException(status_code=404, detail="Unità non trovata")
     
-    # Check for conflicting bookings
-    existing = await db.bookings.find_one({
-        "unit_id": unit_id,
-        "status": {"$in": ["pending", "confirmed"]},
-        "$or": [
-            {"data_arrivo": {"$lt": data_partenza}, "data_partenza": {"$gt": data_arrivo}}
-        ]
-    })
-    
-    # Check for date blocks
-    block = await db.date_blocks.find_one({
-        "unit_id": unit_id,
-        "$or": [
-            {"data_inizio": {"$lt": data_partenza}, "data_fine": {"$gt": data_arrivo}}
-        ]
-    })
+    # Check for conflicting bookings and date blocks
+    conflict = await availability_index.find_conflict(unit_id, data_arrivo, data_partenza)
     
-    is_available = existing is None and block is None
+    is_available = conflict is None
     
     # Get price if available
     price_info = None
@@ -2355,7 +3737,7 @@ async def check_availability(unit_id: str, data_arrivo: str, data_partenza: str)
     
     return {
         "disponibile": is_available,
-        "motivo": None if is_available else ("Già prenotato" if existing else "Date bloccate"),
+        "motivo": None if is_available else ("Già prenotato" if conflict["tipo"] == "booking" else "Date bloccate"),
         "prezzo": price_info
     }
 
@@ -2369,69 +3751,320 @@ async def get_my_bookings(current_user: dict = Depends(get_current_user)):
         ]
     }, {"_id": 0}).sort("created_at", -1).to_list(100)
     
-    # Enrich with unit name
-    for booking in bookings:
-        unit = await db.units.find_one({"id": booking["unit_id"]}, {"_id": 0, "nome": 1})
-        if unit:
-            booking["unit_nome"] = unit["nome"]
-    
-    return bookings
+    return await unit_names.attach(bookings)
 
 # ==================== ADMIN ROUTES ====================
 
-@api_router.get("/admin/badges")
-async def admin_get_badges(admin: dict = Depends(get_admin_user)):
-    """Get counts for admin menu badges"""
-    # Prenotazioni in attesa
-    bookings_pending = await db.bookings.count_documents({"status": "pending"})
-    
-    # Check-in in attesa
-    checkins_pending = await db.checkins.count_documents({"status": "pending"})
-    
-    # Ordini in attesa
-    orders_pending = await db.orders.count_documents({"status": "pending"})
+BADGE_RECONCILE_SECONDS = 600
+
+# Contatore badge -> collezione con stato "pending"
+BADGE_COLLECTIONS = {
+    "prenotazioni": "bookings",
+    "checkins": "checkins",
+    "ordini": "orders",
+    "servizi": "service_bookings",
+}
+
+def today_start_iso() -> str:
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+
+class BadgeCounters:
+    """
+    Contatori dei badge admin in un unico documento (db.admin_counters, _id "badges"),
+    aggiornati con $inc dagli handler che creano o cambiano stato a prenotazioni,
+    check-in, ordini, servizi e ospiti. Un job periodico li riallinea con count_documents.
+    """
+
+    async def transition(self, badge: str, old_status: Optional[str], new_status: Optional[str]):
+        delta = (new_status == "pending") - (old_status == "pending")
+        if delta:
+            await db.admin_counters.update_one({"_id": "badges"}, {"$inc": {badge: delta}}, upsert=True)
+
+    async def guest_created(self):
+        today = today_start_iso()
+        result = await db.admin_counters.update_one(
+            {"_id": "badges", "nuovi_ospiti_dal": today}, {"$inc": {"nuovi_ospiti": 1}}
+        )
+        if result.matched_count == 0:
+            # Nuovo giorno (o documento assente): riparte dal conteggio reale
+            await self.reconcile()
+
+    async def reconcile(self) -> dict:
+        today = today_start_iso()
+        counters = {
+            badge: await db[collection].count_documents({"status": "pending"})
+            for badge, collection in BADGE_COLLECTIONS.items()
+        }
+        # Nuovi ospiti oggi
+        counters["nuovi_ospiti"] = await db.guests.count_documents({
+            "created_at": {"$gte": today},
+            "is_admin": {"$ne": True}
+        })
+        counters["nuovi_ospiti_dal"] = today
+        await db.admin_counters.update_one({"_id": "badges"}, {"$set": counters}, upsert=True)
+        return counters
+
+    async def get(self) -> dict:
+        counters = await db.admin_counters.find_one({"_id": "badges"})
+        if not counters or counters.get("nuovi_ospiti_dal") != today_start_iso():
+            counters = await self.reconcile()
+        return counters
+
+    async def run_reconcile_loop(self):
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Badge counters reconcile failed: {e}")
+            await asyncio.sleep(BADGE_RECONCILE_SECONDS)
+
+badge_counters = BadgeCounters()
+badge_reconcile_task = None
+
+# ==================== ADMIN EVENT STREAM ====================
+
+ADMIN_STREAM_QUEUE_SIZE = 100
+ADMIN_STREAM_HEARTBEAT_SECONDS = 25
+ADMIN_STREAM_TICKET_SECONDS = 30
+
+class EventBus:
+    """
+    Pub/sub in processo: ogni iscritto ha una coda limitata; se un client lento
+    la riempie, gli eventi in eccesso vengono scartati (riceverà comunque i badge aggiornati).
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=ADMIN_STREAM_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, tipo: str, data: dict):
+        self.published += 1
+        event = {"tipo": tipo, "data": data, "at": datetime.now(timezone.utc).isoformat()}
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "published": self.published, "dropped": self.dropped}
+
+admin_events = EventBus()
+
+async def track_status_change(badge: str, ref_id: str, old_status: Optional[str], new_status: Optional[str]):
+    """Aggiorna i contatori dei badge e avvisa le dashboard admin collegate"""
+    await badge_counters.transition(badge, old_status, new_status)
+    admin_events.publish(badge, {"id": ref_id, "status": new_status, "status_precedente": old_status})
+
+def sse_message(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@api_router.post("/admin/stream/ticket")
+async def admin_create_stream_ticket(admin: dict = Depends(get_admin_user)):
+    """
+    Ticket monouso per aprire lo stream: EventSource non permette header, e il JWT
+    in query string finirebbe nei log di accesso e dei proxy. Il ticket scade in pochi
+    secondi ed è valido per una sola connessione.
+    """
+    ticket = str(uuid.uuid4())
+    await db.stream_tickets.insert_one({
+        "_id": ticket,
+        "user_id": admin["id"],
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ADMIN_STREAM_TICKET_SECONDS)
+    })
+    return {"ticket": ticket, "expires_in": ADMIN_STREAM_TICKET_SECONDS}
+
+@api_router.get("/admin/stream")
+async def admin_event_stream(request: Request, ticket: str):
+    """
+    Stream Server-Sent Events per la dashboard admin, aperto con un ticket di
+    POST /admin/stream/ticket. Invia subito i badge, poi un evento per ogni
+    prenotazione, check-in, ordine, servizio o riscatto fedeltà creato o cambiato di stato,
+    seguito dai badge aggiornati.
+    """
+    # Consumato alla lettura: un secondo utilizzo (o un ticket scaduto) non trova nulla
+    claimed = await db.stream_tickets.find_one_and_delete(
+        {"_id": ticket, "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    if not claimed:
+        raise HTTPException(status_code=403, detail="Ticket non valido o scaduto")
+    user = principal_cache.get(claimed["user_id"]) or await db.guests.find_one({"id": claimed["user_id"]}, {"_id": 0})
+    if not user or not user.get("is_admin"):
+        raise HTTPException(status_code=403, detail="Accesso non autorizzato")
     
-    # Prenotazioni servizi in attesa
-    service_bookings_pending = await db.service_bookings.count_documents({"status": "pending"})
+    async def badges_payload() -> dict:
+        counters = await badge_counters.get()
+        return {key: counters.get(key, 0) for key in [*BADGE_COLLECTIONS, "nuovi_ospiti"]}
     
-    # Nuovi ospiti oggi
-    from datetime import datetime, timedelta
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    new_guests_today = await db.guests.count_documents({
-        "created_at": {"$gte": today_start},
-        "is_admin": {"$ne": True}
+    async def stream():
+        queue = admin_events.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            yield sse_message("badges", await badges_payload())
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=ADMIN_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield sse_message(event["tipo"], event)
+                # Più eventi ravvicinati -> un solo ricalcolo dei badge
+                while not queue.empty():
+                    event = queue.get_nowait()
+                    yield sse_message(event["tipo"], event)
+                yield sse_message("badges", await badges_payload())
+        finally:
+            admin_events.unsubscribe(queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # nginx: non bufferizzare lo stream
     })
-    
+
+@api_router.get("/admin/stream/stats")
+async def admin_get_stream_stats(admin: dict = Depends(get_admin_user)):
+    """Client collegati allo stream admin ed eventi pubblicati/scartati"""
+    return admin_events.stats()
+
+@api_router.get("/admin/badges")
+async def admin_get_badges(admin: dict = Depends(get_admin_user)):
+    """Get counts for admin menu badges"""
+    counters = await badge_counters.get()
     return {
-        "prenotazioni": bookings_pending,
-        "checkins": checkins_pending,
-        "ordini": orders_pending,
-        "servizi": service_bookings_pending,
-        "nuovi_ospiti": new_guests_today
+        "prenotazioni": counters.get("prenotazioni", 0),
+        "checkins": counters.get("checkins", 0),
+        "ordini": counters.get("ordini", 0),
+        "servizi": counters.get("servizi", 0),
+        "nuovi_ospiti": counters.get("nuovi_ospiti", 0)
     }
 
 @api_router.get("/admin/guests", response_model=List[GuestResponse])
-async def admin_get_guests(admin: dict = Depends(get_admin_user)):
-    guests = await db.guests.find({}, {"_id": 0, "password_hash": 0}).to_list(500)
-    return [GuestResponse(**g) for g in guests]
+async def admin_get_guests(admin: dict = Depends(get_admin_user),
+                           limit: int = 500, cursor: Optional[str] = None,
+                           fields: Optional[str] = None, count: bool = False):
+    return await page_response(db.guests, {}, limit, cursor, fields, count,
+                               hidden=GUEST_PRIVATE_FIELDS, model=GuestResponse)
+
+# Indice di ricerca ospiti: token normalizzati (minuscolo, senza accenti) e loro prefissi
+# (edge n-gram) salvati sul documento, così la ricerca è un lookup esatto su indice multikey.
+GUEST_SEARCH_MIN_PREFIX = 2
+GUEST_SEARCH_MAX_PREFIX = 15
+GUEST_SEARCH_CANDIDATES = 50
+GUEST_PRIVATE_FIELDS = ("password_hash", "search_tokens", "search_prefixes")
+
+def fold_search_text(text: str) -> list:
+    """'Nicolò D'Amico' -> ['nicolo', 'd', 'amico']"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+    return re.findall(r"[a-z0-9]+", folded)
+
+def guest_name_tokens(text: str) -> set:
+    """Token del nome più la forma unita ("D'Amico" -> d, amico, damico)"""
+    parts = fold_search_text(text)
+    return set(parts) | ({"".join(parts)} if len(parts) > 1 else set())
+
+def guest_search_fields(guest: dict) -> dict:
+    """Campi search_tokens/search_prefixes da salvare con nome, cognome ed email"""
+    tokens = set(fold_search_text(guest.get("email", "")))
+    for field in ("nome", "cognome"):
+        tokens.update(guest_name_tokens(guest.get(field, "")))
+    email = (guest.get("email") or "").lower()
+    local_part = "".join(fold_search_text(email.split("@")[0]))
+    if local_part:
+        tokens.add(local_part)  # "mario.rossi" cercabile anche come "mariorossi"
+    prefixes = set()
+    for token in tokens:
+        for size in range(GUEST_SEARCH_MIN_PREFIX, min(len(token), GUEST_SEARCH_MAX_PREFIX) + 1):
+            prefixes.add(token[:size])
+    return {"search_tokens": sorted(tokens), "search_prefixes": sorted(prefixes)}
+
+def rank_guest_match(guest: dict, terms: list) -> Optional[int]:
+    """Punteggio (più alto = migliore) o None se un termine non è prefisso di alcun token"""
+    name_tokens = guest_name_tokens(guest.get("nome", "")) | guest_name_tokens(guest.get("cognome", ""))
+    tokens = guest.get("search_tokens") or []
+    score = 0
+    for term in terms:
+        if term in name_tokens:
+            score += 4
+        elif any(t.startswith(term) for t in name_tokens):
+            score += 3
+        elif term in tokens:
+            score += 2
+        elif any(t.startswith(term) for t in tokens):
+            score += 1
+        else:
+            return None
+    return score
+
+async def backfill_guest_search(force: bool = False) -> int:
+    """Calcola i campi di ricerca per gli ospiti che non li hanno (o per tutti con force)"""
+    query = {} if force else {"search_prefixes": {"$exists": False}}
+    ops = []
+    updated = 0
+    async for guest in db.guests.find(query, {"_id": 0, "id": 1, "nome": 1, "cognome": 1, "email": 1}):
+        ops.append(UpdateOne({"id": guest["id"]}, {"$set": guest_search_fields(guest)}))
+        if len(ops) >= 500:
+            await db.guests.bulk_write(ops, ordered=False)
+            updated += len(ops)
+            ops = []
+    if ops:
+        await db.guests.bulk_write(ops, ordered=False)
+        updated += len(ops)
+    return updated
+
+guest_search_backfill_task = None
+
+@api_router.post("/admin/guests/search-index/rebuild")
+async def admin_rebuild_guest_search(admin: dict = Depends(get_admin_user)):
+    """Ricalcola i campi di ricerca di tutti gli ospiti"""
+    updated = await backfill_guest_search(force=True)
+    return {"message": "Indice di ricerca ospiti ricostruito", "ospiti": updated}
 
 @api_router.get("/admin/guests/search")
 async def admin_search_guests(q: str = "", admin: dict = Depends(get_admin_user)):
     """Cerca ospiti per nome, cognome o email"""
-    if not q or len(q) < 2:
+    terms = list(dict.fromkeys(fold_search_text(q)))
+    if len(q.strip()) < 2 or not terms:
         return []
     
-    # Cerca per nome, cognome o email (case-insensitive)
-    query = {
-        "$or": [
-            {"nome": {"$regex": q, "$options": "i"}},
-            {"cognome": {"$regex": q, "$options": "i"}},
-            {"email": {"$regex": q, "$options": "i"}}
-        ],
-        "is_admin": {"$ne": True}  # Escludi admin
-    }
+    base = {"is_admin": {"$ne": True}}  # Escludi admin
+    projection = {"_id": 0, "password_hash": 0, "search_prefixes": 0}
+    
+    # Prima i token esatti: sono i risultati migliori e non devono essere tagliati dal limite
+    # applicato ai candidati per prefisso, che arrivano dal DB senza ordine di rilevanza
+    candidates = await db.guests.find(
+        {**base, "search_tokens": {"$all": terms}}, projection
+    ).limit(GUEST_SEARCH_CANDIDATES).to_list(GUEST_SEARCH_CANDIDATES)
+    
+    # Poi i prefissi indicizzati; i termini oltre GUEST_SEARCH_MAX_PREFIX si verificano nel ranking
+    remaining = GUEST_SEARCH_CANDIDATES - len(candidates)
+    if remaining > 0:
+        prefixes = [t[:GUEST_SEARCH_MAX_PREFIX] for t in terms if len(t) >= GUEST_SEARCH_MIN_PREFIX]
+        query = {**base, "id": {"$nin": [g["id"] for g in candidates]}}
+        if prefixes:
+            query["search_prefixes"] = {"$all": prefixes}
+        else:
+            query["search_tokens"] = {"$in": terms}  # solo termini di una lettera: token esatti
+        candidates += await db.guests.find(query, projection).limit(remaining).to_list(remaining)
     
-    guests = await db.guests.find(query, {"_id": 0, "password_hash": 0}).limit(10).to_list(10)
+    ranked = []
+    for g in candidates:
+        score = rank_guest_match(g, terms)
+        if score is not None:
+            ranked.append((score, g))
+    ranked.sort(key=lambda item: (-item[0], item[1].get("cognome", "").lower(), item[1].get("nome", "").lower()))
+    guests = [g for _, g in ranked[:10]]
     
     # Restituisci con info utili
     result = []
@@ -2468,57 +4101,50 @@ async def admin_delete_guest(guest_id: str, admin: dict = Depends(get_admin_user
     
     # Elimina i check-in dell'utente
     await db.checkins.delete_many({"user_id": guest_id})
+    await checkin_view.discard({"source": "form", "user_id": guest_id})
     
     # Elimina le prenotazioni associate
+    booking_ids = [b["id"] async for b in db.bookings.find({"user_id": guest_id}, {"_id": 0, "id": 1})]
     await db.bookings.delete_many({"user_id": guest_id})
+    availability_index.invalidate()
+    await occupancy.discard_bookings(booking_ids)
+    await night_ledger.release_many(booking_ids)
+    await checkin_view.sync_bookings(booking_ids)
+    await badge_counters.reconcile()
     
     # Elimina l'utente da entrambe le collections
     await db.guests.delete_one({"id": guest_id})
     await db.users.delete_one({"id": guest_id})
+    principal_cache.invalidate(guest_id)
     
     return {"message": f"Utente {guest_email} eliminato con successo"}
 
 @api_router.get("/admin/checkins")
-async def admin_get_checkins(admin: dict = Depends(get_admin_user)):
+async def admin_get_checkins(admin: dict = Depends(get_admin_user), source: Optional[str] = None,
+                             status: Optional[str] = None, limit: int = 500, cursor: Optional[str] = None,
+                             fields: Optional[str] = None, count: bool = False):
     """Get all check-ins from both collections (form + online/validated)"""
-    # Get check-ins from form submissions
-    form_checkins = await db.checkins.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    for checkin in form_checkins:
-        checkin["source"] = "form"
-        guest = await db.guests.find_one({"id": checkin.get("guest_id")}, {"_id": 0, "nome": 1, "cognome": 1})
-        if guest:
-            checkin["guest_nome"] = f"{guest.get('nome', '')} {guest.get('cognome', '')}"
-    
-    # Get online check-ins (including manually validated)
-    online_checkins = await db.online_checkins.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    for checkin in online_checkins:
-        checkin["source"] = "online"
-        # Get booking info for guest name
-        booking = await db.bookings.find_one({"id": checkin.get("booking_id")}, {"_id": 0})
-        if booking:
-            checkin["guest_nome"] = booking.get("nome_ospite", "")
-            checkin["booking"] = booking
-        # Map status for consistency
-        if checkin.get("validated_by_admin"):
-            checkin["admin_validated"] = True
-    
-    # Combine and sort
-    all_checkins = form_checkins + online_checkins
-    all_checkins.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-    
-    return all_checkins
+    query = {}
+    if source:
+        query["source"] = source
+    if status:
+        query["status"] = status
+    return await page_response(db.checkin_view, query, limit, cursor, fields, count)
 
 @api_router.put("/admin/checkins/{checkin_id}/status")
 async def admin_update_checkin_status(checkin_id: str, status: str, admin: dict = Depends(get_admin_user)):
     if status not in ["pending", "confirmed", "completed", "cancelled"]:
         raise HTTPException(status_code=400, detail="Status non valido")
     
-    result = await db.checkins.update_one(
+    before = await db.checkins.find_one_and_update(
         {"id": checkin_id},
-        {"$set": {"status": status}}
+        {"$set": {"status": status}},
+        projection={"_id": 0, "status": 1}
     )
-    if result.modified_count == 0:
+    if not before:
         raise HTTPException(status_code=404, detail="Check-in non trovato")
+    await checkin_view.update_fields(checkin_id, {"status": status})
+    await track_status_change("checkins", checkin_id, before.get("status"), status)
     
     return {"message": "Status aggiornato"}
 
@@ -2670,17 +4296,21 @@ async def admin_get_services(admin: dict = Depends(get_admin_user)):
     return services
 
 @api_router.get("/admin/service-bookings", response_model=List[ServiceBookingResponse])
-async def admin_get_service_bookings(admin: dict = Depends(get_admin_user)):
-    bookings = await db.service_bookings.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    return bookings
+async def admin_get_service_bookings(admin: dict = Depends(get_admin_user),
+                                     limit: int = 500, cursor: Optional[str] = None,
+                                     fields: Optional[str] = None, count: bool = False):
+    return await page_response(db.service_bookings, {}, limit, cursor, fields, count, model=ServiceBookingResponse)
 
 @api_router.put("/admin/service-bookings/{booking_id}/status")
 async def admin_update_booking_status(booking_id: str, status: str, admin: dict = Depends(get_admin_user)):
     if status not in ["pending", "confirmed", "completed", "cancelled"]:
         raise HTTPException(status_code=400, detail="Status non valido")
-    result = await db.service_bookings.update_one({"id": booking_id}, {"$set": {"status": status}})
-    if result.modified_count == 0:
+    before = await db.service_bookings.find_one_and_update(
+        {"id": booking_id}, {"$set": {"status": status}}, projection={"_id": 0, "status": 1}
+    )
+    if not before:
         raise HTTPException(status_code=404, detail="Prenotazione non trovata")
+    await track_status_change("servizi", booking_id, before.get("status"), status)
     return {"message": "Status aggiornato"}
 
 # Admin Products
@@ -2713,17 +4343,21 @@ async def admin_delete_product(product_id: str, admin: dict = Depends(get_admin_
 
 # Admin Orders
 @api_router.get("/admin/orders", response_model=List[OrderResponse])
-async def admin_get_orders(admin: dict = Depends(get_admin_user)):
-    orders = await db.orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    return orders
+async def admin_get_orders(admin: dict = Depends(get_admin_user),
+                           limit: int = 500, cursor: Optional[str] = None,
+                           fields: Optional[str] = None, count: bool = False):
+    return await page_response(db.orders, {}, limit, cursor, fields, count, model=OrderResponse)
 
 @api_router.put("/admin/orders/{order_id}/status")
 async def admin_update_order_status(order_id: str, status: str, admin: dict = Depends(get_admin_user)):
     if status not in ["pending", "confirmed", "delivered", "cancelled"]:
         raise HTTPException(status_code=400, detail="Status non valido")
-    result = await db.orders.update_one({"id": order_id}, {"$set": {"status": status}})
-    if result.modified_count == 0:
+    before = await db.orders.find_one_and_update(
+        {"id": order_id}, {"$set": {"status": status}}, projection={"_id": 0, "status": 1}
+    )
+    if not before:
         raise HTTPException(status_code=404, detail="Ordine non trovato")
+    await track_status_change("ordini", order_id, before.get("status"), status)
     return {"message": "Status aggiornato"}
 
 # Admin House Rules
@@ -2796,6 +4430,7 @@ async def admin_create_unit(data: UnitCreate, admin: dict = Depends(get_admin_us
     unit_id = str(uuid.uuid4())
     unit_doc = {"id": unit_id, **data.model_dump()}
     await db.units.insert_one(unit_doc)
+    unit_names.invalidate()
     return UnitResponse(**unit_doc)
 
 @api_router.put("/admin/units/{unit_id}", response_model=UnitResponse)
@@ -2803,7 +4438,10 @@ async def admin_update_unit(unit_id: str, data: UnitCreate, admin: dict = Depend
     result = await db.units.update_one({"id": unit_id}, {"$set": data.model_dump()})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Unità non trovata")
+    rate_calendars.invalidate(unit_id)
+    unit_names.invalidate()
     unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
+    await checkin_view.sync_unit(unit_id, unit.get("nome"))
     return UnitResponse(**unit)
 
 @api_router.delete("/admin/units/{unit_id}")
@@ -2815,6 +4453,8 @@ async def admin_delete_unit(unit_id: str, admin: dict = Depends(get_admin_user))
     result = await db.units.delete_one({"id": unit_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Unità non trovata")
+    rate_calendars.invalidate(unit_id)
+    unit_names.invalidate()
     return {"message": "Unità eliminata"}
 
 # ==================== ADMIN PRICE PERIODS ====================
@@ -2857,6 +4497,7 @@ async def admin_create_price_period(data: PricePeriodCreate, admin: dict = Depen
     period_id = str(uuid.uuid4())
     period_doc = {"id": period_id, **data.model_dump()}
     await db.price_periods.insert_one(period_doc)
+    rate_calendars.invalidate(data.unit_id)
     return PricePeriodResponse(**period_doc)
 
 @api_router.put("/admin/price-periods/{period_id}", response_model=PricePeriodResponse)
@@ -2864,14 +4505,17 @@ async def admin_update_price_period(period_id: str, data: PricePeriodCreate, adm
     result = await db.price_periods.update_one({"id": period_id}, {"$set": data.model_dump()})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Periodo non trovato")
+    # Il periodo può aver cambiato unità: ricompila tutti i calendari
+    rate_calendars.invalidate()
     period = await db.price_periods.find_one({"id": period_id}, {"_id": 0})
     return PricePeriodResponse(**period)
 
 @api_router.delete("/admin/price-periods/{period_id}")
 async def admin_delete_price_period(period_id: str, admin: dict = Depends(get_admin_user)):
-    result = await db.price_periods.delete_one({"id": period_id})
-    if result.deleted_count == 0:
+    period = await db.price_periods.find_one_and_delete({"id": period_id}, {"_id": 0, "unit_id": 1})
+    if not period:
         raise HTTPException(status_code=404, detail="Periodo non trovato")
+    rate_calendars.invalidate(period.get("unit_id"))
     return {"message": "Periodo eliminato"}
 
 # ==================== ADMIN LONG STAY DISCOUNTS ====================
@@ -2893,13 +4537,15 @@ async def admin_create_discount(data: LongStayDiscountCreate, admin: dict = Depe
     discount_id = str(uuid.uuid4())
     discount_doc = {"id": discount_id, **data.model_dump()}
     await db.discounts.insert_one(discount_doc)
+    rate_calendars.invalidate(data.unit_id)
     return discount_doc
 
 @api_router.delete("/admin/discounts/{discount_id}")
 async def admin_delete_discount(discount_id: str, admin: dict = Depends(get_admin_user)):
-    result = await db.discounts.delete_one({"id": discount_id})
-    if result.deleted_count == 0:
+    discount = await db.discounts.find_one_and_delete({"id": discount_id}, {"_id": 0, "unit_id": 1})
+    if not discount:
         raise HTTPException(status_code=404, detail="Sconto non trovato")
+    rate_calendars.invalidate(discount.get("unit_id"))
     return {"message": "Sconto eliminato"}
 
 # ==================== ADMIN UNIT PRICING CONFIG ====================
@@ -2940,6 +4586,7 @@ async def admin_update_unit_pricing(unit_id: str, data: dict, admin: dict = Depe
     
     if update_data:
         await db.units.update_one({"id": unit_id}, {"$set": update_data})
+        rate_calendars.invalidate(unit_id)
     
     return {"message": "Prezzi aggiornati"}
 
@@ -2963,6 +4610,8 @@ async def admin_create_date_block(data: DateBlockCreate, admin: dict = Depends(g
     block_id = str(uuid.uuid4())
     block_doc = {"id": block_id, **data.model_dump()}
     await db.date_blocks.insert_one(block_doc)
+    availability_index.put_block(block_doc)
+    await occupancy.sync_block(block_doc)
     return DateBlockResponse(**block_doc)
 
 @api_router.delete("/admin/date-blocks/{block_id}")
@@ -2970,57 +4619,182 @@ async def admin_delete_date_block(block_id: str, admin: dict = Depends(get_admin
     result = await db.date_blocks.delete_one({"id": block_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Blocco non trovato")
+    availability_index.discard_block(block_id)
+    await occupancy.discard_block(block_id)
     return {"message": "Blocco eliminato"}
 
 # ==================== iCAL SYNC ====================
 
-def parse_ical_date(dt_str: str) -> str:
-    """Parse iCal date format (YYYYMMDD or YYYYMMDDTHHMMSSZ) to YYYY-MM-DD"""
-    if not dt_str:
+# Fuso della struttura: le date/ora UTC dei feed vengono riportate all'ora locale
+PROPERTY_TIMEZONE = ZoneInfo(os.environ.get('PROPERTY_TIMEZONE', 'Europe/Rome'))
+
+def split_ical_property(line: str) -> tuple:
+    """'DTSTART;TZID=Europe/Rome:20240101T150000' -> ('DTSTART', {'TZID': 'Europe/Rome'}, '20240101T150000')"""
+    # I parametri possono contenere ':' tra virgolette
+    in_quotes = False
+    for pos, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            break
+    else:
         return None
-    # Remove any TZID prefix like TZID=Europe/Rome:
-    if ':' in dt_str and not dt_str.startswith('DTSTART') and not dt_str.startswith('DTEND'):
-        dt_str = dt_str.split(':')[-1]
-    dt_str = dt_str.replace('T', '').replace('Z', '').replace('-', '')[:8]
+    name, *params = line[:pos].split(';')
+    parsed = {}
+    for param in params:
+        key, _, value = param.partition('=')
+        parsed[key.upper()] = value.strip('"')
+    return name.upper(), parsed, line[pos + 1:]
+
+def unescape_ical_text(value: str) -> str:
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+def parse_ical_date(value: str, params: Optional[dict] = None) -> Optional[str]:
+    """
+    Data iCal -> YYYY-MM-DD (ora locale della struttura).
+    Gestisce VALUE=DATE (20240101), date/ora UTC (20240101T150000Z),
+    con TZID (convertite dal loro fuso) e "floating" (usate così come sono).
+    """
+    params = params or {}
+    value = value.strip()
     try:
-        return f"{dt_str[:4]}-{dt_str[4:6]}-{dt_str[6:8]}"
-    except:
+        if params.get('VALUE') == 'DATE' or len(value) == 8:
+            return datetime.strptime(value[:8], '%Y%m%d').strftime('%Y-%m-%d')
+        moment = datetime.strptime(value.rstrip('Z')[:15], '%Y%m%dT%H%M%S')
+    except ValueError:
         return None
+    if value.endswith('Z'):
+        moment = moment.replace(tzinfo=timezone.utc).astimezone(PROPERTY_TIMEZONE)
+    elif params.get('TZID'):
+        try:
+            moment = moment.replace(tzinfo=ZoneInfo(params['TZID'])).astimezone(PROPERTY_TIMEZONE)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass  # TZID non standard (es. definito con VTIMEZONE): ora locale come floating
+    return moment.strftime('%Y-%m-%d')
+
+class ICalStreamParser:
+    """
+    Parser iCal incrementale: riceve il testo a pezzi (feed), ricompone le righe
+    ripiegate al volo e restituisce gli eventi VEVENT completi man mano che si chiudono.
+    La memoria usata dipende dall'evento corrente, non dalla dimensione del feed.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._logical = None  # riga logica in costruzione (con le continuazioni)
+        self._event = None
+
+    def feed(self, chunk: str) -> list:
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split('\n')
+        events = []
+        for line in lines:
+            event = self._push_physical(line.rstrip('\r'))
+            if event:
+                events.append(event)
+        return events
+
+    def close(self) -> list:
+        events = self.feed('\n') if self._buffer else []
+        event = self._finish_logical()
+        if event:
+            events.append(event)
+        return events
+
+    def _push_physical(self, line: str) -> Optional[dict]:
+        # Una riga che inizia con spazio/tab continua la precedente (RFC 5545 §3.1)
+        if line[:1] in (' ', '\t') and self._logical is not None:
+            self._logical += line[1:]
+            return None
+        event = self._finish_logical()
+        self._logical = line
+        return event
+
+    def _finish_logical(self) -> Optional[dict]:
+        line, self._logical = self._logical, None
+        if not line:
+            return None
+        return self._handle(line.strip())
+
+    def _handle(self, line: str) -> Optional[dict]:
+        if line == 'BEGIN:VEVENT':
+            self._event = {}
+            return None
+        if line == 'END:VEVENT':
+            event, self._event = self._event, None
+            return self._complete(event)
+        if self._event is None:
+            return None
+        prop = split_ical_property(line)
+        if not prop:
+            return None
+        name, params, value = prop
+        if name == 'DTSTART':
+            self._event['start'] = parse_ical_date(value, params)
+        elif name == 'DTEND':
+            self._event['end'] = parse_ical_date(value, params)
+        elif name == 'SUMMARY':
+            self._event['summary'] = unescape_ical_text(value)
+        elif name == 'UID':
+            self._event['uid'] = value.strip()
+        elif name == 'STATUS':
+            self._event['status'] = value.strip().upper()
+        elif name == 'SEQUENCE':
+            self._event['sequence'] = int(value) if value.strip().isdigit() else 0
+        return None
+
+    @staticmethod
+    def _complete(event: Optional[dict]) -> Optional[dict]:
+        if not event or not event.get('start'):
+            return None
+        start = event['start']
+        end = event.get('end')
+        # Senza DTEND (o con fine non successiva) l'evento occupa la sola notte d'inizio
+        if not end or end <= start:
+            event['end'] = (datetime.strptime(start, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        return event
+
+def iter_ical_events(chunks):
+    """Generatore di eventi da un iterabile di pezzi di testo iCal"""
+    parser = ICalStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+class ICalEventSet:
+    """
+    Eventi deduplicati man mano che arrivano dal parser: un evento per UID,
+    vince il SEQUENCE più alto (a parità l'ultimo ricevuto); gli eventi
+    STATUS:CANCELLED eliminano l'UID. Tiene solo l'ultima versione di ogni UID.
+    """
+
+    def __init__(self):
+        self._by_uid = {}
+        self._without_uid = []
+
+    def add(self, event: dict):
+        uid = event.get('uid')
+        if not uid:
+            if event.get('status') != 'CANCELLED':
+                self._without_uid.append(event)
+            return
+        current = self._by_uid.get(uid)
+        if current is None or event.get('sequence', 0) >= current.get('sequence', 0):
+            self._by_uid[uid] = event
+
+    def events(self) -> list:
+        return [e for e in self._by_uid.values() if e.get('status') != 'CANCELLED'] + self._without_uid
+
+def dedupe_ical_events(events) -> list:
+    """Un evento per UID (vedi ICalEventSet)"""
+    event_set = ICalEventSet()
+    for event in events:
+        event_set.add(event)
+    return event_set.events()
 
 def parse_ical_content(content: str) -> list:
     """Parse iCal content and extract events"""
-    events = []
-    lines = content.replace('\r\n ', '').replace('\r\n\t', '').split('\n')
-    
-    current_event = None
-    for line in lines:
-        line = line.strip()
-        if line == 'BEGIN:VEVENT':
-            current_event = {}
-        elif line == 'END:VEVENT':
-            if current_event and current_event.get('start') and current_event.get('end'):
-                events.append(current_event)
-            current_event = None
-        elif current_event is not None:
-            if line.startswith('DTSTART'):
-                # Handle various formats: DTSTART:20240101 or DTSTART;VALUE=DATE:20240101
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    current_event['start'] = parse_ical_date(parts[1])
-            elif line.startswith('DTEND'):
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    current_event['end'] = parse_ical_date(parts[1])
-            elif line.startswith('SUMMARY'):
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    current_event['summary'] = parts[1]
-            elif line.startswith('UID'):
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    current_event['uid'] = parts[1]
-    
-    return events
+    return dedupe_ical_events(iter_ical_events([content]))
 
 def generate_ical_content(unit: dict, bookings: list, blocks: list) -> str:
     """Generate iCal content for export"""
@@ -3080,36 +4854,100 @@ def generate_ical_content(unit: dict, bookings: list, blocks: list) -> str:
     lines.append('END:VCALENDAR')
     return '\r\n'.join(lines)
 
+ICAL_EXPORT_GZIP = os.environ.get('ICAL_EXPORT_GZIP', 'true').lower() != 'false'
+
+class ICalExportCache:
+    """
+    File .ics già generati per unità, validi finché la revisione dell'unità
+    (prenotazioni, blocchi, dati unità) non cambia. Conserva anche la versione gzip.
+    """
+
+    def __init__(self):
+        self._entries = {}  # unit_id -> dict(revision, body, gzip_body, etag, last_modified)
+        self.hits = 0
+        self.renders = 0
+
+    async def get(self, unit_id: str) -> Optional[dict]:
+        # Revisione letta prima del DB: una modifica concorrente produce una revisione nuova
+        revision = unit_revisions.get(unit_id)
+        entry = self._entries.get(unit_id)
+        if entry and entry["revision"] == revision:
+            self.hits += 1
+            return entry
+        
+        unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
+        if not unit:
+            self._entries.pop(unit_id, None)
+            return None
+        
+        # Get confirmed bookings
+        bookings = await db.bookings.find({
+            "unit_id": unit_id,
+            "status": {"$in": ACTIVE_BOOKING_STATUSES}
+        }, {"_id": 0}).to_list(500)
+        
+        # Get date blocks
+        blocks = await db.date_blocks.find({"unit_id": unit_id}, {"_id": 0}).to_list(500)
+        
+        body = generate_ical_content(unit, bookings, blocks).encode()
+        entry = {
+            "revision": revision,
+            "body": body,
+            "gzip_body": gzip.compress(body) if ICAL_EXPORT_GZIP else None,
+            "etag": f'"ics-{unit_id}-{revision}"',
+            "last_modified": datetime.now(timezone.utc).replace(microsecond=0)
+        }
+        self._entries[unit_id] = entry
+        self.renders += 1
+        return entry
+
+    def stats(self) -> dict:
+        return {"units": len(self._entries), "hits": self.hits, "renders": self.renders}
+
+ical_export_cache = ICalExportCache()
+
+def not_modified_since(request: Request, last_modified: datetime) -> bool:
+    header = request.headers.get("if-modified-since")
+    if not header:
+        return False
+    try:
+        return parsedate_to_datetime(header) >= last_modified
+    except (TypeError, ValueError):
+        return False
+
 # Public iCal export endpoint (no auth required for external services)
 @api_router.get("/ical/{unit_id}.ics")
-async def export_ical(unit_id: str):
+async def export_ical(request: Request, unit_id: str):
     """Export calendar in iCal format for Booking.com/Airbnb import"""
-    from fastapi.responses import Response
-    
-    unit = await db.units.find_one({"id": unit_id}, {"_id": 0})
-    if not unit:
+    entry = await ical_export_cache.get(unit_id)
+    if not entry:
         raise HTTPException(status_code=404, detail="Unità non trovata")
     
-    # Get confirmed bookings
-    bookings = await db.bookings.find({
-        "unit_id": unit_id,
-        "status": {"$in": ["confirmed", "pending"]}
-    }, {"_id": 0}).to_list(500)
-    
-    # Get date blocks
-    blocks = await db.date_blocks.find({"unit_id": unit_id}, {"_id": 0}).to_list(500)
-    
-    # Generate iCal content
-    ical_content = generate_ical_content(unit, bookings, blocks)
-    
-    return Response(
-        content=ical_content,
-        media_type="text/calendar",
-        headers={
-            "Content-Disposition": f'attachment; filename="{unit_id}.ics"',
-            "Cache-Control": "no-cache, no-store, must-revalidate"
-        }
-    )
+    headers = {
+        "ETag": entry["etag"],
+        "Last-Modified": format_datetime(entry["last_modified"], usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }
+    # If-None-Match ha la precedenza su If-Modified-Since (RFC 9110)
+    if request.headers.get("if-none-match"):
+        if etag_matches(request, entry["etag"]):
+            return Response(status_code=304, headers=headers)
+    elif not_modified_since(request, entry["last_modified"]):
+        return Response(status_code=304, headers=headers)
+    
+    headers["Content-Disposition"] = f'attachment; filename="{unit_id}.ics"'
+    content = entry["body"]
+    if entry["gzip_body"] and "gzip" in request.headers.get("accept-encoding", ""):
+        content = entry["gzip_body"]
+        headers["Content-Encoding"] = "gzip"
+    
+    return Response(content=content, media_type="text/calendar", headers=headers)
+
+@api_router.get("/admin/ical/export-cache/stats")
+async def admin_get_ical_export_cache_stats(admin: dict = Depends(get_admin_user)):
+    """Statistiche della cache degli export iCal"""
+    return ical_export_cache.stats()
 
 # Admin iCal feed management
 @api_router.get("/admin/ical/feeds")
@@ -3140,8 +4978,10 @@ async def admin_create_ical_feed(data: ICalFeedCreate, admin: dict = Depends(get
         "nome": data.nome,
         "url": data.url,
         "attivo": data.attivo,
+        "intervallo_minuti": data.intervallo_minuti,
         "ultima_sincronizzazione": None,
         "eventi_importati": 0,
+        "eventi_trovati": 0,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.ical_feeds.insert_one(feed_doc)
@@ -3160,8 +5000,22 @@ async def admin_update_ical_feed(feed_id: str, data: dict, admin: dict = Depends
         update_data["nome"] = data["nome"]
     if "url" in data:
         update_data["url"] = data["url"]
+        # Nuovo URL: i validatori HTTP del vecchio feed non valgono più
+        update_data["http_etag"] = None
+        update_data["http_last_modified"] = None
     if "attivo" in data:
         update_data["attivo"] = data["attivo"]
+    if "intervallo_minuti" in data:
+        intervallo = data["intervallo_minuti"]
+        if intervallo in (None, "", 0):
+            update_data["intervallo_minuti"] = None  # torna all'intervallo globale
+        else:
+            try:
+                if isinstance(intervallo, bool) or float(intervallo) != int(float(intervallo)):
+                    raise ValueError
+                update_data["intervallo_minuti"] = max(int(float(intervallo)), 5)
+            except (TypeError, ValueError, OverflowError):
+                raise HTTPException(status_code=400, detail="intervallo_minuti deve essere un numero intero di minuti")
     
     if update_data:
         await db.ical_feeds.update_one({"id": feed_id}, {"$set": update_data})
@@ -3178,12 +5032,301 @@ async def admin_delete_ical_feed(feed_id: str, admin: dict = Depends(get_admin_u
     
     # Delete associated date blocks
     await db.date_blocks.delete_many({"ical_feed_id": feed_id})
+    availability_index.invalidate(feed["unit_id"])
+    await occupancy.sync_feed_blocks(feed_id)
     
     # Delete feed
     await db.ical_feeds.delete_one({"id": feed_id})
     
     return {"message": "Feed e blocchi associati eliminati"}
 
+ICAL_SYNC_CONCURRENCY = int(os.environ.get('ICAL_SYNC_CONCURRENCY', 4))
+ICAL_FETCH_TIMEOUT = 30.0
+
+_ical_http_client: Optional[httpx.AsyncClient] = None
+
+def get_ical_http_client() -> httpx.AsyncClient:
+    """Client HTTP condiviso (connessioni riutilizzate) per scaricare i feed iCal"""
+    global _ical_http_client
+    if _ical_http_client is None or _ical_http_client.is_closed:
+        _ical_http_client = httpx.AsyncClient(
+            timeout=ICAL_FETCH_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=ICAL_SYNC_CONCURRENCY * 2, max_keepalive_connections=ICAL_SYNC_CONCURRENCY)
+        )
+    return _ical_http_client
+
+def ical_feed_source(feed: dict) -> str:
+    """Determine source based on feed name or URL"""
+    nome_lower = feed["nome"].lower()
+    url_lower = feed["url"].lower()
+    if "booking" in nome_lower or "booking" in url_lower:
+        return "booking"
+    if "airbnb" in nome_lower or "airbnb" in url_lower:
+        return "airbnb"
+    return "ical"
+
+def ical_event_key(event_uid: Optional[str], start: str, end: str) -> str:
+    """Chiave di riconciliazione: UID dell'evento, oppure le date se il feed non lo fornisce"""
+    return event_uid or f"{start}/{end}"
+
+async def reconcile_ical_blocks(feed: dict, events: list) -> dict:
+    """
+    Allinea i blocchi del feed agli eventi ricevuti confrontando per ical_uid:
+    inserisce i nuovi, aggiorna i modificati (mantenendo l'id del blocco), elimina gli scomparsi.
+    Inserimenti e aggiornamenti precedono le cancellazioni nella stessa bulk_write ordinata,
+    così l'unità non resta mai senza blocchi a metà sincronizzazione.
+    """
+    source = ical_feed_source(feed)
+    desired = {}
+    for event in events:
+        # In caso di UID duplicati vale l'ultima occorrenza
+        desired[ical_event_key(event.get("uid"), event["start"], event["end"])] = {
+            "data_inizio": event["start"],
+            "data_fine": event["end"],
+            "motivo": event.get("summary", f"Prenotazione {feed['nome']}"),
+            "source": source,
+            "ical_uid": event.get("uid")
+        }
+    
+    existing, duplicates = {}, []
+    async for block in db.date_blocks.find({"ical_feed_id": feed["id"]}, {"_id": 0}):
+        key = ical_event_key(block.get("ical_uid"), block.get("data_inizio"), block.get("data_fine"))
+        if key in existing:
+            # Duplicato lasciato da sincronizzazioni precedenti
+            duplicates.append(block["id"])
+        else:
+            existing[key] = block
+    
+    inserts, updates, deletes = [], [], []
+    for key, fields in desired.items():
+        block = existing.get(key)
+        if block is None:
+            inserts.append(InsertOne({
+                "id": str(uuid.uuid4()),
+                "unit_id": feed["unit_id"],
+                "ical_feed_id": feed["id"],
+                **fields
+            }))
+        elif any(block.get(field) != value for field, value in fields.items()):
+            updates.append(UpdateOne({"id": block["id"]}, {"$set": fields}))
+    for key, block in existing.items():
+        if key not in desired:
+            deletes.append(DeleteOne({"id": block["id"]}))
+    deletes.extend(DeleteOne({"id": block_id}) for block_id in duplicates)
+    
+    operations = inserts + updates + deletes
+    if operations:
+        await db.date_blocks.bulk_write(operations, ordered=True)
+        await occupancy.sync_feed_blocks(feed["id"])
+    
+    return {
+        "nuovi_blocchi": len(inserts),
+        "blocchi_aggiornati": len(updates),
+        "blocchi_rimossi": len(deletes),
+        "blocchi_attivi": len(desired)
+    }
+
+async def sync_ical_feed(feed: dict) -> dict:
+    """
+    Sincronizza un singolo feed. GET condizionale con ETag/Last-Modified salvati sul feed:
+    se il calendario remoto non è cambiato (304) non si tocca il DB.
+    """
+    result = {
+        "feed_id": feed["id"],
+        "feed_nome": feed["nome"],
+        "eventi_trovati": 0,
+        "nuovi_blocchi": 0,
+        "blocchi_aggiornati": 0,
+        "blocchi_rimossi": 0,
+        "non_modificato": False,
+        "errore": None
+    }
+    
+    headers = {}
+    if feed.get("http_etag"):
+        headers["If-None-Match"] = feed["http_etag"]
+    if feed.get("http_last_modified"):
+        headers["If-Modified-Since"] = feed["http_last_modified"]
+    
+    try:
+        # Fetch iCal content, parsed chunk by chunk as it arrives
+        async with get_ical_http_client().stream("GET", feed["url"], headers=headers) as response:
+            if response.status_code == 304:
+                result["non_modificato"] = True
+                # Stesso calendario dell'ultima lettura completa: stessi eventi trovati
+                result["eventi_trovati"] = feed.get("eventi_trovati", 0)
+                await db.ical_feeds.update_one(
+                    {"id": feed["id"]},
+                    {"$set": {"ultima_sincronizzazione": datetime.now(timezone.utc).isoformat()}}
+                )
+                return result
+            response.raise_for_status()
+            
+            # Deduplica durante la lettura: in memoria resta una versione per UID,
+            # che serve comunque alla riconciliazione (i blocchi assenti vanno rimossi)
+            parser = ICalStreamParser()
+            event_set = ICalEventSet()
+            async for chunk in response.aiter_text():
+                for event in parser.feed(chunk):
+                    event_set.add(event)
+            for event in parser.close():
+                event_set.add(event)
+        events = event_set.events()
+        result["eventi_trovati"] = len(events)
+        
+        # Riconciliazione per ical_uid: solo le differenze, in un'unica bulk_write
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        changes = await reconcile_ical_blocks(feed, [e for e in events if e.get('end', '') >= today])
+        result.update(changes)
+        
+        # Update feed stats and validators for the next conditional GET
+        await db.ical_feeds.update_one(
+            {"id": feed["id"]},
+            {"$set": {
+                "ultima_sincronizzazione": datetime.now(timezone.utc).isoformat(),
+                "eventi_importati": changes["blocchi_attivi"],
+                "eventi_trovati": len(events),
+                "http_etag": response.headers.get("etag"),
+                "http_last_modified": response.headers.get("last-modified")
+            }}
+        )
+        
+    except httpx.HTTPError as e:
+        result["errore"] = f"Errore HTTP: {str(e)}"
+    except Exception as e:
+        result["errore"] = f"Errore: {str(e)}"
+    
+    # Blocchi del feed modificati (o stato incerto dopo un errore): l'unità verrà ricaricata alla prossima verifica
+    if result["errore"] or result["nuovi_blocchi"] or result["blocchi_aggiornati"] or result["blocchi_rimossi"]:
+        availability_index.invalidate(feed["unit_id"])
+    return result
+
+ICAL_SYNC_INTERVAL_MINUTES = int(os.environ.get('ICAL_SYNC_INTERVAL_MINUTES', 30))
+ICAL_SCHEDULER_TICK_SECONDS = 30
+ICAL_SYNC_MAX_BACKOFF = 16  # moltiplicatore massimo dell'intervallo per feed in errore
+
+class ICalSyncScheduler:
+    """
+    Sincronizzazione periodica dei feed iCal in background.
+    Ogni feed ha il suo intervallo (campo intervallo_minuti, default ICAL_SYNC_INTERVAL_MINUTES)
+    con un po' di jitter; i feed in errore raddoppiano l'attesa fino a ICAL_SYNC_MAX_BACKOFF volte.
+    Il lock è condiviso con la sincronizzazione manuale, così due run non si sovrappongono mai.
+    """
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self._feeds = {}  # feed_id -> stato dell'ultima sincronizzazione
+        self._task = None
+        self.last_run = None
+        self.last_duration_ms = None
+
+    @staticmethod
+    def _interval(feed: dict) -> timedelta:
+        return timedelta(minutes=feed.get("intervallo_minuti") or ICAL_SYNC_INTERVAL_MINUTES)
+
+    def _state(self, feed: dict) -> dict:
+        state = self._feeds.get(feed["id"])
+        if state is None:
+            # Primo avvio: riparte dall'ultima sincronizzazione registrata sul feed
+            last = feed.get("ultima_sincronizzazione")
+            next_due = datetime.now(timezone.utc)
+            if last:
+                try:
+                    next_due = datetime.fromisoformat(last) + self._interval(feed)
+                except ValueError:
+                    pass
+            state = {"failures": 0, "last_run": last, "duration_ms": None, "last_error": None, "next_due": next_due}
+            self._feeds[feed["id"]] = state
+        return state
+
+    def record(self, feed: dict, result: dict, duration_ms: float):
+        state = self._state(feed)
+        state["failures"] = state["failures"] + 1 if result["errore"] else 0
+        state["last_error"] = result["errore"]
+        state["last_run"] = datetime.now(timezone.utc).isoformat()
+        state["duration_ms"] = round(duration_ms)
+        interval = self._interval(feed) * min(2 ** state["failures"], ICAL_SYNC_MAX_BACKOFF)
+        jitter = interval.total_seconds() * random.uniform(0, 0.1)
+        state["next_due"] = datetime.now(timezone.utc) + interval + timedelta(seconds=jitter)
+
+    async def run_due(self):
+        feeds = await db.ical_feeds.find({"attivo": True}, {"_id": 0}).to_list(100)
+        # Feed eliminati o disattivati escono dallo stato
+        active_ids = {feed["id"] for feed in feeds}
+        for feed_id in list(self._feeds):
+            if feed_id not in active_ids:
+                del self._feeds[feed_id]
+        now = datetime.now(timezone.utc)
+        due = [feed for feed in feeds if self._state(feed)["next_due"] <= now]
+        if due:
+            started = time.perf_counter()
+            await sync_ical_feeds(due)
+            self.last_run = now.isoformat()
+            self.last_duration_ms = round((time.perf_counter() - started) * 1000)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"iCal scheduler error: {e}")
+            await asyncio.sleep(ICAL_SCHEDULER_TICK_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "sync_in_corso": self.lock.locked(),
+            "intervallo_default_minuti": ICAL_SYNC_INTERVAL_MINUTES,
+            "last_run": self.last_run,
+            "last_duration_ms": self.last_duration_ms,
+            "feeds": [
+                {
+                    "feed_id": feed_id,
+                    "last_run": state["last_run"],
+                    "duration_ms": state["duration_ms"],
+                    "failures": state["failures"],
+                    "last_error": state["last_error"],
+                    "next_due": state["next_due"].isoformat()
+                }
+                for feed_id, state in self._feeds.items()
+            ]
+        }
+
+ical_scheduler = ICalSyncScheduler()
+
+async def sync_ical_feeds(feeds: list) -> list:
+    """
+    Sincronizza i feed in parallelo, al massimo ICAL_SYNC_CONCURRENCY alla volta.
+    Serializzata dal lock dello scheduler (manuale e periodica non si sovrappongono).
+    """
+    semaphore = asyncio.Semaphore(ICAL_SYNC_CONCURRENCY)
+    
+    async def run(feed: dict) -> dict:
+        async with semaphore:
+            started = time.perf_counter()
+            result = await sync_ical_feed(feed)
+            ical_scheduler.record(feed, result, (time.perf_counter() - started) * 1000)
+            return result
+    
+    async with ical_scheduler.lock:
+        return await asyncio.gather(*(run(feed) for feed in feeds))
+
 @api_router.post("/admin/ical/sync")
 async def admin_sync_ical_feeds(admin: dict = Depends(get_admin_user), unit_id: Optional[str] = None, feed_id: Optional[str] = None):
     """Sync all active iCal feeds (or specific unit/feed)"""
@@ -3194,79 +5337,7 @@ async def admin_sync_ical_feeds(admin: dict = Depends(get_admin_user), unit_id:
         query["id"] = feed_id
     
     feeds = await db.ical_feeds.find(query, {"_id": 0}).to_list(100)
-    results = []
-    
-    for feed in feeds:
-        result = {
-            "feed_id": feed["id"],
-            "feed_nome": feed["nome"],
-            "eventi_trovati": 0,
-            "nuovi_blocchi": 0,
-            "errore": None
-        }
-        
-        try:
-            # Fetch iCal content
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(feed["url"])
-                response.raise_for_status()
-                ical_content = response.text
-            
-            # Parse events
-            events = parse_ical_content(ical_content)
-            result["eventi_trovati"] = len(events)
-            
-            # Delete old blocks from this feed
-            await db.date_blocks.delete_many({"ical_feed_id": feed["id"]})
-            
-            # Create new date blocks for each event
-            today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-            new_blocks = 0
-            
-            for event in events:
-                # Skip past events
-                if event.get('end', '') < today:
-                    continue
-                
-                # Determine source based on feed name or URL
-                source = "ical"
-                nome_lower = feed["nome"].lower()
-                url_lower = feed["url"].lower()
-                if "booking" in nome_lower or "booking" in url_lower:
-                    source = "booking"
-                elif "airbnb" in nome_lower or "airbnb" in url_lower:
-                    source = "airbnb"
-                
-                block_doc = {
-                    "id": str(uuid.uuid4()),
-                    "unit_id": feed["unit_id"],
-                    "data_inizio": event["start"],
-                    "data_fine": event["end"],
-                    "motivo": event.get("summary", f"Prenotazione {feed['nome']}"),
-                    "source": source,
-                    "ical_feed_id": feed["id"],
-                    "ical_uid": event.get("uid")
-                }
-                await db.date_blocks.insert_one(block_doc)
-                new_blocks += 1
-            
-            result["nuovi_blocchi"] = new_blocks
-            
-            # Update feed stats
-            await db.ical_feeds.update_one(
-                {"id": feed["id"]},
-                {"$set": {
-                    "ultima_sincronizzazione": datetime.now(timezone.utc).isoformat(),
-                    "eventi_importati": new_blocks
-                }}
-            )
-            
-        except httpx.HTTPError as e:
-            result["errore"] = f"Errore HTTP: {str(e)}"
-        except Exception as e:
-            result["errore"] = f"Errore: {str(e)}"
-        
-        results.append(result)
+    results = await sync_ical_feeds(feeds)
     
     total_eventi = sum(r["eventi_trovati"] for r in results)
     total_blocchi = sum(r["nuovi_blocchi"] for r in results)
@@ -3275,10 +5346,16 @@ async def admin_sync_ical_feeds(admin: dict = Depends(get_admin_user), unit_id:
     return {
         "message": f"Sincronizzazione completata: {total_eventi} eventi trovati, {total_blocchi} blocchi creati",
         "feeds_processati": len(results),
+        "non_modificati": sum(1 for r in results if r["non_modificato"]),
         "errori": len(errori),
         "dettagli": results
     }
 
+@api_router.get("/admin/ical/scheduler")
+async def admin_get_ical_scheduler_status(admin: dict = Depends(get_admin_user)):
+    """Stato della sincronizzazione automatica: ultimo run, durata e prossima scadenza per feed"""
+    return ical_scheduler.status()
+
 @api_router.get("/admin/ical/export-url/{unit_id}")
 async def admin_get_export_url(unit_id: str, admin: dict = Depends(get_admin_user)):
     """Get the iCal export URL for a unit"""
@@ -3308,98 +5385,99 @@ async def admin_get_statistics(admin: dict = Depends(get_admin_user)):
     current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     current_year_start = now.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    # Get all bookings
-    all_bookings = await db.bookings.find({}, {"_id": 0}).to_list(1000)
-    
-    # Current month bookings
-    month_bookings = [b for b in all_bookings if b.get('data_arrivo', '') >= current_month_start.strftime('%Y-%m-%d')]
+    month_start_str = current_month_start.strftime('%Y-%m-%d')
+    year_start_str = current_year_start.strftime('%Y-%m-%d')
     
-    # Year bookings
-    year_bookings = [b for b in all_bookings if b.get('data_arrivo', '') >= current_year_start.strftime('%Y-%m-%d')]
+    # Months shown in the chart (last 6 months)
+    trend_months = []
+    for i in range(5, -1, -1):
+        month_date = now - timedelta(days=30*i)
+        trend_months.append((month_date.strftime('%Y-%m'), month_date.strftime('%b')))
     
-    # Calculate nights sold
-    def count_nights(booking):
-        try:
-            start = datetime.fromisoformat(booking['data_arrivo'])
-            end = datetime.fromisoformat(booking['data_partenza'])
-            return (end - start).days
-        except:
-            return 0
+    # Upcoming check-ins (next 7 days)
+    next_week = (now + timedelta(days=7)).strftime('%Y-%m-%d')
+    today = now.strftime('%Y-%m-%d')
     
-    total_nights_month = sum(count_nights(b) for b in month_bookings)
-    total_nights_year = sum(count_nights(b) for b in year_bookings)
+    # Source breakdown (from notes)
+    note_expr = {"$ifNull": ["$note", ""]}
+    source_expr = {"$switch": {
+        "branches": [
+            {"case": {"$regexMatch": {"input": note_expr, "regex": "airbnb", "options": "i"}}, "then": "airbnb"},
+            {"case": {"$regexMatch": {"input": note_expr, "regex": "booking", "options": "i"}}, "then": "booking"},
+            {"case": {"$regexMatch": {"input": note_expr, "regex": "\\[whatsapp\\]", "options": "i"}}, "then": "whatsapp"},
+            {"case": {"$regexMatch": {"input": note_expr, "regex": "\\[(telefono|phone)\\]", "options": "i"}}, "then": "phone"},
+        ],
+        "default": "direct"
+    }}
+    
+    # Bookings by arrival: counts, sources and upcoming check-ins
+    pipeline = [
+        {"$match": {"data_arrivo": {"$gte": year_start_str}}},
+        {"$facet": {
+            "month": [{"$match": {"data_arrivo": {"$gte": month_start_str}}}, {"$count": "count"}],
+            "year": [{"$match": {"data_arrivo": {"$gte": year_start_str}}}, {"$count": "count"}],
+            "sources": [
+                {"$match": {"data_arrivo": {"$gte": year_start_str}}},
+                {"$group": {"_id": source_expr, "count": {"$sum": 1}}}
+            ],
+            "upcoming_count": [{"$match": {"data_arrivo": {"$gte": today, "$lte": next_week}}}, {"$count": "count"}],
+            "upcoming_list": [
+                {"$match": {"data_arrivo": {"$gte": today, "$lte": next_week}}},
+                {"$limit": 5},
+                {"$project": {"_id": 0}}
+            ]
+        }}
+    ]
+    facets = (await db.bookings.aggregate(pipeline).to_list(1))[0]
     
     # Get units for occupancy calculation
-    units = await db.units.find({"attivo": True}, {"_id": 0}).to_list(10)
-    num_units = len(units) if units else 1
+    units_count = await db.units.count_documents({"attivo": True})
+    num_units = units_count or 1
     
     # Days in current month
     next_month = current_month_start.replace(month=current_month_start.month % 12 + 1) if current_month_start.month < 12 else current_month_start.replace(year=current_month_start.year + 1, month=1)
     days_in_month = (next_month - current_month_start).days
     available_nights_month = days_in_month * num_units
     
-    # Occupancy rate
-    occupancy_rate = round((total_nights_month / available_nights_month * 100), 1) if available_nights_month > 0 else 0
+    # Nights sold and revenue by the month each night falls in (materialized table, confirmed/completed only)
+    months = await occupancy.monthly(
+        min(year_start_str, f"{trend_months[0][0]}-01"), next_month.strftime('%Y-%m-%d'), ["confirmed", "completed"]
+    )
+    empty = {"bookings": 0, "nights": 0, "revenue": 0}
+    month_totals = months.get(current_month_start.strftime('%Y-%m'), empty)
+    year_rows = [row for key, row in months.items() if key >= year_start_str[:7]]
     
-    # Revenue calculation (from notes or estimated)
-    def extract_revenue(booking):
-        # Try to get price from booking or estimate
-        if 'prezzo_totale' in booking:
-            return booking['prezzo_totale']
-        # Estimate based on nights (average €100/night)
-        return count_nights(booking) * 100
+    total_nights_month = int(month_totals["nights"])
+    total_nights_year = int(sum(row["nights"] for row in year_rows))
     
-    revenue_month = sum(extract_revenue(b) for b in month_bookings if b.get('status') in ['confirmed', 'completed'])
-    revenue_year = sum(extract_revenue(b) for b in year_bookings if b.get('status') in ['confirmed', 'completed'])
+    # Occupancy rate: confirmed nights falling in the current month
+    occupancy_rate = round((total_nights_month / available_nights_month * 100), 1) if available_nights_month > 0 else 0
     
-    # Source breakdown (from notes)
-    def get_source(booking):
-        note = booking.get('note', '') or ''
-        note_lower = note.lower()
-        if '[airbnb]' in note_lower or 'airbnb' in note_lower:
-            return 'airbnb'
-        elif '[booking' in note_lower or 'booking' in note_lower:
-            return 'booking'
-        elif '[whatsapp]' in note_lower:
-            return 'whatsapp'
-        elif '[telefono]' in note_lower or '[phone]' in note_lower:
-            return 'phone'
-        else:
-            return 'direct'
+    revenue_month = round(month_totals["revenue"], 2)
+    revenue_year = round(sum(row["revenue"] for row in year_rows), 2)
     
     source_counts = {'airbnb': 0, 'booking': 0, 'direct': 0, 'phone': 0, 'whatsapp': 0}
-    for b in year_bookings:
-        source = get_source(b)
-        source_counts[source] = source_counts.get(source, 0) + 1
+    for row in facets["sources"]:
+        source_counts[row["_id"]] = row["count"]
     
-    # Monthly breakdown for chart (last 6 months)
-    monthly_data = []
-    for i in range(5, -1, -1):
-        month_date = now - timedelta(days=30*i)
-        month_str = month_date.strftime('%Y-%m')
-        month_name = month_date.strftime('%b')
-        
-        month_bookings_count = len([b for b in all_bookings if b.get('data_arrivo', '').startswith(month_str)])
-        month_revenue = sum(extract_revenue(b) for b in all_bookings if b.get('data_arrivo', '').startswith(month_str) and b.get('status') in ['confirmed', 'completed'])
-        
-        monthly_data.append({
+    monthly_data = [
+        {
             'month': month_name,
-            'bookings': month_bookings_count,
-            'revenue': month_revenue
-        })
+            'bookings': months.get(month_str, empty)["bookings"],
+            'revenue': round(months.get(month_str, empty)["revenue"], 2)
+        }
+        for month_str, month_name in trend_months
+    ]
     
-    # Upcoming check-ins (next 7 days)
-    next_week = (now + timedelta(days=7)).strftime('%Y-%m-%d')
-    today = now.strftime('%Y-%m-%d')
-    upcoming_checkins = [b for b in all_bookings if today <= b.get('data_arrivo', '') <= next_week]
+    upcoming_count = facets["upcoming_count"][0]["count"] if facets["upcoming_count"] else 0
     
     # Get guests count
     guests_count = await db.guests.count_documents({})
     
     return {
         "overview": {
-            "total_bookings_month": len(month_bookings),
-            "total_bookings_year": len(year_bookings),
+            "total_bookings_month": facets["month"][0]["count"] if facets["month"] else 0,
+            "total_bookings_year": facets["year"][0]["count"] if facets["year"] else 0,
             "nights_sold_month": total_nights_month,
             "nights_sold_year": total_nights_year,
             "occupancy_rate": occupancy_rate,
@@ -3410,8 +5488,8 @@ async def admin_get_statistics(admin: dict = Depends(get_admin_user)):
         },
         "source_breakdown": source_counts,
         "monthly_trend": monthly_data,
-        "upcoming_checkins": len(upcoming_checkins),
-        "upcoming_checkins_list": upcoming_checkins[:5]
+        "upcoming_checkins": upcoming_count,
+        "upcoming_checkins_list": facets["upcoming_list"]
     }
 
 @api_router.get("/admin/statistics/report")
@@ -3438,24 +5516,8 @@ async def admin_get_monthly_report(admin: dict = Depends(get_admin_user), month:
     else:
         next_month = report_date.replace(month=report_date.month + 1)
     
-    # Get all bookings for the month
-    bookings = await db.bookings.find({
-        "data_arrivo": {"$gte": month_str + "-01", "$lt": next_month.strftime('%Y-%m') + "-01"}
-    }, {"_id": 0}).to_list(500)
-    
-    # Calculate metrics
-    def count_nights(booking):
-        try:
-            start = datetime.fromisoformat(booking['data_arrivo'])
-            end = datetime.fromisoformat(booking['data_partenza'])
-            return (end - start).days
-        except:
-            return 0
-    
-    def extract_revenue(booking):
-        if 'prezzo_totale' in booking:
-            return booking['prezzo_totale']
-        return count_nights(booking) * 100
+    month_start = f"{month_str}-01"
+    month_end = next_month.strftime('%Y-%m') + "-01"
     
     def get_source(booking):
         note = booking.get('note', '') or ''
@@ -3471,43 +5533,48 @@ async def admin_get_monthly_report(admin: dict = Depends(get_admin_user), month:
         else:
             return 'Diretto'
     
-    confirmed_bookings = [b for b in bookings if b.get('status') in ['confirmed', 'completed']]
-    cancelled_bookings = [b for b in bookings if b.get('status') == 'cancelled']
-    
-    total_nights = sum(count_nights(b) for b in confirmed_bookings)
-    total_revenue = sum(extract_revenue(b) for b in confirmed_bookings)
-    avg_stay = round(total_nights / len(confirmed_bookings), 1) if confirmed_bookings else 0
-    
-    # Daily breakdown
+    # Notti e ricavi del mese dalla tabella di occupazione: ogni riga porta la sua quota di ricavo
     days_in_month = (next_month - report_date).days
+    daily = await occupancy.daily(month_start, month_end, ["confirmed", "completed"])
     daily_occupancy = []
     for day in range(1, days_in_month + 1):
-        day_str = f"{month_str}-{str(day).zfill(2)}"
-        occupied = len([b for b in confirmed_bookings if b['data_arrivo'] <= day_str < b['data_partenza']])
-        daily_occupancy.append({"day": day, "occupied": occupied})
+        row = daily.get(f"{month_str}-{str(day).zfill(2)}", {})
+        daily_occupancy.append({"day": day, "occupied": row.get("occupied", 0), "blocked": row.get("blocked", 0)})
+    total_nights = sum(d["occupied"] for d in daily_occupancy)
+    total_revenue = round(sum(row.get("revenue", 0) for row in daily.values()), 2)
+    num_units = await db.units.count_documents({"attivo": True}) or 1
     
-    # Booking details for report
+    # Elenco delle prenotazioni con arrivo nel mese (per il dettaglio del PDF)
     booking_details = []
-    for b in confirmed_bookings:
+    cancelled_count = 0
+    async for b in db.bookings.find(
+        {"data_arrivo": {"$gte": month_start, "$lt": month_end}, "status": {"$in": ["confirmed", "completed", "cancelled"]}},
+        {"_id": 0, "nome_ospite": 1, "data_arrivo": 1, "data_partenza": 1, "note": 1, "prezzo_totale": 1, "status": 1}
+    ).sort("data_arrivo", 1):
+        if b.get('status') == 'cancelled':
+            cancelled_count += 1
+            continue
+        notti = len(booking_nights(b.get('data_arrivo'), b.get('data_partenza')))
         booking_details.append({
             "nome_ospite": b.get('nome_ospite', 'N/A'),
             "data_arrivo": b.get('data_arrivo'),
             "data_partenza": b.get('data_partenza'),
-            "notti": count_nights(b),
+            "notti": notti,
             "provenienza": get_source(b),
-            "revenue": extract_revenue(b)
+            "revenue": b['prezzo_totale'] if 'prezzo_totale' in b else notti * 100
         })
+    avg_stay = round(sum(d["notti"] for d in booking_details) / len(booking_details), 1) if booking_details else 0
     
     return {
         "report_month": month_name,
         "generated_at": datetime.now(timezone.utc).isoformat(),
         "summary": {
-            "total_bookings": len(confirmed_bookings),
-            "cancelled_bookings": len(cancelled_bookings),
+            "total_bookings": len(booking_details),
+            "cancelled_bookings": cancelled_count,
             "total_nights": total_nights,
             "total_revenue": total_revenue,
             "average_stay": avg_stay,
-            "occupancy_rate": round((total_nights / (days_in_month * 2)) * 100, 1)  # Assuming 2 units
+            "occupancy_rate": round((total_nights / (days_in_month * num_units)) * 100, 1)
         },
         "daily_occupancy": daily_occupancy,
         "bookings": booking_details
@@ -3646,7 +5713,7 @@ async def request_checkin_link(booking_code: str):
         token = existing_checkin["token"]
     else:
         token = str(uuid.uuid4())
-        await db.online_checkins.insert_one({
+        checkin_doc = {
             "id": str(uuid.uuid4()),
             "booking_id": booking["id"],
             "token": token,
@@ -3654,7 +5721,9 @@ async def request_checkin_link(booking_code: str):
             "created_at": datetime.now(timezone.utc).isoformat(),
             "completed_at": None,
             "guest_data": None
-        })
+        }
+        await db.online_checkins.insert_one(checkin_doc)
+        await checkin_view.put("online", checkin_doc, booking)
     
     return {
         "message": "Link check-in generato",
@@ -3721,6 +5790,7 @@ async def submit_checkin(token: str, data: dict):
             "firma_digitale": data.get("firma_digitale", False)
         }}
     )
+    await checkin_view.sync_checkin("online", checkin["id"])
     
     # Update booking
     booking = await db.bookings.find_one({"id": checkin["booking_id"]})
@@ -3736,17 +5806,11 @@ async def submit_checkin(token: str, data: dict):
     }
 
 @api_router.get("/admin/checkins/online")
-async def admin_get_online_checkins(admin: dict = Depends(get_admin_user)):
+async def admin_get_online_checkins(admin: dict = Depends(get_admin_user),
+                                    limit: int = 100, cursor: Optional[str] = None,
+                                    fields: Optional[str] = None, count: bool = False):
     """Get all online check-ins"""
-    checkins = await db.online_checkins.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
-    # Enrich with booking data
-    for checkin in checkins:
-        booking = await db.bookings.find_one({"id": checkin["booking_id"]}, {"_id": 0})
-        if booking:
-            checkin["booking"] = booking
-    
-    return checkins
+    return await page_response(db.checkin_view, {"source": "online"}, limit, cursor, fields, count)
 
 @api_router.post("/admin/checkins/validate/{booking_id}")
 async def admin_validate_checkin(booking_id: str, data: dict = None, admin: dict = Depends(get_admin_user)):
@@ -3800,6 +5864,7 @@ async def admin_validate_checkin(booking_id: str, data: dict = None, admin: dict
             **checkin_data
         }
         await db.online_checkins.insert_one(checkin_doc)
+    await checkin_view.sync_checkin("online", checkin_id)
     
     # Aggiorna la prenotazione
     await db.bookings.update_one(
@@ -3845,6 +5910,7 @@ async def admin_update_checkin_guest_data(checkin_id: str, data: dict, admin: di
         {"id": checkin_id},
         {"$set": update_data}
     )
+    await checkin_view.update_fields(checkin_id, update_data)
     
     return {"message": "Dati ospite aggiornati", "checkin_id": checkin_id}
 
@@ -3864,20 +5930,16 @@ async def export_questura(admin: dict = Depends(get_admin_user), data_da: str =
         else:
             query["created_at"] = {"$lte": data_a}
     
-    # Get all completed check-ins from both collections
-    checkins_form = await db.checkins.find(query, {"_id": 0}).to_list(1000)
-    checkins_online = await db.online_checkins.find(query, {"_id": 0}).to_list(1000)
-    
-    all_checkins = checkins_form + checkins_online
+    # Check-in completati (form + online) con la prenotazione già incorporata
+    all_checkins = await db.checkin_view.find(
+        {**query, "booking": {"$ne": None}}, {"_id": 0}
+    ).sort("created_at", 1).to_list(2000)
     
     # Prepare export data
     export_lines = []
     
     for checkin in all_checkins:
-        # Get booking data
-        booking = await db.bookings.find_one({"id": checkin.get("booking_id")}, {"_id": 0})
-        if not booking:
-            continue
+        booking = checkin["booking"]
         
         data_arrivo = checkin.get("data_arrivo") or booking.get("data_arrivo", "")
         
@@ -3935,20 +5997,11 @@ async def export_single_checkin_questura(checkin_id: str, admin: dict = Depends(
     Esporta i dati di un singolo check-in nel formato per Alloggiati Web (Questura).
     Formato: record fisso 168 caratteri per riga come da specifiche ufficiali.
     """
-    # Try to find in checkins collection first
-    checkin = await db.checkins.find_one({"id": checkin_id}, {"_id": 0})
-    source = "form"
-    
-    if not checkin:
-        # Try online_checkins
-        checkin = await db.online_checkins.find_one({"id": checkin_id}, {"_id": 0})
-        source = "online"
-    
+    checkin = await db.checkin_view.find_one({"id": checkin_id}, {"_id": 0})
     if not checkin:
         raise HTTPException(status_code=404, detail="Check-in non trovato")
-    
-    # Get booking data
-    booking = await db.bookings.find_one({"id": checkin.get("booking_id")}, {"_id": 0})
+    source = checkin["source"]
+    booking = checkin.get("booking")
     
     data_arrivo = checkin.get("data_arrivo") or (booking.get("data_arrivo") if booking else "")
     data_partenza = checkin.get("data_partenza") or (booking.get("data_partenza") if booking else "")
@@ -4094,20 +6147,11 @@ async def get_paytourist_format(checkin_id: str, admin: dict = Depends(get_admin
     Restituisce i dati del check-in formattati per PayTourist.
     L'utente può copiare questi dati e incollarli manualmente su PayTourist.
     """
-    # Try to find in checkins collection first
-    checkin = await db.checkins.find_one({"id": checkin_id}, {"_id": 0})
-    source = "form"
-    
-    if not checkin:
-        # Try online_checkins
-        checkin = await db.online_checkins.find_one({"id": checkin_id}, {"_id": 0})
-        source = "online"
-    
+    checkin = await db.checkin_view.find_one({"id": checkin_id}, {"_id": 0})
     if not checkin:
         raise HTTPException(status_code=404, detail="Check-in non trovato")
-    
-    # Get booking data
-    booking = await db.bookings.find_one({"id": checkin.get("booking_id")}, {"_id": 0})
+    source = checkin["source"]
+    booking = checkin.get("booking")
     
     data_arrivo = checkin.get("data_arrivo") or (booking.get("data_arrivo") if booking else "")
     data_partenza = checkin.get("data_partenza") or (booking.get("data_partenza") if booking else "")
@@ -4241,6 +6285,7 @@ async def admin_invalidate_checkin(booking_id: str, admin: dict = Depends(get_ad
     
     # Elimina il check-in se esiste
     await db.online_checkins.delete_many({"booking_id": booking_id})
+    await checkin_view.discard({"source": "online", "booking_id": booking_id})
     
     # Aggiorna la prenotazione
     await db.bookings.update_one(
@@ -4253,10 +6298,11 @@ async def admin_invalidate_checkin(booking_id: str, admin: dict = Depends(get_ad
 # ==================== ADMIN NOTIFICATIONS ====================
 
 @api_router.get("/admin/notifications", response_model=List[NotificationResponse])
-async def admin_get_notifications(admin: dict = Depends(get_admin_user)):
+async def admin_get_notifications(admin: dict = Depends(get_admin_user),
+                                  limit: int = 200, cursor: Optional[str] = None,
+                                  fields: Optional[str] = None, count: bool = False):
     """Get all notifications (admin)"""
-    notifications = await db.notifications.find({}, {"_id": 0}).sort("created_at", -1).to_list(200)
-    return notifications
+    return await page_response(db.notifications, {}, limit, cursor, fields, count, model=NotificationResponse)
 
 @api_router.post("/admin/notifications", response_model=NotificationResponse)
 async def admin_create_notification(data: NotificationCreate, admin: dict = Depends(get_admin_user)):
@@ -4273,6 +6319,7 @@ async def admin_create_notification(data: NotificationCreate, admin: dict = Depe
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notification_doc)
+    notification_created(data.destinatario_id)
     return NotificationResponse(**notification_doc)
 
 @api_router.post("/admin/notifications/broadcast")
@@ -4290,6 +6337,7 @@ async def admin_broadcast_notification(data: NotificationCreate, admin: dict = D
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     await db.notifications.insert_one(notification_doc)
+    notification_created(None)
     
     # Count guests
     guest_count = await db.guests.count_documents({"is_admin": {"$ne": True}})
@@ -4307,6 +6355,8 @@ async def admin_delete_notification(notification_id: str, admin: dict = Depends(
         raise HTTPException(status_code=404, detail="Notifica non trovata")
     # Also delete read records
     await db.notification_reads.delete_many({"notification_id": notification_id})
+    # La notifica poteva essere non letta per chiunque: invalida tutti i contatori
+    unread_counts.bump_epoch()
     return {"message": "Notifica eliminata"}
 
 # ==================== PUSH NOTIFICATIONS ====================
@@ -4347,6 +6397,140 @@ async def unsubscribe_push(user: dict = Depends(get_current_user)):
     await db.push_subscriptions.delete_many({"user_id": user["id"]})
     return {"message": "Disiscrizione completata"}
 
+PUSH_WORKERS = int(os.environ.get('PUSH_WORKERS', 8))
+PUSH_TTL_SECONDS = int(os.environ.get('PUSH_TTL_SECONDS', 86400))
+PUSH_PROGRESS_EVERY = 50  # consegne tra due salvataggi dell'avanzamento
+
+class PushFanout:
+    """
+    Invio push in background su db.push_jobs.
+    L'endpoint admin crea il job e ritorna subito; il job firma l'header VAPID una sola
+    volta per push service (il claim aud dipende dall'origine dell'endpoint), spedisce
+    in un pool di thread limitato (pywebpush è bloccante) e rimuove le iscrizioni
+    scadute (404/410) con un unico delete_many finale.
+    Stati: queued -> running -> completed | failed | interrupted.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=PUSH_WORKERS, thread_name_prefix="webpush")
+        # Sessione unica creata qui (non nei thread) e condivisa: pool di connessioni grande quanto i worker
+        self._session = None
+        if WEBPUSH_AVAILABLE:
+            self._session = requests.Session()
+            self._session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=PUSH_WORKERS))
+        self._tasks = {}  # job_id -> asyncio.Task
+
+    def _vapid_headers(self, endpoint: str, signed: dict) -> dict:
+        parsed = urlparse(endpoint)
+        aud = f"{parsed.scheme}://{parsed.netloc}"
+        if aud not in signed:
+            if os.path.isfile(VAPID_PRIVATE_KEY):
+                vapid = Vapid.from_file(private_key_file=VAPID_PRIVATE_KEY)
+            else:
+                vapid = Vapid.from_string(private_key=VAPID_PRIVATE_KEY)
+            signed[aud] = vapid.sign({
+                "sub": f"mailto:{VAPID_EMAIL}",
+                "aud": aud,
+                "exp": int(time.time()) + 12 * 3600
+            })
+        return dict(signed[aud])
+
+    def _deliver(self, sub: dict, payload: str, headers: dict) -> int:
+        pusher = WebPusher({"endpoint": sub["endpoint"], "keys": sub["keys"]}, requests_session=self._session)
+        response = pusher.send(payload, headers, ttl=PUSH_TTL_SECONDS, timeout=10)
+        return response.status_code
+
+    async def start(self, query: dict, message: dict, created_by: str) -> dict:
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": "queued",
+            "query": query,
+            "title": message["title"],
+            "total": await db.push_subscriptions.count_documents(query),
+            "sent": 0,
+            "failed": 0,
+            "removed": 0,
+            "created_by": created_by,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None
+        }
+        await db.push_jobs.insert_one(dict(job))
+        task = asyncio.create_task(self._run(job, json.dumps(message)))
+        self._tasks[job["id"]] = task
+        task.add_done_callback(lambda _t, job_id=job["id"]: self._tasks.pop(job_id, None))
+        return job
+
+    async def _save(self, job: dict, **extra):
+        await db.push_jobs.update_one({"id": job["id"]}, {"$set": {
+            "status": job["status"], "sent": job["sent"], "failed": job["failed"],
+            "removed": job["removed"], **extra
+        }})
+
+    async def _run(self, job: dict, payload: str):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(PUSH_WORKERS)
+        signed = {}
+        dead = []
+        pending = set()
+        done_count = 0
+        job["status"] = "running"
+        await self._save(job)
+
+        async def deliver(sub: dict):
+            nonlocal done_count
+            try:
+                headers = self._vapid_headers(sub["endpoint"], signed)
+                status = await loop.run_in_executor(self._executor, self._deliver, sub, payload, headers)
+                if status in (404, 410):
+                    dead.append(sub["endpoint"])
+                if status > 202:
+                    job["failed"] += 1
+                else:
+                    job["sent"] += 1
+            except Exception as e:
+                job["failed"] += 1
+                logging.error(f"Push notification error: {e}")
+            finally:
+                semaphore.release()
+                done_count += 1
+
+        try:
+            cursor = db.push_subscriptions.find(job["query"], {"_id": 0, "endpoint": 1, "keys": 1})
+            async for sub in cursor:
+                await semaphore.acquire()
+                task = asyncio.create_task(deliver(sub))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if done_count >= PUSH_PROGRESS_EVERY:
+                    done_count = 0
+                    await self._save(job)
+            if pending:
+                await asyncio.gather(*pending)
+            if dead:
+                result = await db.push_subscriptions.delete_many({"endpoint": {"$in": dead}})
+                job["removed"] = result.deleted_count
+            job["status"] = "completed"
+            await self._save(job, finished_at=datetime.now(timezone.utc).isoformat())
+        except asyncio.CancelledError:
+            job["status"] = "interrupted"
+            await self._save(job, finished_at=datetime.now(timezone.utc).isoformat())
+            raise
+        except Exception as e:
+            logging.error(f"Push job {job['id']} failed: {e}")
+            job["status"] = "failed"
+            await self._save(job, error=str(e), finished_at=datetime.now(timezone.utc).isoformat())
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+push_fanout = PushFanout()
+
 @api_router.post("/admin/push/send")
 async def admin_send_push(data: dict, admin: dict = Depends(get_admin_user)):
     """Send push notification to users (admin only)"""
@@ -4356,62 +6540,41 @@ async def admin_send_push(data: dict, admin: dict = Depends(get_admin_user)):
     if not VAPID_PUBLIC_KEY or not VAPID_PRIVATE_KEY:
         raise HTTPException(status_code=503, detail="VAPID keys not configured")
     
-    title = data.get("title", "La Maisonette di Paestum")
-    body = data.get("body", "")
-    url = data.get("url", "/")
+    message = {
+        "title": data.get("title", "La Maisonette di Paestum"),
+        "body": data.get("body", ""),
+        "url": data.get("url", "/"),
+        "icon": "/icons/icon-192x192.png"
+    }
     user_id = data.get("user_id")  # None = broadcast to all
     
-    # Get subscriptions
     query = {"user_id": user_id} if user_id else {}
-    subscriptions = await db.push_subscriptions.find(query, {"_id": 0}).to_list(1000)
-    
-    if not subscriptions:
+    if not await db.push_subscriptions.find_one(query, {"_id": 1}):
         return {"message": "Nessuna iscrizione push trovata", "sent": 0}
     
-    sent_count = 0
-    failed_count = 0
-    
-    for sub in subscriptions:
-        try:
-            webpush(
-                subscription_info={
-                    "endpoint": sub["endpoint"],
-                    "keys": sub["keys"]
-                },
-                data=json.dumps({
-                    "title": title,
-                    "body": body,
-                    "url": url,
-                    "icon": "/icons/icon-192x192.png"
-                }),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims={
-                    "sub": f"mailto:{VAPID_EMAIL}"
-                }
-            )
-            sent_count += 1
-        except WebPushException as e:
-            failed_count += 1
-            # Remove invalid subscription
-            if e.response and e.response.status_code in [404, 410]:
-                await db.push_subscriptions.delete_one({"endpoint": sub["endpoint"]})
-        except Exception as e:
-            failed_count += 1
-            logging.error(f"Push notification error: {e}")
-    
+    job = await push_fanout.start(query, message, admin["id"])
     return {
-        "message": f"Notifiche inviate: {sent_count}, fallite: {failed_count}",
-        "sent": sent_count,
-        "failed": failed_count
+        "message": f"Invio avviato a {job['total']} iscrizioni",
+        "job_id": job["id"],
+        "total": job["total"]
     }
 
+@api_router.get("/admin/push/jobs/{job_id}")
+async def admin_get_push_job(job_id: str, admin: dict = Depends(get_admin_user)):
+    """Avanzamento di un invio push"""
+    job = await db.push_jobs.find_one({"id": job_id}, {"_id": 0, "query": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Invio non trovato")
+    return job
+
 # ==================== ADMIN LOYALTY REWARDS ====================
 
 @api_router.get("/admin/loyalty/transactions")
-async def admin_get_loyalty_transactions(admin: dict = Depends(get_admin_user)):
+async def admin_get_loyalty_transactions(admin: dict = Depends(get_admin_user),
+                                         limit: int = 500, cursor: Optional[str] = None,
+                                         fields: Optional[str] = None, count: bool = False):
     """Get all loyalty transactions for admin"""
-    transactions = await db.loyalty_transactions.find({}, {"_id": 0}).sort("created_at", -1).to_list(500)
-    return transactions
+    return await page_response(db.loyalty_transactions, {}, limit, cursor, fields, count)
 
 @api_router.post("/admin/loyalty/add")
 async def admin_add_loyalty_points(data: dict, admin: dict = Depends(get_admin_user)):
@@ -4436,6 +6599,7 @@ async def admin_add_loyalty_points(data: dict, admin: dict = Depends(get_admin_u
         {"id": guest_id},
         {"$inc": {"punti_fedelta": punti}}
     )
+    principal_cache.invalidate(guest_id)
     
     # Create transaction
     transaction = {
@@ -4541,19 +6705,14 @@ async def admin_delete_amenity(amenity_id: str, admin: dict = Depends(get_admin_
 # ==================== ADMIN BOOKINGS ====================
 
 @api_router.get("/admin/bookings", response_model=List[BookingResponse])
-async def admin_get_bookings(admin: dict = Depends(get_admin_user), status: Optional[str] = None):
+async def admin_get_bookings(admin: dict = Depends(get_admin_user), status: Optional[str] = None,
+                             limit: int = 500, cursor: Optional[str] = None,
+                             fields: Optional[str] = None, count: bool = False):
     query = {}
     if status:
         query["status"] = status
-    bookings = await db.bookings.find(query, {"_id": 0}).sort("created_at", -1).to_list(500)
-    
-    # Enrich with unit name
-    for booking in bookings:
-        unit = await db.units.find_one({"id": booking["unit_id"]}, {"_id": 0, "nome": 1})
-        if unit:
-            booking["unit_nome"] = unit["nome"]
-    
-    return bookings
+    return await page_response(db.bookings, query, limit, cursor, fields, count,
+                               model=BookingResponse, enrich=unit_names.attach)
 
 @api_router.post("/admin/bookings", response_model=BookingResponse)
 async def admin_create_booking(data: AdminBookingCreate, admin: dict = Depends(get_admin_user)):
@@ -4578,13 +6737,7 @@ async def admin_create_booking(data: AdminBookingCreate, admin: dict = Depends(g
         raise HTTPException(status_code=400, detail=f"Capacità massima: {unit['capacita_max']} ospiti")
     
     # Check for conflicting bookings (solo confermate o pending)
-    existing = await db.bookings.find_one({
-        "unit_id": data.unit_id,
-        "status": {"$in": ["pending", "confirmed"]},
-        "$or": [
-            {"data_arrivo": {"$lt": data.data_partenza}, "data_partenza": {"$gt": data.data_arrivo}}
-        ]
-    })
+    existing = await availability_index.find_conflict(data.unit_id, data.data_arrivo, data.data_partenza, include_blocks=False)
     if existing:
         raise HTTPException(status_code=409, detail="Date non disponibili - già prenotato")
     
@@ -4595,13 +6748,9 @@ async def admin_create_booking(data: AdminBookingCreate, admin: dict = Depends(g
         prezzo_totale = price_response["prezzo_totale"]
     
     booking_id = str(uuid.uuid4())
-    codice_prenotazione = generate_booking_code()
     
-    # Assicurati che il codice sia univoco
-    while await db.bookings.find_one({"codice_prenotazione": codice_prenotazione}):
-        codice_prenotazione = generate_booking_code()
-    
-    # Gestione ospite: esistente o nuovo
+    # Gestione ospite: esistente o nuovo (scritto dopo la prenotazione, quando il codice è definitivo)
+    new_guest = None
     if data.guest_id:
         # Usa cliente esistente
         existing_guest = await db.guests.find_one({"id": data.guest_id}, {"_id": 0})
@@ -4612,12 +6761,6 @@ async def admin_create_booking(data: AdminBookingCreate, admin: dict = Depends(g
         nome_ospite = f"{existing_guest.get('nome', '')} {existing_guest.get('cognome', '')}".strip()
         email_ospite = existing_guest.get("email", "")
         telefono_ospite = existing_guest.get("telefono", "")
-        
-        # Aggiorna il codice prenotazione dell'ospite
-        await db.guests.update_one(
-            {"id": guest_id},
-            {"$set": {"codice_prenotazione": codice_prenotazione}}
-        )
     else:
         # Crea nuovo cliente o trova esistente per email
         if not data.email_ospite or not data.nome_ospite:
@@ -4625,49 +6768,34 @@ async def admin_create_booking(data: AdminBookingCreate, admin: dict = Depends(g
         
         guest_email = data.email_ospite.lower()
         existing_guest = await db.guests.find_one({"email": guest_email}, {"_id": 0})
+        nome_ospite = data.nome_ospite
+        email_ospite = guest_email
         
         if existing_guest:
             # Ospite esiste già per email, usa il suo ID
             guest_id = existing_guest["id"]
-            nome_ospite = data.nome_ospite
-            email_ospite = guest_email
             telefono_ospite = data.telefono_ospite or existing_guest.get("telefono", "")
-            
-            # Aggiorna il codice prenotazione
-            await db.guests.update_one(
-                {"id": guest_id},
-                {"$set": {"codice_prenotazione": codice_prenotazione}}
-            )
         else:
-            # Crea nuovo account ospite
+            # Nuovo account ospite
             guest_id = str(uuid.uuid4())
             nome_parts = data.nome_ospite.strip().split(' ', 1)
-            nome = nome_parts[0] if nome_parts else data.nome_ospite
-            cognome = nome_parts[1] if len(nome_parts) > 1 else ''
-            
-            guest_doc = {
+            new_guest = {
                 "id": guest_id,
-                "nome": nome,
-                "cognome": cognome,
+                "nome": nome_parts[0] if nome_parts else data.nome_ospite,
+                "cognome": nome_parts[1] if len(nome_parts) > 1 else '',
                 "email": guest_email,
-                "password_hash": hash_password(codice_prenotazione),
                 "telefono": data.telefono_ospite or "",
                 "punti_fedelta": 0,
                 "is_admin": False,
-                "codice_prenotazione": codice_prenotazione,
                 "created_at": datetime.now(timezone.utc).isoformat()
             }
-            await db.guests.insert_one(guest_doc)
-            
-            nome_ospite = data.nome_ospite
-            email_ospite = guest_email
             telefono_ospite = data.telefono_ospite or ""
     
     booking_doc = {
         "id": booking_id,
         "unit_id": data.unit_id,
         "guest_id": guest_id,
-        "codice_prenotazione": codice_prenotazione,
+        "codice_prenotazione": generate_booking_code(),
         "data_arrivo": data.data_arrivo,
         "data_partenza": data.data_partenza,
         "num_ospiti": data.num_ospiti,
@@ -4680,7 +6808,32 @@ async def admin_create_booking(data: AdminBookingCreate, admin: dict = Depends(g
         "created_at": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.bookings.insert_one(booking_doc)
+    await night_ledger.sync(booking_doc, new=True)
+    try:
+        # Il codice univoco è garantito dall'indice: insert_booking lo rigenera se già usato
+        await insert_booking(booking_doc)
+    except Exception:
+        await night_ledger.release(booking_id)
+        raise
+    booking_doc.pop("_id", None)
+    codice_prenotazione = booking_doc["codice_prenotazione"]
+    
+    if new_guest:
+        new_guest["password_hash"] = await hash_password(codice_prenotazione)
+        new_guest["codice_prenotazione"] = codice_prenotazione
+        new_guest.update(guest_search_fields(new_guest))
+        await db.guests.insert_one(new_guest)
+        await badge_counters.guest_created()
+    else:
+        # Aggiorna il codice prenotazione dell'ospite
+        await db.guests.update_one(
+            {"id": guest_id},
+            {"$set": {"codice_prenotazione": codice_prenotazione}}
+        )
+        principal_cache.invalidate(guest_id)
+    availability_index.put_booking(booking_doc)
+    await occupancy.sync_booking(booking_doc)
+    await track_status_change("prenotazioni", booking_doc["id"], None, booking_doc["status"])
     booking_doc["unit_nome"] = unit["nome"]
     
     # Send notification email to admin
@@ -4696,13 +6849,41 @@ async def admin_update_booking_status(booking_id: str, status: str, admin: dict
     if status not in ["pending", "confirmed", "cancelled", "completed"]:
         raise HTTPException(status_code=400, detail="Status non valido")
     
-    result = await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {"status": status}}
-    )
-    if result.modified_count == 0:
+    booking = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    if not booking:
         raise HTTPException(status_code=404, detail="Prenotazione non trovata")
     
+    # Riserva (o libera) le notti prima che il nuovo stato sia visibile: una riattivazione
+    # su notti ormai prese da un'altra prenotazione si ferma qui con 409
+    await night_ledger.sync({**booking, "status": status})
+    
+    try:
+        # Aggiorna solo se lo stato è ancora quello letto: una modifica concorrente non viene sovrascritta
+        updated = await db.bookings.find_one_and_update(
+            {"id": booking_id, "status": booking.get("status")},
+            {"$set": {"status": status}},
+            projection={"_id": 1}
+        )
+        if not updated:
+            raise HTTPException(status_code=409, detail="Prenotazione modificata nel frattempo, riprova")
+    except Exception:
+        # Stato non aggiornato: le notti tornano quelle della prenotazione com'è ora nel DB
+        try:
+            current = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+            if current:
+                await night_ledger.sync(current)
+            else:
+                await night_ledger.release(booking_id)
+        except HTTPException:
+            logger.error(f"Night ledger: impossibile ripristinare le notti della prenotazione {booking_id}")
+        raise
+    await track_status_change("prenotazioni", booking_id, booking.get("status"), status)
+    
+    booking["status"] = status
+    availability_index.put_booking(booking)
+    await occupancy.sync_booking(booking)
+    await checkin_view.sync_booking(booking_id)
+    
     return {"message": "Status aggiornato"}
 
 @api_router.put("/admin/bookings/{booking_id}")
@@ -4731,98 +6912,128 @@ async def admin_update_booking(booking_id: str, data: dict, admin: dict = Depend
     if "status" in update_data and update_data["status"] not in ["pending", "confirmed", "cancelled", "completed"]:
         raise HTTPException(status_code=400, detail="Status non valido")
     
-    # Gestione ospite
-    email_ospite = data.get("email_ospite", "").strip().lower()
-    nome_ospite = data.get("nome_ospite", booking.get("nome_ospite", ""))
-    telefono_ospite = data.get("telefono_ospite", booking.get("telefono_ospite", ""))
+    # Nuove date o stato: riserva le notti prima di toccare ospiti e prenotazione
+    await night_ledger.sync({**booking, **update_data})
+    
+    try:
+        # Gestione ospite
+        email_ospite = data.get("email_ospite", "").strip().lower()
+        nome_ospite = data.get("nome_ospite", booking.get("nome_ospite", ""))
+        telefono_ospite = data.get("telefono_ospite", booking.get("telefono_ospite", ""))
     
-    # Se l'email è valida (non placeholder)
-    is_valid_email = email_ospite and "@" in email_ospite and "temp.com" not in email_ospite and "noemail" not in email_ospite
+        # Se l'email è valida (non placeholder)
+        is_valid_email = email_ospite and "@" in email_ospite and "temp.com" not in email_ospite and "noemail" not in email_ospite
     
-    if is_valid_email:
-        existing_guest_id = booking.get("guest_id")
+        if is_valid_email:
+            existing_guest_id = booking.get("guest_id")
         
-        # Check if guest with this email already exists
-        existing_guest_by_email = await db.guests.find_one({"email": email_ospite}, {"_id": 0})
+            # Check if guest with this email already exists
+            existing_guest_by_email = await db.guests.find_one({"email": email_ospite}, {"_id": 0})
         
-        if existing_guest_by_email:
-            # Guest exists with this email, link to booking
-            update_data["guest_id"] = existing_guest_by_email["id"]
-            # Update guest info
-            await db.guests.update_one(
-                {"id": existing_guest_by_email["id"]},
-                {"$set": {
-                    "codice_prenotazione": booking.get("codice_prenotazione", ""),
-                    "telefono": telefono_ospite or existing_guest_by_email.get("telefono", "")
-                }}
-            )
-            print(f"✅ Linked existing guest {existing_guest_by_email['id']} to booking {booking_id}")
+            if existing_guest_by_email:
+                # Guest exists with this email, link to booking
+                update_data["guest_id"] = existing_guest_by_email["id"]
+                # Update guest info
+                await db.guests.update_one(
+                    {"id": existing_guest_by_email["id"]},
+                    {"$set": {
+                        "codice_prenotazione": booking.get("codice_prenotazione", ""),
+                        "telefono": telefono_ospite or existing_guest_by_email.get("telefono", "")
+                    }}
+                )
+                principal_cache.invalidate(existing_guest_by_email["id"])
+                print(f"✅ Linked existing guest {existing_guest_by_email['id']} to booking {booking_id}")
             
-            # Delete old temp guest if different
-            if existing_guest_id and existing_guest_id != existing_guest_by_email["id"]:
-                old_guest = await db.guests.find_one({"id": existing_guest_id}, {"_id": 0})
-                if old_guest and ("temp.com" in old_guest.get("email", "") or "noemail" in old_guest.get("email", "")):
-                    await db.guests.delete_one({"id": existing_guest_id})
-                    print(f"🗑️ Deleted temp guest {existing_guest_id}")
+                # Delete old temp guest if different
+                if existing_guest_id and existing_guest_id != existing_guest_by_email["id"]:
+                    old_guest = await db.guests.find_one({"id": existing_guest_id}, {"_id": 0})
+                    if old_guest and ("temp.com" in old_guest.get("email", "") or "noemail" in old_guest.get("email", "")):
+                        await db.guests.delete_one({"id": existing_guest_id})
+                        principal_cache.invalidate(existing_guest_id)
+                        print(f"🗑️ Deleted temp guest {existing_guest_id}")
                     
-        elif existing_guest_id:
-            # Update existing guest with new email
-            old_guest = await db.guests.find_one({"id": existing_guest_id}, {"_id": 0})
-            if old_guest:
-                old_email = old_guest.get("email", "")
-                # If old email was temp, update it
-                if "temp.com" in old_email or "noemail" in old_email:
-                    nome_parts = nome_ospite.strip().split(' ', 1) if nome_ospite else [""]
-                    await db.guests.update_one(
-                        {"id": existing_guest_id},
-                        {"$set": {
+            elif existing_guest_id:
+                # Update existing guest with new email
+                old_guest = await db.guests.find_one({"id": existing_guest_id}, {"_id": 0})
+                if old_guest:
+                    old_email = old_guest.get("email", "")
+                    # If old email was temp, update it
+                    if "temp.com" in old_email or "noemail" in old_email:
+                        nome_parts = nome_ospite.strip().split(' ', 1) if nome_ospite else [""]
+                        renamed = {
                             "email": email_ospite,
                             "nome": nome_parts[0],
-                            "cognome": nome_parts[1] if len(nome_parts) > 1 else "",
-                            "telefono": telefono_ospite,
-                            "codice_prenotazione": booking.get("codice_prenotazione", "")
-                        }}
-                    )
-                    print(f"✅ Updated guest {existing_guest_id} with real email {email_ospite}")
-        else:
-            # No guest exists, create new one
-            guest_id = str(uuid.uuid4())
-            nome_parts = nome_ospite.strip().split(' ', 1) if nome_ospite else ["Guest"]
-            nome = nome_parts[0]
-            cognome = nome_parts[1] if len(nome_parts) > 1 else ""
-            codice = booking.get("codice_prenotazione", generate_booking_code())
+                            "cognome": nome_parts[1] if len(nome_parts) > 1 else ""
+                        }
+                        await db.guests.update_one(
+                            {"id": existing_guest_id},
+                            {"$set": {
+                                **renamed,
+                                **guest_search_fields(renamed),
+                                "telefono": telefono_ospite,
+                                "codice_prenotazione": booking.get("codice_prenotazione", "")
+                            }}
+                        )
+                        principal_cache.invalidate(existing_guest_id)
+                        await checkin_view.sync_guest(existing_guest_id)
+                        print(f"✅ Updated guest {existing_guest_id} with real email {email_ospite}")
+            else:
+                # No guest exists, create new one
+                guest_id = str(uuid.uuid4())
+                nome_parts = nome_ospite.strip().split(' ', 1) if nome_ospite else ["Guest"]
+                nome = nome_parts[0]
+                cognome = nome_parts[1] if len(nome_parts) > 1 else ""
+                codice = booking.get("codice_prenotazione", generate_booking_code())
             
-            guest_doc = {
-                "id": guest_id,
-                "nome": nome,
-                "cognome": cognome,
-                "email": email_ospite,
-                "password_hash": hash_password(codice),
-                "telefono": telefono_ospite,
-                "punti_fedelta": 0,
-                "is_admin": False,
-                "codice_prenotazione": codice,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.guests.insert_one(guest_doc)
-            update_data["guest_id"] = guest_id
-            print(f"✅ Created new guest {guest_id} for booking {booking_id}")
+                guest_doc = {
+                    "id": guest_id,
+                    "nome": nome,
+                    "cognome": cognome,
+                    "email": email_ospite,
+                    "password_hash": await hash_password(codice),
+                    "telefono": telefono_ospite,
+                    "punti_fedelta": 0,
+                    "is_admin": False,
+                    "codice_prenotazione": codice,
+                    "created_at": datetime.now(timezone.utc).isoformat()
+                }
+                guest_doc.update(guest_search_fields(guest_doc))
+                await db.guests.insert_one(guest_doc)
+                await badge_counters.guest_created()
+                update_data["guest_id"] = guest_id
+                print(f"✅ Created new guest {guest_id} for booking {booking_id}")
     
-    # Update booking
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": update_data}
-    )
+        # Update booking
+        await db.bookings.update_one(
+            {"id": booking_id},
+            {"$set": update_data}
+        )
+    except Exception:
+        # Ospite o prenotazione non aggiornati: le notti tornano quelle della prenotazione originale
+        try:
+            await night_ledger.sync(booking)
+        except HTTPException:
+            logger.error(f"Night ledger: impossibile ripristinare le notti della prenotazione {booking_id}")
+        raise
     
     # Get updated booking
     updated = await db.bookings.find_one({"id": booking_id}, {"_id": 0})
+    availability_index.put_booking(updated)
+    await occupancy.sync_booking(updated)
+    await checkin_view.sync_booking(booking_id)
+    await track_status_change("prenotazioni", booking_id, booking.get("status"), updated.get("status"))
     return updated
 
 @api_router.delete("/admin/bookings/{booking_id}")
 async def admin_delete_booking(booking_id: str, admin: dict = Depends(get_admin_user)):
-    result = await db.bookings.delete_one({"id": booking_id})
-    if result.deleted_count == 0:
+    deleted = await db.bookings.find_one_and_delete({"id": booking_id}, {"_id": 0, "status": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Prenotazione non trovata")
+    availability_index.discard_booking(booking_id)
+    await occupancy.discard_booking(booking_id)
+    await night_ledger.release(booking_id)
+    await checkin_view.sync_booking(booking_id)
+    await track_status_change("prenotazioni", booking_id, deleted.get("status"), None)
     return {"message": "Prenotazione eliminata"}
 
 # ==================== SEED DATA ====================
@@ -4837,6 +7048,8 @@ async def seed_data(admin: dict = Depends(get_admin_user)):
     
     for u in units:
         await db.units.update_one({"nome": u["nome"]}, {"$set": u}, upsert=True)
+    rate_calendars.invalidate()
+    unit_names.invalidate()
     
     # Seed structures with coordinates
     structures = [
@@ -5215,6 +7428,152 @@ async def scrape_events(admin: dict = Depends(get_admin_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Errore durante lo scraping: {str(e)}")
 
+# ==================== DATABASE INDEXES ====================
+
+# Solo documenti con il campo valorizzato: i record storici senza valore non violano l'unicità
+def _present(field: str) -> dict:
+    return {field: {"$type": "string"}}
+
+# Indici richiesti dalle query di questo file: (collezione, chiavi, opzioni)
+REQUIRED_INDEXES = [
+    ("guests", [("id", 1)], {"unique": True}),
+    ("guests", [("email", 1)], {"unique": True, "partialFilterExpression": _present("email")}),
+    ("guests", [("codice_prenotazione", 1)], {}),
+    ("guests", [("search_prefixes", 1)], {}),
+    ("guests", [("search_tokens", 1)], {}),
+    ("units", [("id", 1)], {"unique": True}),
+    ("bookings", [("id", 1)], {"unique": True}),
+    ("bookings", [("codice_prenotazione", 1)], {"unique": True, "partialFilterExpression": _present("codice_prenotazione")}),
+    ("bookings", [("unit_id", 1), ("status", 1), ("data_arrivo", 1), ("data_partenza", 1)], {}),
+    ("bookings", [("email_ospite", 1)], {}),
+    ("bookings", [("guest_id", 1)], {}),
+    ("bookings", [("created_at", -1), ("id", -1)], {}),
+    ("bookings", [("status", 1), ("created_at", -1), ("id", -1)], {}),
+    ("bookings", [("data_arrivo", 1)], {}),
+    ("date_blocks", [("id", 1)], {"unique": True}),
+    ("date_blocks", [("unit_id", 1), ("data_inizio", 1)], {}),
+    ("date_blocks", [("ical_feed_id", 1)], {}),
+    ("price_periods", [("id", 1)], {"unique": True}),
+    ("price_periods", [("unit_id", 1), ("data_inizio", 1)], {}),
+    ("discounts", [("unit_id", 1), ("giorni_minimo", -1)], {}),
+    ("ical_feeds", [("id", 1)], {"unique": True}),
+    ("ical_feeds", [("unit_id", 1)], {}),
+    ("checkins", [("id", 1)], {"unique": True}),
+    ("checkins", [("guest_id", 1), ("created_at", -1)], {}),
+    ("checkins", [("booking_id", 1)], {}),
+    ("online_checkins", [("id", 1)], {"unique": True}),
+    ("online_checkins", [("token", 1)], {"unique": True, "partialFilterExpression": _present("token")}),
+    ("online_checkins", [("booking_id", 1)], {}),
+    ("online_checkins", [("created_at", -1)], {}),
+    ("notifications", [("id", 1)], {"unique": True}),
+    ("notifications", [("destinatario_id", 1), ("created_at", -1)], {}),
+    ("notification_reads", [("user_id", 1), ("notification_id", 1)], {"unique": True}),
+    ("notification_reads", [("notification_id", 1)], {}),
+    ("notification_reads", [("user_id", 1), ("notification_created_at", 1)], {}),
+    ("notification_watermarks", [("user_id", 1)], {"unique": True}),
+    ("email_queue", [("status", 1), ("next_attempt_at", 1)], {}),
+    ("email_queue", [("status", 1), ("claimed_at", 1)], {}),
+    ("push_jobs", [("id", 1)], {"unique": True}),
+    ("stream_tickets", [("expires_at", 1)], {"expireAfterSeconds": 0}),  # pulizia dei ticket non usati
+    ("checkin_view", [("id", 1)], {"unique": True}),
+    ("checkin_view", [("created_at", -1), ("id", -1)], {}),
+    ("checkin_view", [("source", 1), ("created_at", -1), ("id", -1)], {}),
+    ("checkin_view", [("guest_id", 1), ("created_at", -1), ("id", -1)], {}),
+    ("checkin_view", [("status", 1), ("created_at", 1)], {}),
+    ("checkin_view", [("booking_id", 1)], {}),
+    ("checkin_view", [("unit_id", 1)], {}),
+    ("occupancy_daily", [("date", 1), ("unit_id", 1)], {}),
+    ("unit_nights", [("booking_id", 1)], {}),
+    ("occupancy_daily", [("kind", 1), ("ref_id", 1)], {}),
+    ("occupancy_daily", [("kind", 1), ("ical_feed_id", 1)], {}),
+    ("push_subscriptions", [("user_id", 1)], {}),
+    ("push_subscriptions", [("endpoint", 1)], {}),
+    ("orders", [("guest_id", 1), ("created_at", -1)], {}),
+    ("orders", [("created_at", -1), ("id", -1)], {}),
+    ("service_bookings", [("guest_id", 1), ("created_at", -1)], {}),
+    ("service_bookings", [("created_at", -1), ("id", -1)], {}),
+    ("loyalty_transactions", [("guest_id", 1), ("created_at", -1)], {}),
+    ("loyalty_transactions", [("created_at", -1), ("id", -1)], {}),
+    ("guests", [("created_at", -1), ("id", -1)], {}),
+    ("media", [("created_at", -1), ("id", -1)], {}),
+    ("notifications", [("created_at", -1), ("id", -1)], {}),
+    ("events", [("id", 1)], {"unique": True}),
+    ("events", [("data", 1)], {}),
+    ("structures", [("id", 1)], {"unique": True}),
+    ("services", [("id", 1)], {"unique": True}),
+    ("products", [("id", 1)], {"unique": True}),
+]
+
+class IndexManager:
+    """
+    Crea in modo idempotente gli indici dichiarati in REQUIRED_INDEXES
+    e confronta lo stato reale del DB (mancanti, non dichiarati, mai usati).
+    """
+
+    def __init__(self, specs: list):
+        self.specs = specs
+        self.errors = {}  # nome indice -> errore dell'ultima creazione
+        self.last_run = None
+        self.task = None
+
+    @staticmethod
+    def index_name(keys: list) -> str:
+        # Stessa convenzione di nomi di MongoDB (es. "unit_id_1_status_1")
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    async def ensure(self):
+        """Crea gli indici mancanti; un errore su un indice (es. duplicati) non blocca gli altri"""
+        errors = {}
+        for collection, keys, options in self.specs:
+            name = self.index_name(keys)
+            try:
+                await db[collection].create_index(keys, name=name, **options)
+            except Exception as e:
+                errors[f"{collection}.{name}"] = str(e)
+                logger.error(f"Index {collection}.{name} creation failed: {e}")
+        self.errors = errors
+        self.last_run = datetime.now(timezone.utc).isoformat()
+
+    async def report(self) -> dict:
+        declared = {}
+        for collection, keys, _ in self.specs:
+            declared.setdefault(collection, set()).add(self.index_name(keys))
+        
+        missing, undeclared, unused = [], [], []
+        for collection, names in declared.items():
+            existing = await db[collection].index_information()
+            missing.extend(f"{collection}.{name}" for name in sorted(names - existing.keys()))
+            undeclared.extend(f"{collection}.{name}" for name in sorted(existing.keys() - names - {"_id_"}))
+            # Contatori d'uso dall'ultimo riavvio di mongod (richiede il permesso indexStats)
+            try:
+                async for stat in db[collection].aggregate([{"$indexStats": {}}]):
+                    if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0:
+                        unused.append(f"{collection}.{stat['name']}")
+            except Exception as e:
+                logger.warning(f"$indexStats unavailable for {collection}: {e}")
+        
+        return {
+            "declared": sum(len(names) for names in declared.values()),
+            "missing": missing,
+            "undeclared": undeclared,
+            "unused": sorted(unused),
+            "errors": self.errors,
+            "last_run": self.last_run
+        }
+
+index_manager = IndexManager(REQUIRED_INDEXES)
+
+@api_router.get("/admin/db-indexes")
+async def admin_get_db_indexes(admin: dict = Depends(get_admin_user)):
+    """Stato degli indici MongoDB: mancanti, non dichiarati e mai usati"""
+    return await index_manager.report()
+
+@api_router.post("/admin/db-indexes/ensure")
+async def admin_ensure_db_indexes(admin: dict = Depends(get_admin_user)):
+    """Ricrea gli indici mancanti"""
+    await index_manager.ensure()
+    return await index_manager.report()
+
 # Create admin user endpoint (for initial setup)
 @api_router.post("/setup/admin")
 async def create_admin():
@@ -5230,7 +7589,7 @@ async def create_admin():
         "nome": "Admin",
         "cognome": "Maisonette",
         "email": "admin@maisonette.it",
-        "password_hash": hash_password("admin123"),
+        "password_hash": await hash_password("admin123"),
         "telefono": None,
         "punti_fedelta": 0,
         "is_admin": True,
@@ -5254,6 +7613,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 logging.basicConfig(
@@ -5262,6 +7622,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_tasks():
+    email_outbox.start()
+    global occupancy_bootstrap_task, badge_reconcile_task, checkin_view_bootstrap_task, guest_search_backfill_task
+    global night_ledger_bootstrap_task
+    occupancy_bootstrap_task = asyncio.create_task(occupancy.ensure_built())
+    night_ledger_bootstrap_task = asyncio.create_task(night_ledger.ensure_built())
+    checkin_view_bootstrap_task = asyncio.create_task(checkin_view.ensure_built())
+    guest_search_backfill_task = asyncio.create_task(backfill_guest_search())
+    badge_reconcile_task = asyncio.create_task(badge_counters.run_reconcile_loop())
+    # Con più worker uvicorn abilitarlo su uno solo (ICAL_SCHEDULER_ENABLED=false sugli altri)
+    if os.environ.get('ICAL_SCHEDULER_ENABLED', 'true').lower() != 'false':
+        ical_scheduler.start()
+    # Creazione indici in background: non ritarda l'avvio dell'API
+    index_manager.task = asyncio.create_task(index_manager.ensure())
+    try:
+        await availability_index.rebuild()
+    except Exception as e:
+        logger.error(f"Availability index build failed: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await email_outbox.stop()
+    await ical_scheduler.stop()
+    await push_fanout.stop()
+    if _ical_http_client is not None:
+        await _ical_http_client.aclose()
     client.close()
@@ -1,3 +1,5 @@
+import axios from 'axios';
+
 // Centralized API configuration
 // Use relative URL in production (same domain), env variable in development
 
@@ -57,5 +59,20 @@ const getBaseUrl = () => {
 export const API = getApiUrl();
 export const BASE_URL = getBaseUrl();
 
+// Paged admin lists: follow the X-Next-Cursor header until the last page
+export const fetchAllPages = async (url, config = {}) => {
+  const rows = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(url, {
+      ...config,
+      params: cursor ? { ...config.params, cursor } : config.params
+    });
+    rows.push(...response.data);
+    cursor = response.headers['x-next-cursor'] || null;
+  } while (cursor);
+  return rows;
+};
+
 console.log('API URL:', API);
 console.log('BASE URL:', BASE_URL);
@@ -11,7 +11,7 @@ import axios from 'axios';
 import { toast } from 'sonner';
 import { Plus, Edit, Trash2, Home, Euro, Calendar, Users, Check, X, Clock, Phone, Mail, Key, Copy, Search, User, Gift, UserPlus } from 'lucide-react';
 
-import { API } from '../../lib/api';
+import { API, fetchAllPages } from '../../lib/api';
 
 export default function AdminBookings() {
   const { token } = useAuth();
@@ -68,12 +68,12 @@ export default function AdminBookings() {
   const fetchAll = async () => {
     try {
       // Carica units e bookings (essenziali)
-      const [unitsRes, bookingsRes] = await Promise.all([
+      const [unitsRes, allBookings] = await Promise.all([
         axios.get(`${API}/admin/units`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/admin/bookings`, { headers: { Authorization: `Bearer ${token}` } })
+        fetchAllPages(`${API}/admin/bookings`, { headers: { Authorization: `Bearer ${token}` } })
       ]);
       setUnits(unitsRes.data);
-      setBookings(bookingsRes.data);
+      setBookings(allBookings);
       
       // Carica price-periods (opzionale, non blocca se fallisce)
       try {
@@ -30,6 +30,8 @@ export default function AdminCheckins() {
   const { token } = useAuth();
   const [checkins, setCheckins] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedCheckin, setSelectedCheckin] = useState(null);
   const [detailsOpen, setDetailsOpen] = useState(false);
   const [expandedRows, setExpandedRows] = useState({});
@@ -70,6 +72,7 @@ export default function AdminCheckins() {
         headers: { Authorization: `Bearer ${token}` }
       });
       setCheckins(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching checkins:', error);
     } finally {
@@ -77,6 +80,23 @@ export default function AdminCheckins() {
     }
   };
 
+  const fetchMoreCheckins = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/admin/checkins`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { cursor: nextCursor }
+      });
+      setCheckins(prev => [...prev, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching checkins:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleStatusChange = async (checkinId, newStatus) => {
     try {
       await axios.put(`${API}/admin/checkins/${checkinId}/status?status=${newStatus}`, {}, {
@@ -273,7 +293,7 @@ export default function AdminCheckins() {
     <AdminLayout title="Gestione Check-in">
       <div className="flex justify-between items-center mb-6">
         <p className="font-manrope text-[#4A5568]">
-          {checkins.length} check-in totali
+          {checkins.length} check-in {nextCursor ? 'caricati' : 'totali'}
         </p>
       </div>
 
@@ -556,6 +576,18 @@ export default function AdminCheckins() {
               </CardContent>
             </Card>
           ))}
+          {nextCursor && (
+            <div className="flex justify-center">
+              <Button
+                variant="outline"
+                onClick={fetchMoreCheckins}
+                disabled={loadingMore}
+                data-testid="load-more-checkins"
+              >
+                {loadingMore ? 'Caricamento...' : 'Carica altri'}
+              </Button>
+            </div>
+          )}
         </div>
       )}
 
@@ -10,7 +10,7 @@ import axios from 'axios';
 import { toast } from 'sonner';
 import { Users, Gift, Mail, Phone, Star, Trash2 } from 'lucide-react';
 
-import { API } from '../../lib/api';
+import { API, fetchAllPages } from '../../lib/api';
 
 export default function AdminGuests() {
   const { token } = useAuth();
@@ -26,10 +26,10 @@ export default function AdminGuests() {
 
   const fetchGuests = async () => {
     try {
-      const response = await axios.get(`${API}/admin/guests`, {
+      const rows = await fetchAllPages(`${API}/admin/guests`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setGuests(response.data);
+      setGuests(rows);
     } catch (error) {
       console.error('Error fetching guests:', error);
     } finally {
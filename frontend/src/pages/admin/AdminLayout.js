@@ -50,9 +50,42 @@ export default function AdminLayout({ children, title }) {
   useEffect(() => {
     if (token && isAdmin) {
       fetchBadges();
-      // Refresh badges every 60 seconds
-      const interval = setInterval(fetchBadges, 60000);
-      return () => clearInterval(interval);
+      // Live badges via Server-Sent Events; polling only as a slow fallback
+      const streaming = typeof EventSource !== 'undefined';
+      let source = null;
+      let reconnectTimer = null;
+      let closed = false;
+
+      // Each connection uses a fresh single-use ticket, so the JWT never ends up in a URL
+      const connect = async () => {
+        try {
+          const response = await axios.post(`${API}/admin/stream/ticket`, {}, {
+            headers: { Authorization: `Bearer ${token}` }
+          });
+          if (closed) return;
+          source = new EventSource(`${API}/admin/stream?ticket=${encodeURIComponent(response.data.ticket)}`);
+          source.addEventListener('badges', (event) => {
+            setBadges(JSON.parse(event.data));
+          });
+          source.onerror = () => {
+            // The browser would retry with the already used ticket: reconnect with a new one
+            source.close();
+            source = null;
+            if (!closed) reconnectTimer = setTimeout(connect, 5000);
+          };
+        } catch (error) {
+          if (!closed) reconnectTimer = setTimeout(connect, 30000);
+        }
+      };
+
+      if (streaming) connect();
+      const interval = setInterval(fetchBadges, streaming ? 300000 : 60000);
+      return () => {
+        closed = true;
+        clearInterval(interval);
+        clearTimeout(reconnectTimer);
+        if (source) source.close();
+      };
     }
   }, [token, isAdmin]);
 
@@ -8,7 +8,7 @@ import axios from 'axios';
 import { toast } from 'sonner';
 import { Upload, Trash2, Copy, Image, Check, X } from 'lucide-react';
 
-import { API, BASE_URL } from '../../lib/api';
+import { API, BASE_URL, fetchAllPages } from '../../lib/api';
 
 export default function AdminMedia() {
   const { token } = useAuth();
@@ -23,10 +23,10 @@ export default function AdminMedia() {
 
   const fetchMedia = async () => {
     try {
-      const response = await axios.get(`${API}/admin/media`, {
+      const rows = await fetchAllPages(`${API}/admin/media`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setMedia(response.data);
+      setMedia(rows);
     } catch (error) {
       console.error('Error fetching media:', error);
     } finally {
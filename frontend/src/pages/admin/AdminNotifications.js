@@ -14,7 +14,7 @@ import { Plus, Trash2, Bell, Send, Users, User, Gift, Calendar, Info, Star, Aler
 import { formatDistanceToNow } from 'date-fns';
 import { it } from 'date-fns/locale';
 
-import { API } from '../../lib/api';
+import { API, fetchAllPages } from '../../lib/api';
 
 const NOTIFICATION_TYPES = [
   { value: 'info', label: 'Informazione', icon: Info },
@@ -45,10 +45,10 @@ export default function AdminNotifications() {
 
   const fetchNotifications = async () => {
     try {
-      const response = await axios.get(`${API}/admin/notifications`, {
+      const rows = await fetchAllPages(`${API}/admin/notifications`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setNotifications(response.data);
+      setNotifications(rows);
     } catch (error) {
       console.error('Error fetching notifications:', error);
     } finally {
@@ -58,10 +58,11 @@ export default function AdminNotifications() {
 
   const fetchGuests = async () => {
     try {
-      const response = await axios.get(`${API}/admin/guests`, {
-        headers: { Authorization: `Bearer ${token}` }
+      const rows = await fetchAllPages(`${API}/admin/guests`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { fields: 'nome,cognome,is_admin' }
       });
-      setGuests(response.data.filter(g => !g.is_admin));
+      setGuests(rows.filter(g => !g.is_admin));
     } catch (error) {
       console.error('Error fetching guests:', error);
     }
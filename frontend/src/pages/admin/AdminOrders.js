@@ -7,7 +7,7 @@ import axios from 'axios';
 import { toast } from 'sonner';
 import { ShoppingCart, Euro, Package } from 'lucide-react';
 
-import { API } from '../../lib/api';
+import { API, fetchAllPages } from '../../lib/api';
 
 const STATUSES = [
   { value: 'pending', label: 'In attesa', class: 'bg-yellow-100 text-yellow-700' },
@@ -27,10 +27,10 @@ export default function AdminOrders() {
 
   const fetchOrders = async () => {
     try {
-      const response = await axios.get(`${API}/admin/orders`, {
+      const rows = await fetchAllPages(`${API}/admin/orders`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setOrders(response.data);
+      setOrders(rows);
     } catch (error) {
       console.error('Error fetching orders:', error);
     } finally {
@@ -13,7 +13,7 @@ import { Gift, User, Clock, Check, X, Search, Plus, Minus, Trophy, Star } from '
 import { formatDistanceToNow } from 'date-fns';
 import { it } from 'date-fns/locale';
 
-import { API } from '../../lib/api';
+import { API, fetchAllPages } from '../../lib/api';
 
 export default function AdminRedemptions() {
   const { token } = useAuth();
@@ -34,19 +34,20 @@ export default function AdminRedemptions() {
   const fetchData = async () => {
     try {
       // Fetch all loyalty transactions (redemptions)
-      const transResponse = await axios.get(`${API}/admin/loyalty/transactions`, {
+      const transactions = await fetchAllPages(`${API}/admin/loyalty/transactions`, {
         headers: { Authorization: `Bearer ${token}` }
       });
       
       // Filter only redemptions (negative points = riscatto)
-      const allRedemptions = transResponse.data.filter(t => t.tipo === 'riscatto');
+      const allRedemptions = transactions.filter(t => t.tipo === 'riscatto');
       setRedemptions(allRedemptions);
       
       // Fetch guests
-      const guestsResponse = await axios.get(`${API}/admin/guests`, {
-        headers: { Authorization: `Bearer ${token}` }
+      const allGuests = await fetchAllPages(`${API}/admin/guests`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { fields: 'nome,cognome,email,is_admin,punti_fedelta' }
       });
-      setGuests(guestsResponse.data.filter(g => !g.is_admin));
+      setGuests(allGuests.filter(g => !g.is_admin));
       
     } catch (error) {
       console.error('Error fetching data:', error);
@@ -0,0 +1,55 @@
+"""
+Misura il parser iCal in streaming su un feed sintetico.
+
+    python scripts/benchmark_ical_parser.py --events 20000 --chunk-size 8192
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from server import dedupe_ical_events, iter_ical_events  # noqa: E402
+
+
+def synthetic_feed(events: int) -> str:
+    origin = datetime(2030, 1, 1)
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Benchmark//IT"]
+    for i in range(events):
+        start = origin + timedelta(days=i % 3000)
+        lines.extend([
+            "BEGIN:VEVENT",
+            f"UID:bench-{i}@maisonette.it",
+            f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{(start + timedelta(days=3)).strftime('%Y%m%d')}",
+            f"SUMMARY:Prenotazione di prova con un titolo abbastanza lungo da essere\r\n  ripiegato su due righe {i}",
+            "STATUS:CANCELLED" if i % 50 == 0 else "STATUS:CONFIRMED",
+            "END:VEVENT",
+        ])
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=8192)
+    args = parser.parse_args()
+
+    content = synthetic_feed(args.events)
+    chunks = [content[i:i + args.chunk_size] for i in range(0, len(content), args.chunk_size)]
+    started = time.perf_counter()
+    parsed = dedupe_ical_events(iter_ical_events(chunks))
+    elapsed = time.perf_counter() - started
+
+    print(f"eventi: {args.events}  validi: {len(parsed)}  dimensione: {len(content) / 1024:.1f} KB  chunk: {len(chunks)}")
+    print(f"parse: {elapsed * 1000:.1f} ms  ({args.events / elapsed:,.0f} eventi/s)")
+
+
+if __name__ == "__main__":
+    main()
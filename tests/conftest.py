@@ -0,0 +1,50 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# server.py legge la configurazione all'import: basta un URL, i test non si collegano a MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+class Clock:
+    """Orologio manuale per le cache con scadenza basata su time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    import server
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """
+    Factory di DB in memoria installati come server.db:
+    fake_db(guests=[...], bookings=FakeCollection(unique=(...,))). Le collezioni
+    non indicate nascono vuote al primo accesso.
+    """
+    import server
+    from tests.fake_mongo import FakeCollection, FakeDB
+
+    def install(**collections) -> FakeDB:
+        fake = FakeDB(**{
+            name: docs if isinstance(docs, FakeCollection) else FakeCollection(docs)
+            for name, docs in collections.items()
+        })
+        monkeypatch.setattr(server, "db", fake)
+        return fake
+
+    return install
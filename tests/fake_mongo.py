@@ -0,0 +1,301 @@
+"""Collezioni MongoDB in memoria per i test: solo gli operatori usati da server.py."""
+import copy
+
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def _compare(value, op, arg):
+    if op == "$in":
+        if isinstance(value, list):
+            return any(v in arg for v in value)
+        return value in arg
+    if op == "$nin":
+        return not _compare(value, "$in", arg)
+    if op == "$ne":
+        return value != arg
+    if op == "$exists":
+        return (value is not None) == arg
+    if op == "$all":
+        return isinstance(value, list) and all(a in value for a in arg)
+    if value is None or arg is None:
+        return False
+    return {"$lt": value < arg, "$lte": value <= arg, "$gt": value > arg, "$gte": value >= arg}[op]
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in cond):
+                return False
+            continue
+        value = _get(doc, key)
+        if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            if not all(_compare(value, op, arg) for op, arg in cond.items()):
+                return False
+        elif isinstance(value, list) and not isinstance(cond, list):
+            if cond not in value:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        out = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    out = copy.deepcopy(doc)
+    for k, v in projection.items():
+        if not v:
+            out.pop(k, None)
+    return out
+
+
+def _expr(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get(doc, expr[1:])
+    if isinstance(expr, dict) and not all(k.startswith("$") for k in expr):
+        return {field: _expr(doc, sub) for field, sub in expr.items()}
+    if isinstance(expr, dict):
+        (op, args), = expr.items()
+        if op == "$substrCP":
+            start, length = args[1], args[2]
+            return (_expr(doc, args[0]) or "")[start:start + length]
+        if op == "$cond":
+            return _expr(doc, args[1]) if _expr(doc, args[0]) else _expr(doc, args[2])
+        if op == "$eq":
+            return _expr(doc, args[0]) == _expr(doc, args[1])
+        raise NotImplementedError(op)
+    return expr
+
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _expr(doc, spec["_id"])
+        hashable = tuple(key.items()) if isinstance(key, dict) else key
+        out = groups.setdefault(hashable, {"_id": key, **{f: 0 for f in spec if f != "_id"}})
+        for field, acc in spec.items():
+            if field != "_id":
+                out[field] += _expr(doc, acc["$sum"]) or 0
+    return list(groups.values())
+
+
+class FakeAggregate:
+    def __init__(self, docs):
+        self._iter = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return list(self._iter)
+
+
+def _sort_key(value):
+    # None prima di tutto, come in MongoDB
+    return (value is not None, value if value is not None else 0)
+
+
+class FakeCursor:
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key, direction=None):
+        spec = key if isinstance(key, list) else [(key, direction or 1)]
+        for field, order in reversed(spec):
+            self._docs.sort(key=lambda d: _sort_key(_get(d, field)), reverse=order < 0)
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def _results(self):
+        docs = self._docs[:self._limit] if self._limit else self._docs
+        return [project(d, self._projection) for d in docs]
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, docs=(), unique=()):
+        self.docs = []
+        self.unique = ("_id",) + tuple(unique)
+        for doc in docs:
+            self._insert(copy.deepcopy(doc))
+
+    def _insert(self, doc):
+        doc.setdefault("_id", ObjectId())
+        for field in self.unique:
+            value = doc.get(field)
+            if value is not None and any(d.get(field) == value for d in self.docs):
+                raise DuplicateKeyError(f"E11000 duplicate key error dup key: {{ {field}: {value!r} }}", 11000)
+        self.docs.append(doc)
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([d for d in self.docs if matches(d, query or {})], projection)
+
+    async def find_one(self, query=None, projection=None):
+        for doc in self.docs:
+            if matches(doc, query or {}):
+                return project(doc, projection)
+        return None
+
+    async def insert_one(self, doc):
+        stored = copy.deepcopy(doc)
+        self._insert(stored)
+        doc["_id"] = stored["_id"]
+
+    async def insert_many(self, docs, ordered=True):
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self._insert(copy.deepcopy(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    def _apply(self, doc, update):
+        for field, value in update.get("$set", {}).items():
+            doc[field] = copy.deepcopy(value)
+        for field, value in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + value
+        for field in update.get("$unset", {}):
+            doc.pop(field, None)
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                self._apply(doc, update)
+                return
+        if upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            self._apply(doc, update)
+            for field, value in update.get("$setOnInsert", {}).items():
+                doc.setdefault(field, value)
+            self._insert(doc)
+
+    async def replace_one(self, query, replacement, upsert=False):
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                self.docs[index] = {**copy.deepcopy(replacement), "_id": doc["_id"]}
+                return
+        if upsert:
+            self._insert(copy.deepcopy(replacement))
+
+    async def update_many(self, query, update):
+        for doc in self.docs:
+            if matches(doc, query):
+                self._apply(doc, update)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, return_document=False):
+        candidates = self.find(query)
+        if sort:
+            candidates.sort(sort)
+        for doc in candidates._docs:
+            before = project(doc, projection)
+            self._apply(doc, update)
+            return project(doc, projection) if return_document else before
+        return None
+
+    async def find_one_and_delete(self, query, projection=None):
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[index]
+                return project(doc, projection)
+        return None
+
+    async def delete_many(self, query):
+        self.docs = [d for d in self.docs if not matches(d, query)]
+
+    async def delete_one(self, query):
+        for index, doc in enumerate(self.docs):
+            if matches(doc, query):
+                del self.docs[index]
+                return
+
+    def aggregate(self, pipeline):
+        docs = [copy.deepcopy(d) for d in self.docs]
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if matches(d, arg)]
+            elif op == "$group":
+                docs = _group(docs, arg)
+            else:
+                raise NotImplementedError(op)
+        return FakeAggregate(docs)
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs if matches(d, query))
+
+    async def estimated_document_count(self):
+        return len(self.docs)
+
+    async def bulk_write(self, operations, ordered=True):
+        for op in operations:
+            if isinstance(op, InsertOne):
+                await self.insert_one(op._doc)
+            elif isinstance(op, UpdateOne):
+                await self.update_one(op._filter, op._doc, upsert=bool(op._upsert))
+            elif isinstance(op, ReplaceOne):
+                await self.replace_one(op._filter, op._doc, upsert=bool(op._upsert))
+            elif isinstance(op, DeleteOne):
+                await self.delete_one(op._filter)
+
+
+class FakeDB:
+    def __init__(self, **collections):
+        self._collections = dict(collections)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+GUESTS = [{"id": "admin", "is_admin": True}, {"id": "guest", "is_admin": False}]
+
+
+@pytest.fixture(autouse=True)
+def fresh_principal_cache(monkeypatch):
+    monkeypatch.setattr(server, "principal_cache", server.PrincipalCache(max_size=10, ttl_seconds=60))
+
+
+class ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+
+def open_stream(ticket):
+    return asyncio.run(server.admin_event_stream(ConnectedRequest(), ticket=ticket))
+
+
+def test_ticket_opens_the_stream_once(fake_db):
+    fake_db(guests=GUESTS)
+    ticket = asyncio.run(server.admin_create_stream_ticket(admin={"id": "admin"}))["ticket"]
+    assert open_stream(ticket).media_type == "text/event-stream"
+    with pytest.raises(HTTPException) as exc:
+        open_stream(ticket)
+    assert exc.value.status_code == 403
+
+
+def test_expired_or_unknown_ticket_is_rejected(fake_db):
+    fake_db(guests=GUESTS, stream_tickets=[
+        {"_id": "old", "user_id": "admin", "expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}
+    ])
+    for ticket in ("old", "missing"):
+        with pytest.raises(HTTPException):
+            open_stream(ticket)
+
+
+def test_ticket_of_demoted_user_is_rejected(fake_db):
+    fake_db(guests=GUESTS)
+    ticket = asyncio.run(server.admin_create_stream_ticket(admin={"id": "guest"}))["ticket"]
+    with pytest.raises(HTTPException) as exc:
+        open_stream(ticket)
+    assert exc.value.status_code == 403
@@ -0,0 +1,100 @@
+import asyncio
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import server
+
+
+def day(n):
+    return (date(2024, 1, 1) + timedelta(days=n)).isoformat()
+
+
+def test_overlap_is_half_open():
+    track = server._IntervalTrack()
+    track.put("a", "2024-07-01", "2024-07-05", "manutenzione")
+    assert track.find_overlap("2024-07-04", "2024-07-06") == ("a", "manutenzione")
+    assert track.find_overlap("2024-06-28", "2024-07-02") == ("a", "manutenzione")
+    assert track.find_overlap("2024-07-02", "2024-07-03") == ("a", "manutenzione")
+    # Partenza il giorno dell'arrivo successivo e viceversa: nessun conflitto
+    assert track.find_overlap("2024-07-05", "2024-07-08") is None
+    assert track.find_overlap("2024-06-25", "2024-07-01") is None
+
+
+def test_long_interval_hidden_behind_later_starts_is_found():
+    track = server._IntervalTrack()
+    track.put("long", "2024-01-01", "2024-12-31")
+    track.put("short1", "2024-03-01", "2024-03-02")
+    track.put("short2", "2024-05-01", "2024-05-02")
+    assert track.find_overlap("2024-08-01", "2024-08-03")[0] == "long"
+
+
+def test_put_and_discard_recompile():
+    track = server._IntervalTrack()
+    assert track.find_overlap("2024-07-01", "2024-07-02") is None
+    track.put("a", "2024-07-01", "2024-07-03")
+    assert track.find_overlap("2024-07-01", "2024-07-02")[0] == "a"
+    track.put("a", "2024-08-01", "2024-08-03")  # date spostate
+    assert track.find_overlap("2024-07-01", "2024-07-02") is None
+    assert track.discard("a") is True
+    assert track.discard("a") is False
+    assert track.find_overlap("2024-08-01", "2024-08-02") is None
+
+
+def test_matches_brute_force():
+    rng = random.Random(7)
+    track = server._IntervalTrack()
+    intervals = {}
+    for i in range(200):
+        start = rng.randrange(0, 360)
+        intervals[f"i{i}"] = (day(start), day(start + rng.randrange(1, 15)))
+        track.put(f"i{i}", *intervals[f"i{i}"])
+        if rng.random() < 0.2:
+            victim = rng.choice(sorted(intervals))
+            del intervals[victim]
+            track.discard(victim)
+    for _ in range(500):
+        start = rng.randrange(0, 370)
+        inizio, fine = day(start), day(start + rng.randrange(1, 10))
+        expected = {k for k, (s, e) in intervals.items() if s < fine and inizio < e}
+        hit = track.find_overlap(inizio, fine)
+        assert (hit is not None) == bool(expected)
+        if hit:
+            assert hit[0] in expected
+
+
+@pytest.fixture
+def index(fake_db):
+    fake_db(
+        units=[{"id": "u1"}, {"id": "u2"}],
+        bookings=[
+            {"id": "b1", "unit_id": "u1", "data_arrivo": "2024-07-01", "data_partenza": "2024-07-05", "status": "confirmed"},
+            {"id": "b2", "unit_id": "u1", "data_arrivo": "2024-07-10", "data_partenza": "2024-07-12", "status": "cancelled"},
+        ],
+        date_blocks=[
+            {"id": "x1", "unit_id": "u1", "data_inizio": "2024-08-01", "data_fine": "2024-08-03", "motivo": "Airbnb"},
+        ],
+    )
+    index = server.AvailabilityIndex()
+    asyncio.run(index.rebuild())
+    return index
+
+
+def test_index_conflicts_bookings_and_blocks(index):
+    conflict = lambda *args, **kw: asyncio.run(index.find_conflict(*args, **kw))
+    assert conflict("u1", "2024-07-03", "2024-07-04") == {"tipo": "booking", "id": "b1", "motivo": None}
+    assert conflict("u1", "2024-07-10", "2024-07-11") is None  # cancellata
+    assert conflict("u1", "2024-08-02", "2024-08-04") == {"tipo": "block", "id": "x1", "motivo": "Airbnb"}
+    assert conflict("u1", "2024-08-02", "2024-08-04", include_blocks=False) is None
+    assert conflict("u2", "2024-07-01", "2024-07-05") is None
+
+
+def test_index_follows_booking_writes(index):
+    booking = {"id": "b3", "unit_id": "u2", "data_arrivo": "2024-07-01", "data_partenza": "2024-07-03", "status": "pending"}
+    index.put_booking(booking)
+    assert asyncio.run(index.find_conflict("u2", "2024-07-02", "2024-07-03"))["id"] == "b3"
+    index.put_booking({**booking, "status": "cancelled"})
+    assert asyncio.run(index.find_conflict("u2", "2024-07-02", "2024-07-03")) is None
+    index.discard_booking("b1")
+    assert asyncio.run(index.night_status("u1", ["2024-07-01", "2024-07-02", "2024-08-01", "2024-08-02"])) == "FFX"
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def checkin_db(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "unit_names", server.UnitNameMap())
+    return fake_db(
+        units=[{"id": "u1", "nome": "Casetta Ulivo"}],
+        bookings=[{"id": "b1", "unit_id": "u1", "nome_ospite": "Mario Rossi",
+                   "data_arrivo": "2024-07-01", "data_partenza": "2024-07-03", "status": "confirmed"}],
+        guests=[{"id": "g1", "nome": "Mario", "cognome": "Rossi"}],
+        checkins=[{"id": "c1", "booking_id": "b1", "guest_id": "g1", "status": "pending"}],
+        online_checkins=[{"id": "o1", "booking_id": "b1", "status": "pending"}],
+        checkin_view=[
+            {"id": "c1", "source": "form", "guest_nome": "Vecchio nome", "unit_nome": None},
+            {"id": "deleted", "source": "form"},
+        ],
+    )
+
+
+def test_rebuild_replaces_rows_and_removes_only_stale_ones(checkin_db):
+    assert asyncio.run(server.checkin_view.rebuild()) == 2
+    rows = {d["id"]: d for d in checkin_db.checkin_view.docs}
+    assert sorted(rows) == ["c1", "o1"]
+    assert rows["c1"]["guest_nome"] == "Mario Rossi"
+    assert rows["c1"]["unit_nome"] == rows["o1"]["unit_nome"] == "Casetta Ulivo"
+    assert rows["o1"]["data_arrivo"] == "2024-07-01"
+
+
+def test_rebuild_keeps_rows_written_meanwhile(checkin_db, monkeypatch):
+    attach = server.unit_names.attach
+
+    async def racing_attach(docs, *args, **kwargs):
+        # Un check-in arriva mentre la vista viene ricostruita
+        await checkin_db.checkin_view.insert_one({"id": "new", "source": "online"})
+        return await attach(docs, *args, **kwargs)
+
+    monkeypatch.setattr(server.unit_names, "attach", racing_attach)
+    asyncio.run(server.checkin_view.rebuild())
+    assert sorted(d["id"] for d in checkin_db.checkin_view.docs) == ["c1", "new", "o1"]
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def iso(**delta):
+    return (datetime.now(timezone.utc) + timedelta(**delta)).isoformat()
+
+
+def message(message_id, status, **extra):
+    return {"id": message_id, "to": "ospite@example.com", "subject": "s", "body": "b",
+            "status": status, "attempts": 0, "next_attempt_at": iso(minutes=-1), **extra}
+
+
+def status_of(fake, message_id):
+    return next(d for d in fake.email_queue.docs if d["id"] == message_id)
+
+
+def test_claim_skips_messages_with_a_live_lease(fake_db):
+    lease = server.EMAIL_CLAIM_LEASE_SECONDS
+    db = fake_db(email_queue=[
+        message("pending", "pending"),
+        message("future", "pending", next_attempt_at=iso(minutes=5)),
+        message("in-flight", "sending", claimed_at=iso(seconds=-10)),
+        message("expired", "sending", claimed_at=iso(seconds=-lease - 10)),
+        message("legacy", "sending"),
+        message("done", "sent"),
+    ])
+    claimed = asyncio.run(server.EmailOutbox()._claim_batch())
+    assert sorted(d["id"] for d in claimed) == ["expired", "legacy", "pending"]
+    assert all(d["claimed_at"] == claimed[0]["claimed_at"] for d in claimed)
+    assert status_of(db, "in-flight")["claimed_at"] < claimed[0]["claimed_at"]
+
+
+def test_result_is_ignored_after_lease_was_taken_over(fake_db):
+    outbox = server.EmailOutbox()
+    outbox._send_batch = lambda messages: [None] * len(messages)
+    db = fake_db(email_queue=[message("m", "pending")])
+
+    async def scenario():
+        [doc] = await outbox._claim_batch()
+        # Un altro worker riprende il messaggio con un nuovo lease
+        await server.db.email_queue.update_one({"id": "m"}, {"$set": {"claimed_at": iso(seconds=1)}})
+        await outbox._deliver([doc])
+        outbox._executor.shutdown()
+
+    asyncio.run(scenario())
+    assert status_of(db, "m")["status"] == "sending"
+
+
+def test_failed_send_is_rescheduled(fake_db):
+    outbox = server.EmailOutbox()
+    outbox._send_batch = lambda messages: ["timeout"] * len(messages)
+    db = fake_db(email_queue=[message("m", "pending")])
+
+    async def scenario():
+        await outbox._deliver(await outbox._claim_batch())
+        outbox._executor.shutdown()
+
+    asyncio.run(scenario())
+    doc = status_of(db, "m")
+    assert (doc["status"], doc["attempts"], doc["error"]) == ("pending", 1, "timeout")
+    assert doc["next_attempt_at"] > iso()
@@ -0,0 +1,73 @@
+import asyncio
+
+import server
+
+
+def guest(guest_id, nome, cognome, email, **extra):
+    doc = {"id": guest_id, "nome": nome, "cognome": cognome, "email": email, **extra}
+    doc.update(server.guest_search_fields(doc))
+    return doc
+
+
+def test_fold_search_text_strips_accents_and_punctuation():
+    assert server.fold_search_text("Nicolò D'Amico") == ["nicolo", "d", "amico"]
+    assert server.fold_search_text("ÉLODIE  Müller-Ström") == ["elodie", "muller", "strom"]
+    assert server.fold_search_text(None) == []
+
+
+def test_guest_search_fields_tokens_and_prefixes():
+    fields = server.guest_search_fields({"nome": "Nicolò", "cognome": "D'Amico", "email": "Nico.DAmico@Mail.it"})
+    assert fields["search_tokens"] == sorted({"nicolo", "d", "amico", "damico", "nico", "mail", "it", "nicodamico"})
+    prefixes = set(fields["search_prefixes"])
+    assert {"ni", "nic", "nicolo", "da", "dam", "am"} <= prefixes
+    # Nessun prefisso di una lettera
+    assert all(len(p) >= server.GUEST_SEARCH_MIN_PREFIX for p in prefixes)
+
+
+def test_guest_search_fields_caps_prefix_length():
+    fields = server.guest_search_fields({"nome": "Bartolomeoantonio", "cognome": "", "email": ""})
+    assert max(len(p) for p in fields["search_prefixes"]) == server.GUEST_SEARCH_MAX_PREFIX
+    assert "bartolomeoantonio" in fields["search_tokens"]
+
+
+def test_rank_guest_match_prefers_name_over_email():
+    rossi = guest("1", "Mario", "Rossi", "m@x.it")
+    rossini = guest("2", "Luca", "Rossini", "l@x.it")
+    by_email = guest("3", "Anna", "Bianchi", "rossi@x.it")
+    assert server.rank_guest_match(rossi, ["rossi"]) == 4
+    assert server.rank_guest_match(rossini, ["rossi"]) == 3
+    assert server.rank_guest_match(by_email, ["rossi"]) == 2
+    assert server.rank_guest_match(guest("4", "Anna", "Bianchi", "rossignoli@x.it"), ["rossi"]) == 1
+    assert server.rank_guest_match(rossi, ["rossi", "verdi"]) is None
+
+
+def search(q):
+    return asyncio.run(server.admin_search_guests(q=q, admin={}))
+
+
+def test_search_orders_by_rank_and_hides_admins(fake_db):
+    fake_db(guests=[
+        guest("1", "Luca", "Rossini", "l@x.it"),
+        guest("2", "Mario", "Rossi", "m@x.it"),
+        guest("3", "Anna", "Bianchi", "rossi@x.it"),
+        guest("4", "Admin", "Rossi", "admin@x.it", is_admin=True),
+    ])
+    assert [g["id"] for g in search("rossi")] == ["2", "1", "3"]
+    assert search("r") == []
+
+
+def test_exact_matches_survive_candidate_limit(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "GUEST_SEARCH_CANDIDATES", 5)
+    # Molti prefissi inseriti prima: senza la ricerca esatta riempirebbero tutti i candidati
+    fake_db(guests=[
+        *(guest(f"p{i}", "Luca", f"Rossini{i}", f"l{i}@x.it") for i in range(10)),
+        guest("exact", "Mario", "Rossi", "m@x.it"),
+    ])
+    results = search("rossi")
+    assert results[0]["id"] == "exact"
+    assert len(results) == 5
+
+
+def test_search_accepts_accents_and_joined_names(fake_db):
+    fake_db(guests=[guest("1", "Nicolò", "D'Amico", "n@x.it")])
+    assert [g["nome_completo"] for g in search("nicolo damico")] == ["Nicolò D'Amico"]
@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import server
+
+FEED = {"id": "f1", "unit_id": "u1", "nome": "Airbnb", "url": "https://x"}
+
+
+def update(data):
+    return asyncio.run(server.admin_update_ical_feed("f1", data, admin={}))
+
+
+@pytest.mark.parametrize("value, expected", [(30, 30), ("45", 45), (60.0, 60), (2, 5), (None, None), ("", None), (0, None)])
+def test_update_interval_accepts_whole_minutes(fake_db, value, expected):
+    fake_db(ical_feeds=[FEED])
+    assert update({"intervallo_minuti": value})["intervallo_minuti"] == expected
+
+
+@pytest.mark.parametrize("value", ["abc", 12.5, "1e400", True, [10], {"m": 1}])
+def test_update_interval_rejects_invalid_values(fake_db, value):
+    fake_db(ical_feeds=[FEED])
+    with pytest.raises(HTTPException) as exc:
+        update({"intervallo_minuti": value})
+    assert exc.value.status_code == 400
+
+
+FEED_BODY = "\r\n".join([
+    "BEGIN:VCALENDAR",
+    "BEGIN:VEVENT", "UID:past", "DTSTART;VALUE=DATE:20200101", "DTEND;VALUE=DATE:20200103", "END:VEVENT",
+    "BEGIN:VEVENT", "UID:future", "DTSTART;VALUE=DATE:20990101", "DTEND;VALUE=DATE:20990103", "END:VEVENT",
+    "END:VCALENDAR", ""
+])
+
+
+def test_not_modified_sync_reports_events_of_last_full_read(fake_db, monkeypatch):
+    db = fake_db(ical_feeds=[FEED])
+
+    def handler(request):
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=FEED_BODY, headers={"etag": '"v1"'})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(server, "get_ical_http_client", lambda: client)
+
+    async def sync_twice():
+        first = await server.sync_ical_feed(await server.db.ical_feeds.find_one({"id": "f1"}, {"_id": 0}))
+        second = await server.sync_ical_feed(await server.db.ical_feeds.find_one({"id": "f1"}, {"_id": 0}))
+        await client.aclose()
+        return first, second
+
+    first, second = asyncio.run(sync_twice())
+    # Due eventi nel calendario, uno solo ancora da bloccare
+    assert (first["eventi_trovati"], first["nuovi_blocchi"], first["non_modificato"]) == (2, 1, False)
+    assert (second["eventi_trovati"], second["nuovi_blocchi"], second["non_modificato"]) == (2, 0, True)
+    assert db.ical_feeds.docs[0]["eventi_importati"] == 1
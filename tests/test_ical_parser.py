@@ -0,0 +1,107 @@
+from server import (
+    ICalStreamParser, dedupe_ical_events, iter_ical_events, parse_ical_content, parse_ical_date,
+)
+
+
+def vevent(*props):
+    return "\r\n".join(["BEGIN:VEVENT", *props, "END:VEVENT"])
+
+
+def calendar(*events):
+    return "\r\n".join(["BEGIN:VCALENDAR", "VERSION:2.0", *events, "END:VCALENDAR"]) + "\r\n"
+
+
+def chunks_of(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_parse_ical_date_value_date():
+    assert parse_ical_date("20240701", {"VALUE": "DATE"}) == "2024-07-01"
+    assert parse_ical_date("20240701") == "2024-07-01"
+
+
+def test_parse_ical_date_utc_is_converted_to_property_timezone():
+    # 23:30 UTC del 30 giugno è già il 1 luglio a Roma (UTC+2)
+    assert parse_ical_date("20240630T233000Z") == "2024-07-01"
+    assert parse_ical_date("20240630T200000Z") == "2024-06-30"
+
+
+def test_parse_ical_date_tzid():
+    # 20:00 a New York (UTC-4) sono le 02:00 del giorno dopo a Roma
+    assert parse_ical_date("20240630T200000", {"TZID": "America/New_York"}) == "2024-07-01"
+    # TZID sconosciuto: usata come ora locale
+    assert parse_ical_date("20240630T200000", {"TZID": "Custom/Zone"}) == "2024-06-30"
+
+
+def test_parse_ical_date_invalid():
+    assert parse_ical_date("not-a-date") is None
+
+
+def test_folded_lines_split_across_chunk_boundaries():
+    content = calendar(vevent(
+        "UID:fold@test",
+        "DTSTART;VALUE=DATE:20240701",
+        "DTEND;VALUE=DATE:20240705",
+        "SUMMARY:Prenotazione con un titolo\r\n  ripiegato\r\n\tdue volte",
+    ))
+    expected = parse_ical_content(content)
+    assert expected[0]["summary"] == "Prenotazione con un titolo ripiegatodue volte"
+    for size in (1, 2, 3, 7, 16, 64):
+        assert dedupe_ical_events(iter_ical_events(chunks_of(content, size))) == expected
+
+
+def test_parser_returns_events_as_they_close():
+    parser = ICalStreamParser()
+    first = vevent("UID:a", "DTSTART;VALUE=DATE:20240701", "DTEND;VALUE=DATE:20240702")
+    assert parser.feed("BEGIN:VCALENDAR\r\n" + first[:20]) == []
+    # END:VEVENT si chiude solo alla riga successiva (potrebbe essere ripiegata)
+    assert parser.feed(first[20:] + "\r\n") == []
+    events = parser.feed("END:VCALENDAR\r\n")
+    assert [e["uid"] for e in events] == ["a"]
+    assert parser.close() == []
+
+
+def test_missing_or_invalid_dtend_covers_one_night():
+    events = parse_ical_content(calendar(
+        vevent("UID:a", "DTSTART;VALUE=DATE:20240701"),
+        vevent("UID:b", "DTSTART;VALUE=DATE:20240710", "DTEND;VALUE=DATE:20240709"),
+    ))
+    assert {e["uid"]: e["end"] for e in events} == {"a": "2024-07-02", "b": "2024-07-11"}
+
+
+def test_cancelled_events_are_skipped():
+    events = parse_ical_content(calendar(
+        vevent("UID:keep", "DTSTART;VALUE=DATE:20240701", "DTEND;VALUE=DATE:20240703"),
+        vevent("UID:gone", "DTSTART;VALUE=DATE:20240705", "DTEND;VALUE=DATE:20240707", "STATUS:CANCELLED"),
+        vevent("DTSTART;VALUE=DATE:20240710", "DTEND;VALUE=DATE:20240712", "STATUS:CANCELLED"),
+    ))
+    assert [e["uid"] for e in events] == ["keep"]
+
+
+def test_dedupe_keeps_highest_sequence():
+    events = dedupe_ical_events([
+        {"uid": "x", "sequence": 2, "start": "2024-07-05", "end": "2024-07-08"},
+        {"uid": "x", "sequence": 1, "start": "2024-07-01", "end": "2024-07-03"},
+        {"uid": "y", "sequence": 0, "start": "2024-08-01", "end": "2024-08-02"},
+        {"uid": "y", "sequence": 0, "start": "2024-08-03", "end": "2024-08-04"},
+    ])
+    by_uid = {e["uid"]: e["start"] for e in events}
+    # SEQUENCE più alto vince anche se arriva prima; a parità vince l'ultimo
+    assert by_uid == {"x": "2024-07-05", "y": "2024-08-03"}
+
+
+def test_dedupe_cancellation_with_higher_sequence_removes_uid():
+    events = dedupe_ical_events([
+        {"uid": "x", "sequence": 0, "start": "2024-07-01", "end": "2024-07-03"},
+        {"uid": "x", "sequence": 1, "status": "CANCELLED", "start": "2024-07-01", "end": "2024-07-03"},
+        {"uid": "x", "sequence": 0, "start": "2024-07-01", "end": "2024-07-03"},
+    ])
+    assert events == []
+
+
+def test_events_without_uid_are_kept():
+    events = dedupe_ical_events([
+        {"start": "2024-07-01", "end": "2024-07-02"},
+        {"start": "2024-07-01", "end": "2024-07-02"},
+    ])
+    assert len(events) == 2
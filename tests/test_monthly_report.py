@@ -0,0 +1,74 @@
+import asyncio
+
+import server
+
+UNITS = [{"id": "u1", "attivo": True}, {"id": "u2", "attivo": True}]
+
+
+def add_booking(fake, booking_id, arrival, departure, price, status="confirmed", unit="u1"):
+    doc = {"id": booking_id, "unit_id": unit, "data_arrivo": arrival, "data_partenza": departure,
+           "prezzo_totale": price, "status": status, "nome_ospite": booking_id, "note": ""}
+    fake.bookings.docs.append(dict(doc))
+    asyncio.run(server.occupancy.sync_booking(doc))
+
+
+def test_report_counts_only_nights_inside_the_month(fake_db):
+    db = fake_db(units=UNITS)
+    # 2 notti a giugno + 2 a luglio, 400€ -> 200€ di competenza di luglio
+    add_booking(db, "a", "2024-06-29", "2024-07-03", 400)
+    # Tutta a luglio
+    add_booking(db, "b", "2024-07-10", "2024-07-13", 300, unit="u2")
+    # Inizia a luglio, finisce ad agosto: 1 notte a luglio
+    add_booking(db, "c", "2024-07-31", "2024-08-02", 200)
+    add_booking(db, "d", "2024-07-05", "2024-07-06", 999, status="cancelled")
+    add_booking(db, "e", "2024-07-20", "2024-07-22", 500, status="pending")
+
+    report = asyncio.run(server.admin_get_monthly_report(admin={}, month="2024-07"))
+    summary = report["summary"]
+    assert summary["total_nights"] == 2 + 3 + 1
+    assert summary["total_revenue"] == 200 + 300 + 100
+    assert summary["total_bookings"] == 2  # arrivi del mese confermati: b e c
+    assert summary["cancelled_bookings"] == 1
+    assert summary["average_stay"] == 2.5
+    assert summary["occupancy_rate"] == round(6 / (31 * 2) * 100, 1)
+    assert [d["nome_ospite"] for d in report["bookings"]] == ["b", "c"]
+    assert report["daily_occupancy"][0] == {"day": 1, "occupied": 1, "blocked": 0}
+
+
+def test_monthly_totals_split_stays_by_night(fake_db):
+    db = fake_db(units=UNITS)
+    add_booking(db, "a", "2024-06-29", "2024-07-03", 400)
+    add_booking(db, "b", "2024-07-10", "2024-07-13", 300, unit="u2")
+    add_booking(db, "e", "2024-07-20", "2024-07-22", 500, status="pending")
+
+    months = asyncio.run(server.occupancy.monthly("2024-06-01", "2024-08-01", ["confirmed", "completed"]))
+    assert {key: (row["bookings"], row["nights"], row["revenue"]) for key, row in months.items()} == {
+        "2024-06": (1, 2, 200), "2024-07": (2, 5, 500),
+    }
+
+
+def test_rebuild_upserts_and_removes_only_stale_rows(fake_db):
+    db = fake_db(
+        units=UNITS,
+        date_blocks=[{"id": "x1", "unit_id": "u2", "data_inizio": "2024-07-01", "data_fine": "2024-07-02"}],
+        occupancy_daily=[
+            {"unit_id": "u1", "date": "2024-07-01", "kind": "booking", "ref_id": "gone", "status": "confirmed"},
+        ],
+    )
+    add_booking(db, "a", "2024-07-01", "2024-07-03", 200)
+    synced = {d["_id"] for d in db.occupancy_daily.docs if d["ref_id"] == "a"}
+
+    assert asyncio.run(server.occupancy.rebuild()) == 3
+    assert sorted(d["_id"] for d in db.occupancy_daily.docs) == [
+        "block|x1|2024-07-01", "booking|a|2024-07-01", "booking|a|2024-07-02",
+    ]
+    assert synced <= {d["_id"] for d in db.occupancy_daily.docs}
+
+
+def test_sync_replaces_rows_of_moved_booking(fake_db):
+    db = fake_db(units=UNITS)
+    add_booking(db, "a", "2024-07-01", "2024-07-03", 200)
+    add_booking(db, "a", "2024-07-02", "2024-07-04", 300)
+    assert sorted((d["_id"], d["revenue"]) for d in db.occupancy_daily.docs) == [
+        ("booking|a|2024-07-02", 150), ("booking|a|2024-07-03", 150),
+    ]
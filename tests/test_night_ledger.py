@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.fake_mongo import FakeCollection
+
+
+def booking(booking_id, arrival, departure, unit="u1", status="confirmed"):
+    return {"id": booking_id, "unit_id": unit, "data_arrivo": arrival,
+            "data_partenza": departure, "status": status}
+
+
+def nights(fake, booking_id=None):
+    return sorted(d["_id"] for d in fake.unit_nights.docs if booking_id is None or d["booking_id"] == booking_id)
+
+
+def test_sync_reserves_each_night(fake_db):
+    db = fake_db()
+    asyncio.run(server.NightLedger().sync(booking("b1", "2024-07-01", "2024-07-04"), new=True))
+    assert nights(db) == ["u1|2024-07-01", "u1|2024-07-02", "u1|2024-07-03"]
+
+
+def test_overlapping_booking_is_rejected_and_rolled_back(fake_db):
+    db = fake_db()
+    ledger = server.NightLedger()
+
+    async def scenario():
+        await ledger.sync(booking("b1", "2024-07-03", "2024-07-05"), new=True)
+        with pytest.raises(HTTPException) as exc:
+            await ledger.sync(booking("b2", "2024-07-01", "2024-07-04"), new=True)
+        return exc.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 409
+    # Le notti libere inserite da b2 prima del conflitto vengono rimosse
+    assert nights(db, "b2") == []
+    assert nights(db, "b1") == ["u1|2024-07-03", "u1|2024-07-04"]
+
+
+def test_other_units_and_adjacent_stays_do_not_conflict(fake_db):
+    db = fake_db()
+    ledger = server.NightLedger()
+
+    async def scenario():
+        await ledger.sync(booking("b1", "2024-07-01", "2024-07-04"), new=True)
+        await ledger.sync(booking("b2", "2024-07-04", "2024-07-06"), new=True)
+        await ledger.sync(booking("b3", "2024-07-01", "2024-07-04", unit="u2"), new=True)
+
+    asyncio.run(scenario())
+    assert len(nights(db)) == 8
+
+
+def test_date_change_moves_nights_and_cancellation_releases(fake_db):
+    db = fake_db()
+    ledger = server.NightLedger()
+
+    async def scenario():
+        await ledger.sync(booking("b1", "2024-07-01", "2024-07-04"), new=True)
+        await ledger.sync(booking("b1", "2024-07-03", "2024-07-05"))
+        moved = nights(db, "b1")
+        await ledger.sync(booking("b1", "2024-07-03", "2024-07-05", status="cancelled"))
+        return moved
+
+    assert asyncio.run(scenario()) == ["u1|2024-07-03", "u1|2024-07-04"]
+    assert nights(db) == []
+
+
+def test_release_and_release_many(fake_db):
+    db = fake_db()
+    ledger = server.NightLedger()
+
+    async def scenario():
+        for i, unit in enumerate(["u1", "u2", "u3"]):
+            await ledger.sync(booking(f"b{i}", "2024-07-01", "2024-07-03", unit=unit), new=True)
+        await ledger.release("b0")
+        await ledger.release_many(["b1"])
+
+    asyncio.run(scenario())
+    assert nights(db) == ["u3|2024-07-01", "u3|2024-07-02"]
+
+
+def test_rebuild_upserts_and_removes_only_stale_rows(fake_db):
+    db = fake_db(
+        bookings=[
+            booking("b1", "2024-07-01", "2024-07-03"),
+            booking("b2", "2024-07-02", "2024-07-04"),
+            booking("b3", "2024-07-10", "2024-07-11", status="cancelled"),
+        ],
+        unit_nights=[
+            {"_id": "u1|2024-07-01", "unit_id": "u1", "date": "2024-07-01", "booking_id": "old"},
+            {"_id": "u1|2024-07-10", "unit_id": "u1", "date": "2024-07-10", "booking_id": "b3"},
+        ],
+    )
+    result = asyncio.run(server.NightLedger().rebuild())
+    assert result == {"notti": 3, "sovrapposizioni": 1}
+    assert {d["_id"]: d["booking_id"] for d in db.unit_nights.docs} == {
+        "u1|2024-07-01": "b1", "u1|2024-07-02": "b1", "u1|2024-07-03": "b2",
+    }
+
+
+def test_insert_booking_regenerates_duplicate_code(fake_db, monkeypatch):
+    db = fake_db(bookings=FakeCollection([{"id": "old", "codice_prenotazione": "AAA"}], unique=("codice_prenotazione",)))
+    codes = iter(["AAA", "BBB"])
+    monkeypatch.setattr(server, "generate_booking_code", lambda: next(codes))
+    doc = {"id": "new", "codice_prenotazione": "AAA"}
+    asyncio.run(server.insert_booking(doc))
+    assert doc["codice_prenotazione"] == "BBB"
+    assert [d["codice_prenotazione"] for d in db.bookings.docs] == ["AAA", "BBB"]
+
+
+def test_insert_booking_gives_up_after_attempts(fake_db, monkeypatch):
+    fake_db(bookings=FakeCollection([{"id": "old", "codice_prenotazione": "AAA"}], unique=("codice_prenotazione",)))
+    monkeypatch.setattr(server, "generate_booking_code", lambda: "AAA")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.insert_booking({"id": "new", "codice_prenotazione": "AAA"}))
+    assert exc.value.status_code == 503
+
+
+@pytest.fixture
+def status_db(fake_db, monkeypatch):
+    """b1 annullata sulle notti che b2 ha occupato nel frattempo, b3 confermata altrove"""
+    monkeypatch.setattr(server, "availability_index", server.AvailabilityIndex())
+    db = fake_db(bookings=[
+        booking("b1", "2024-07-01", "2024-07-03", status="cancelled"),
+        booking("b2", "2024-07-02", "2024-07-04"),
+        booking("b3", "2024-07-10", "2024-07-12"),
+    ])
+    asyncio.run(server.night_ledger.rebuild())
+    return db
+
+
+def status_of(fake, booking_id):
+    return next(d["status"] for d in fake.bookings.docs if d["id"] == booking_id)
+
+
+def test_status_change_reserves_nights_before_updating(status_db):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.admin_update_booking_status("b1", "confirmed", admin={}))
+    assert exc.value.status_code == 409
+    assert status_of(status_db, "b1") == "cancelled"
+    assert nights(status_db, "b1") == []
+
+    asyncio.run(server.admin_update_booking_status("b3", "cancelled", admin={}))
+    assert status_of(status_db, "b3") == "cancelled"
+    assert nights(status_db, "b3") == []
+
+
+def test_concurrent_status_change_is_not_overwritten(status_db, monkeypatch):
+    update = status_db.bookings.find_one_and_update
+
+    async def racing_update(query, *args, **kwargs):
+        # Un'altra richiesta rimette la prenotazione in attesa tra la lettura e l'aggiornamento
+        await status_db.bookings.update_one({"id": "b3"}, {"$set": {"status": "pending"}})
+        return await update(query, *args, **kwargs)
+
+    monkeypatch.setattr(status_db.bookings, "find_one_and_update", racing_update)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.admin_update_booking_status("b3", "cancelled", admin={}))
+    assert exc.value.status_code == 409
+    assert status_of(status_db, "b3") == "pending"
+    assert nights(status_db, "b3") == ["u1|2024-07-10", "u1|2024-07-11"]
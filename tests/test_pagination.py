@@ -0,0 +1,105 @@
+import asyncio
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.fake_mongo import FakeCollection
+
+
+def test_cursor_round_trip():
+    cursor = server.encode_cursor("2024-07-01T10:00:00+00:00", "abc")
+    assert server.decode_cursor(cursor) == ("2024-07-01T10:00:00+00:00", "abc")
+    assert server.decode_cursor(server.encode_cursor(None, "abc")) == (None, "abc")
+
+
+@pytest.mark.parametrize("cursor", [
+    "%%%",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(json.dumps(["2024-07-01", 5]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps([1, "abc"]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps(["a", "b", "c"]).encode()).decode(),
+    base64.urlsafe_b64encode(json.dumps({"a": 1}).encode()).decode(),
+])
+def test_invalid_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as exc:
+        server.decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_fields_projection_keeps_cursor_keys_and_hides_private_fields():
+    assert server.fields_projection("nome, password_hash,$where", hidden=("password_hash",)) == {
+        "_id": 0, "id": 1, "created_at": 1, "nome": 1
+    }
+    assert server.fields_projection(None, hidden=("password_hash",)) == {"_id": 0, "password_hash": 0}
+
+
+def walk(collection, limit, query=None):
+    pages, cursor = [], None
+    while True:
+        docs, cursor = asyncio.run(server.keyset_page(collection, query or {}, limit, cursor))
+        pages.append([d["id"] for d in docs])
+        if not cursor:
+            return pages
+
+
+def test_pages_cover_ties_on_created_at_and_missing_dates():
+    docs = [{"id": f"{i:02d}", "created_at": "2024-07-01T10:00:00"} for i in range(7)]
+    docs += [{"id": f"{i:02d}", "created_at": "2024-07-02T10:00:00"} for i in range(7, 10)]
+    docs += [{"id": f"{i:02d}"} for i in range(10, 14)]  # senza created_at
+    docs += [{"id": "14", "created_at": None}]
+    collection = FakeCollection(docs)
+    expected = ["09", "08", "07", "06", "05", "04", "03", "02", "01", "00", "14", "13", "12", "11", "10"]
+    for limit in (1, 2, 3, 4, 15, 50):
+        pages = walk(collection, limit)
+        assert [doc_id for page in pages for doc_id in page] == expected
+        assert all(len(page) <= limit for page in pages)
+
+
+def test_page_combines_with_filter():
+    collection = FakeCollection([
+        {"id": str(i), "created_at": f"2024-07-0{i % 3 + 1}", "status": "pending" if i % 2 else "confirmed"}
+        for i in range(10)
+    ])
+    pages = walk(collection, 2, {"status": "pending"})
+    assert sorted(doc_id for page in pages for doc_id in page) == ["1", "3", "5", "7", "9"]
+
+
+def test_limit_is_clamped():
+    collection = FakeCollection([{"id": str(i), "created_at": "2024-07-01"} for i in range(3)])
+    docs, cursor = asyncio.run(server.keyset_page(collection, {}, 0))
+    assert len(docs) == 1 and cursor is not None
+
+
+BOOKING = {"id": "b1", "unit_id": "u1", "data_arrivo": "2024-07-01", "data_partenza": "2024-07-03",
+           "num_ospiti": 2, "prezzo_totale": 200.0, "status": "confirmed", "nome_ospite": "Mario",
+           "email_ospite": "m@x.it", "telefono_ospite": "", "created_at": "2024-06-01T10:00:00+00:00",
+           "ical_uid": "interno", "guest_note_private": "non per l'elenco"}
+
+
+def page_body(response):
+    return json.loads(response.body)
+
+
+def test_paged_route_applies_its_response_model(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "unit_names", server.UnitNameMap())
+    fake_db(units=[{"id": "u1", "nome": "Casetta 1"}],
+            bookings=[BOOKING, {**BOOKING, "id": "b2", "created_at": "2024-06-02T10:00:00+00:00"}])
+    response = asyncio.run(server.admin_get_bookings(admin={}, limit=1, cursor=None, fields=None, count=True))
+    rows = page_body(response)
+    assert [row["id"] for row in rows] == ["b2"]
+    assert set(rows[0]) == set(server.BookingResponse.model_fields)
+    assert rows[0]["unit_nome"] == "Casetta 1"
+    assert response.headers["x-total-count"] == "2"
+    assert response.headers["x-next-cursor"]
+
+
+def test_projected_page_keeps_only_model_fields(fake_db, monkeypatch):
+    monkeypatch.setattr(server, "unit_names", server.UnitNameMap())
+    fake_db(bookings=[BOOKING])
+    response = asyncio.run(server.admin_get_bookings(admin={}, limit=10, cursor=None,
+                                                     fields="nome_ospite,ical_uid", count=False))
+    assert page_body(response) == [{"id": "b1", "created_at": BOOKING["created_at"], "nome_ospite": "Mario"}]
+    assert "x-next-cursor" not in response.headers
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import server
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = server.PrincipalCache(max_size=10, ttl_seconds=60)
+    cache.put({"id": "g1", "nome": "Mario"})
+    clock.now += 59
+    assert cache.get("g1") == {"id": "g1", "nome": "Mario"}
+    clock.now += 2
+    assert cache.get("g1") is None
+    assert cache.stats()["size"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = server.PrincipalCache(max_size=2, ttl_seconds=60)
+    cache.put({"id": "a"})
+    cache.put({"id": "b"})
+    cache.get("a")  # "b" diventa il meno recente
+    cache.put({"id": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_invalidate_one_or_all(clock):
+    cache = server.PrincipalCache(max_size=10, ttl_seconds=60)
+    for guest_id in ("a", "b", "c"):
+        cache.put({"id": guest_id})
+    cache.invalidate("a")
+    assert cache.get("a") is None and cache.get("b") is not None
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
+
+
+def test_returned_documents_are_copies(clock):
+    cache = server.PrincipalCache(max_size=10, ttl_seconds=60)
+    guest = {"id": "a", "is_admin": False}
+    cache.put(guest)
+    guest["is_admin"] = True
+    cache.get("a")["is_admin"] = True
+    assert cache.get("a")["is_admin"] is False
+
+
+@pytest.fixture
+def guest_db(fake_db, monkeypatch, clock):
+    monkeypatch.setattr(server, "principal_cache", server.PrincipalCache(max_size=10, ttl_seconds=60))
+    return fake_db(guests=[{"id": "g1", "nome": "Mario", "is_admin": False}])
+
+
+def current_user(guest_id):
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=server.create_token(guest_id))
+    return asyncio.run(server.get_current_user(credentials))
+
+
+def test_current_user_is_served_from_cache_until_invalidated(guest_db):
+    assert current_user("g1")["nome"] == "Mario"
+    guest_db.guests.docs[0]["nome"] = "Luigi"
+    assert current_user("g1")["nome"] == "Mario"
+    server.principal_cache.invalidate("g1")
+    assert current_user("g1")["nome"] == "Luigi"
+
+
+def test_deleted_user_is_rejected_after_invalidation(guest_db):
+    current_user("g1")
+    guest_db.guests.docs.clear()
+    server.principal_cache.invalidate("g1")
+    with pytest.raises(HTTPException) as exc:
+        current_user("g1")
+    assert exc.value.status_code == 401
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+import server
+from tests.test_rate_calendar import UNIT, iso, next_monday
+
+
+@pytest.fixture
+def unit_db(fake_db, monkeypatch):
+    """Unità con una prenotazione a inizio settimana e un blocco la settimana dopo"""
+    monday = next_monday()
+    monkeypatch.setattr(server, "rate_calendars", server.RateCalendarCache())
+    monkeypatch.setattr(server, "availability_index", server.AvailabilityIndex())
+    return fake_db(
+        units=[UNIT],
+        bookings=[{"id": "b1", "unit_id": "u1", "status": "confirmed",
+                   "data_arrivo": iso(monday), "data_partenza": iso(monday + timedelta(days=2))}],
+        date_blocks=[{"id": "x1", "unit_id": "u1", "motivo": "Airbnb",
+                      "data_inizio": iso(monday + timedelta(days=7)), "data_fine": iso(monday + timedelta(days=9))}],
+    )
+
+
+def quote(*items):
+    request = server.QuoteBatchRequest(items=[
+        {"unit_id": unit, "data_arrivo": arrivo, "data_partenza": partenza, "num_ospiti": ospiti}
+        for unit, arrivo, partenza, ospiti in items
+    ])
+    return asyncio.run(server.quote_batch(request))
+
+
+def test_each_item_is_priced_and_checked_independently(unit_db):
+    monday = next_monday()
+    day = lambda n: iso(monday + timedelta(days=n))
+    result = quote(
+        ("u1", day(2), day(4), 2),      # libero
+        ("u1", day(1), day(3), 2),      # prenotato
+        ("u1", day(8), day(10), 2),     # bloccato
+        ("u1", day(2), day(4), 5),      # troppi ospiti (capacità 4)
+        ("u1", day(4), day(4), 2),      # date non valide
+        ("u1", "2024-13-01", day(4), 2),
+        ("zz", day(2), day(4), 2),      # unità inesistente
+    )
+    quotes = result["quotes"]
+    assert result["count"] == 7
+    assert quotes[0]["disponibile"] and quotes[0]["prezzo"]["prezzo_totale"] == 200.0
+    assert (quotes[1]["disponibile"], quotes[1]["motivo"]) == (False, "Già prenotato")
+    assert (quotes[2]["disponibile"], quotes[2]["motivo"]) == (False, "Date bloccate")
+    assert quotes[3]["motivo"] == "Capacità massima: 4 ospiti"
+    assert [q["errore"] for q in quotes[4:]] == ["Date non valide", "Date non valide", "Unità non trovata"]
+    # Il preventivo coincide con quello dell'endpoint singolo
+    assert quotes[0]["prezzo"] == asyncio.run(server.get_unit_price("u1", day(2), day(4)))
+
+
+def test_calendar_is_compiled_once_per_batch(unit_db):
+    monday = next_monday()
+    quote(*[("u1", iso(monday + timedelta(days=i)), iso(monday + timedelta(days=i + 1)), 2) for i in range(20)])
+    assert server.rate_calendars.compiles == 1
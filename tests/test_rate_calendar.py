@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException, Request
+
+import server
+
+UNIT = {"id": "u1", "nome": "Casetta 1", "prezzo_base": 100.0, "prezzo_weekend": 130.0,
+        "capacita_max": 4, "attivo": True, "soggiorno_minimo": 1}
+
+
+def next_monday(weeks=1) -> datetime:
+    today = datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time())
+    return today + timedelta(days=7 * weeks - today.weekday())
+
+
+def iso(day: datetime) -> str:
+    return day.strftime("%Y-%m-%d")
+
+
+def test_weekend_nights_use_weekend_rate():
+    calendar = server.RateCalendar(UNIT, [], [])
+    monday = next_monday()
+    total, dettaglio = calendar.quote(monday, monday + timedelta(days=7))
+    # Lun-Gio base, Ven-Dom weekend
+    assert [n["prezzo"] for n in dettaglio] == [100.0] * 4 + [130.0] * 3
+    assert total == 4 * 100 + 3 * 130
+    assert dettaglio[4]["periodo"] == "Tariffa Weekend" and dettaglio[4]["is_weekend"]
+
+
+def test_first_period_wins_and_bounds_are_inclusive():
+    monday = next_monday()
+    periods = [
+        {"nome_periodo": "Alta", "data_inizio": iso(monday + timedelta(days=1)),
+         "data_fine": iso(monday + timedelta(days=2)), "prezzo_notte": 200.0, "soggiorno_minimo": 3},
+        {"nome_periodo": "Media", "data_inizio": iso(monday), "data_fine": iso(monday + timedelta(days=3)),
+         "prezzo_notte": 150.0},
+    ]
+    calendar = server.RateCalendar(UNIT, periods, [])
+    _, dettaglio = calendar.quote(monday, monday + timedelta(days=5))
+    assert [(n["prezzo"], n["periodo"]) for n in dettaglio] == [
+        (150.0, "Media"), (200.0, "Alta"), (200.0, "Alta"), (150.0, "Media"), (130.0, "Tariffa Weekend"),
+    ]
+    prices, min_stay = calendar.nights(monday, 5)
+    assert prices == [n["prezzo"] for n in dettaglio]
+    assert min_stay == [1, 3, 3, 1, 1]
+
+
+def test_quote_beyond_horizon_matches_direct_resolution():
+    periods = [{"nome_periodo": "Estate", "data_inizio": "2000-06-01", "data_fine": "2999-08-31", "prezzo_notte": 180.0,
+                "prezzo_weekend": 210.0}]
+    calendar = server.RateCalendar(UNIT, periods, [])
+    start = calendar.origin + timedelta(days=server.RATE_CALENDAR_HORIZON_DAYS - 3)
+    end = start + timedelta(days=7)
+    total, dettaglio = calendar.quote(start, end)
+    expected = [calendar._resolve(start + timedelta(days=i)) for i in range(7)]
+    assert [(n["data"], n["prezzo"], n["periodo"]) for n in dettaglio] == [e[:3] for e in expected]
+    assert total == sum(e[1] for e in expected)
+    assert calendar.nights(start, 7)[0] == [e[1] for e in expected]
+
+
+def test_compute_price_quote_applies_longest_matching_discount():
+    discounts = [{"giorni_minimo": 14, "sconto_percentuale": 20}, {"giorni_minimo": 7, "sconto_percentuale": 10}]
+    calendar = server.RateCalendar(UNIT, [], discounts)
+    monday = next_monday()
+    quote = server.compute_price_quote(calendar, iso(monday), iso(monday + timedelta(days=7)))
+    assert quote["num_notti"] == 7
+    assert quote["prezzo_base_totale"] == 790.0
+    assert (quote["sconto_percentuale"], quote["sconto_applicato"]) == (10, "Sconto 7+ notti")
+    assert quote["prezzo_totale"] == 711.0
+    short = server.compute_price_quote(calendar, iso(monday), iso(monday + timedelta(days=2)))
+    assert (short["sconto_percentuale"], short["prezzo_totale"]) == (0, 200.0)
+
+
+def test_compute_price_quote_rejects_empty_stay():
+    calendar = server.RateCalendar(UNIT, [], [])
+    day = iso(next_monday())
+    with pytest.raises(HTTPException) as exc:
+        server.compute_price_quote(calendar, day, day)
+    assert exc.value.status_code == 400
+
+
+def test_cache_compiles_once_until_invalidated(fake_db):
+    db = fake_db(units=[UNIT])
+    cache = server.RateCalendarCache()
+    first = asyncio.run(cache.get("u1"))
+    assert asyncio.run(cache.get("u1")) is first
+    assert cache.compiles == 1
+    db.units.docs[0]["prezzo_base"] = 90.0
+    cache.invalidate("u1")
+    assert asyncio.run(cache.get("u1")).prezzo_base == 90.0
+    assert cache.compiles == 2
+    assert asyncio.run(cache.get("missing")) is None
+
+
+def test_cache_recompiles_stale_calendar(fake_db):
+    fake_db(units=[UNIT])
+    cache = server.RateCalendarCache()
+    calendar = asyncio.run(cache.get("u1"))
+    calendar.origin -= timedelta(days=server.RATE_CALENDAR_MAX_AGE_DAYS + 1)
+    assert asyncio.run(cache.get("u1")) is not calendar
+    assert cache.compiles == 2
+
+
+def calendar_request(if_none_match=None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+def fresh_worker(monkeypatch):
+    # Ogni worker ha le proprie cache e i propri contatori di revisione
+    monkeypatch.setattr(server, "rate_calendars", server.RateCalendarCache())
+    monkeypatch.setattr(server, "availability_index", server.AvailabilityIndex())
+    monkeypatch.setattr(server, "unit_revisions", server.UnitRevisions())
+
+
+def test_calendar_of_unknown_unit_is_404_even_with_wildcard(fake_db, monkeypatch):
+    fake_db(units=[UNIT])
+    fresh_worker(monkeypatch)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(server.get_unit_calendar(calendar_request("*"), "missing", month="2024-07"))
+    assert exc.value.status_code == 404
+
+
+def test_calendar_etag_is_shared_across_workers(fake_db, monkeypatch):
+    db = fake_db(units=[UNIT])
+    fresh_worker(monkeypatch)
+    first = asyncio.run(server.get_unit_calendar(calendar_request(), "u1", month="2024-07"))
+    etag = first.headers["etag"]
+
+    fresh_worker(monkeypatch)
+    cached = asyncio.run(server.get_unit_calendar(calendar_request(etag), "u1", month="2024-07"))
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+
+    db.units.docs[0]["prezzo_base"] = 90.0
+    fresh_worker(monkeypatch)
+    changed = asyncio.run(server.get_unit_calendar(calendar_request(etag), "u1", month="2024-07"))
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
@@ -0,0 +1,68 @@
+import pytest
+
+import server
+
+
+@pytest.fixture
+def cache(clock):
+    return server.UnreadCountCache(max_size=3, ttl_seconds=60)
+
+
+def test_put_get_and_ttl(cache, clock):
+    cache.put("u1", 4)
+    assert cache.get("u1") == 4
+    clock.now += 61
+    assert cache.get("u1") is None
+
+
+def test_increment_updates_cached_entry_only(cache):
+    cache.put("u1", 4)
+    cache.increment("u1")
+    cache.increment("u2")  # non in cache: resta da calcolare
+    assert cache.get("u1") == 5
+    assert cache.get("u2") is None
+
+
+def test_count_computed_before_a_change_is_discarded(cache):
+    # Un ricalcolo parte, nel frattempo arriva una notifica: il risultato è già vecchio
+    generation = cache.generation
+    cache.increment("u1")
+    cache.put("u1", 2, generation)
+    assert cache.get("u1") is None
+    generation = cache.generation
+    cache.put("u1", 3, generation)
+    assert cache.get("u1") == 3
+
+
+def test_invalidate_and_epoch(cache):
+    cache.put("u1", 1)
+    cache.put("u2", 2)
+    generation = cache.generation
+    cache.invalidate("u1")
+    assert cache.get("u1") is None and cache.get("u2") == 2
+    cache.put("u1", 7, generation)  # calcolato prima dell'invalidazione
+    assert cache.get("u1") is None
+    cache.bump_epoch()
+    assert cache.get("u2") is None
+    cache.put("u2", 5)
+    assert cache.get("u2") == 5
+
+
+def test_lru_eviction(cache):
+    for i, user in enumerate(["a", "b", "c"]):
+        cache.put(user, i)
+    cache.get("a")
+    cache.put("d", 9)
+    assert cache.get("b") is None
+    assert [cache.get(u) for u in ("a", "c", "d")] == [0, 2, 9]
+
+
+def test_notification_created_routes_personal_and_broadcast(monkeypatch, clock):
+    cache = server.UnreadCountCache(max_size=10, ttl_seconds=60)
+    monkeypatch.setattr(server, "unread_counts", cache)
+    cache.put("u1", 1)
+    cache.put("u2", 1)
+    server.notification_created("u1")
+    assert (cache.get("u1"), cache.get("u2")) == (2, 1)
+    server.notification_created(None)
+    assert (cache.get("u1"), cache.get("u2")) == (None, None)